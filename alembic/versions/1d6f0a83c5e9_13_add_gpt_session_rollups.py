@@ -0,0 +1,110 @@
+"""13_add_gpt_session_rollups
+
+Revision ID: 1d6f0a83c5e9
+Revises: e7b29c5d1f38
+Create Date: 2026-10-16 18:47:12.660418
+
+"""
+from datetime import UTC, datetime, timedelta
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = "1d6f0a83c5e9"
+down_revision: Union[str, None] = "e7b29c5d1f38"
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+GRANULARITY = sa.Enum(
+    "HOUR", "DAY", "WEEK", name="sessionrollupgranularity", native_enum=False
+)
+# Mirrors SESSION_ROLLUP_USER_WINDOW and the partition premake in the app.
+USER_WINDOW_DAYS = 7
+PREMAKE_DAYS = 2
+BUCKETED_SESSIONS = """
+    SELECT
+        s.gpt_application_id,
+        g.granularity,
+        date_trunc(lower(g.granularity), s.created_at AT TIME ZONE 'UTC')
+            AT TIME ZONE 'UTC' AS bucket_start,
+        hashtextextended(lower(s.email), 0) AS user_hash
+    FROM gpt_session AS s
+    CROSS JOIN (VALUES ('HOUR'), ('DAY'), ('WEEK')) AS g(granularity)
+"""
+
+
+def upgrade() -> None:
+    op.create_table(
+        "gpt_session_rollup",
+        sa.Column("gpt_application_id", sa.Integer(), nullable=False),
+        sa.Column("granularity", GRANULARITY, nullable=False),
+        sa.Column("bucket_start", sa.DateTime(timezone=True), nullable=False),
+        sa.Column("session_count", sa.BigInteger(), nullable=False),
+        sa.Column("unique_users", sa.BigInteger(), nullable=False),
+        sa.ForeignKeyConstraint(
+            ["gpt_application_id"],
+            ["custom_gpt_application.id"],
+        ),
+        sa.PrimaryKeyConstraint("gpt_application_id", "granularity", "bucket_start"),
+    )
+    op.create_table(
+        "gpt_session_rollup_user",
+        sa.Column("gpt_application_id", sa.Integer(), nullable=False),
+        sa.Column("granularity", GRANULARITY, nullable=False),
+        sa.Column("bucket_start", sa.DateTime(timezone=True), nullable=False),
+        sa.Column("user_hash", sa.BigInteger(), nullable=False),
+        sa.PrimaryKeyConstraint(
+            "gpt_application_id", "granularity", "bucket_start", "user_hash"
+        ),
+        postgresql_partition_by="RANGE (bucket_start)",
+    )
+
+    # Partitions back to the start of the oldest week that is still open.
+    now = datetime.now(UTC)
+    today = datetime(now.year, now.month, now.day, tzinfo=UTC)
+    for offset in range(-USER_WINDOW_DAYS, PREMAKE_DAYS + 1):
+        start = today + timedelta(days=offset)
+        end = start + timedelta(days=1)
+        op.execute(
+            f"CREATE TABLE gpt_session_rollup_user_p{start.strftime('%Y%m%d')} "
+            "PARTITION OF gpt_session_rollup_user "
+            f"FOR VALUES FROM ('{start.isoformat()}') TO ('{end.isoformat()}')"
+        )
+    # Keeps session writes working if partition maintenance stops running; the
+    # rollup update runs in the same transaction as the session insert.
+    op.execute(
+        "CREATE TABLE gpt_session_rollup_user_default "
+        "PARTITION OF gpt_session_rollup_user DEFAULT"
+    )
+
+    # Sessions created by instances still running the previous release while
+    # this runs are missing from the rollups; run
+    # analytics.rebuild_session_rollups_stmts() once the deploy completes.
+    op.execute(
+        f"""
+        INSERT INTO gpt_session_rollup
+            (gpt_application_id, granularity, bucket_start, session_count, unique_users)
+        SELECT gpt_application_id, granularity, bucket_start, count(*),
+            count(DISTINCT user_hash)
+        FROM ({BUCKETED_SESSIONS}) AS b
+        GROUP BY gpt_application_id, granularity, bucket_start
+        """
+    )
+    op.execute(
+        f"""
+        INSERT INTO gpt_session_rollup_user
+            (gpt_application_id, granularity, bucket_start, user_hash)
+        SELECT DISTINCT gpt_application_id, granularity, bucket_start, user_hash
+        FROM ({BUCKETED_SESSIONS}) AS b
+        WHERE bucket_start >= now() - interval '{USER_WINDOW_DAYS} days'
+            AND bucket_start < now() + interval '1 day'
+        """
+    )
+
+
+def downgrade() -> None:
+    op.drop_table("gpt_session_rollup_user")
+    op.drop_table("gpt_session_rollup")
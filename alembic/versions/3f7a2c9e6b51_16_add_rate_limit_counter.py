@@ -0,0 +1,39 @@
+"""16_add_rate_limit_counter
+
+Revision ID: 3f7a2c9e6b51
+Revises: 8b4e1f6a9c27
+Create Date: 2026-10-16 22:41:55.301874
+
+Counters for RATE_LIMIT_STORAGE=postgres. The table is unlogged: the counters
+are short-lived and losing them on a crash only resets the limits.
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = "3f7a2c9e6b51"
+down_revision: Union[str, None] = "8b4e1f6a9c27"
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    op.create_table(
+        "rate_limit_counter",
+        sa.Column("key", sa.Text(), nullable=False),
+        sa.Column("window_start", sa.BigInteger(), nullable=False),
+        sa.Column("hits", sa.Integer(), nullable=False),
+        sa.Column("expires_at", sa.BigInteger(), nullable=False),
+        sa.PrimaryKeyConstraint("key", "window_start"),
+        prefixes=["UNLOGGED"],
+    )
+    op.create_index(
+        "ix_rate_limit_counter_expires_at", "rate_limit_counter", ["expires_at"]
+    )
+
+
+def downgrade() -> None:
+    op.drop_table("rate_limit_counter")
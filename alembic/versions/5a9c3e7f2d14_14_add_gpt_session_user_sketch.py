@@ -0,0 +1,87 @@
+"""14_add_gpt_session_user_sketch
+
+Revision ID: 5a9c3e7f2d14
+Revises: 1d6f0a83c5e9
+Create Date: 2026-10-16 20:05:38.224917
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = "5a9c3e7f2d14"
+down_revision: Union[str, None] = "1d6f0a83c5e9"
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+# Mirrors gategpt.hll.
+HLL_PRECISION = 12
+HLL_REGISTERS = 1 << HLL_PRECISION
+
+
+def upgrade() -> None:
+    op.create_table(
+        "gpt_session_user_sketch",
+        sa.Column("gpt_application_id", sa.Integer(), nullable=False),
+        sa.Column("day", sa.Date(), nullable=False),
+        sa.Column("registers", sa.LargeBinary(), nullable=False),
+        sa.ForeignKeyConstraint(
+            ["gpt_application_id"],
+            ["custom_gpt_application.id"],
+        ),
+        sa.PrimaryKeyConstraint("gpt_application_id", "day"),
+    )
+
+    # Same hashing as gategpt.hll.register_update. Sessions created by instances
+    # still running the previous release while this runs are missing from the
+    # sketches; run analytics.rebuild_session_rollups_stmts() once the deploy
+    # completes.
+    op.execute(
+        f"""
+        WITH hashed AS (
+            SELECT
+                gpt_application_id,
+                CAST(created_at AT TIME ZONE 'UTC' AS date) AS day,
+                CAST('x' || substr(md5(lower(email)), 1, 16) AS bit(64)) AS user_hash
+            FROM gpt_session
+        ),
+        register AS (
+            SELECT
+                gpt_application_id,
+                day,
+                CAST(substring(user_hash FROM 1 FOR {HLL_PRECISION}) AS integer) AS register,
+                max(
+                    {65 - HLL_PRECISION} - length(ltrim(
+                        CAST(substring(user_hash FROM {HLL_PRECISION + 1}) AS text), '0'
+                    ))
+                ) AS rank
+            FROM hashed
+            GROUP BY 1, 2, 3
+        ),
+        sketch AS (
+            SELECT DISTINCT gpt_application_id, day FROM register
+        )
+        INSERT INTO gpt_session_user_sketch (gpt_application_id, day, registers)
+        SELECT
+            sketch.gpt_application_id,
+            sketch.day,
+            decode(
+                string_agg(lpad(to_hex(coalesce(r.rank, 0)), 2, '0'), '' ORDER BY i),
+                'hex'
+            )
+        FROM sketch
+        CROSS JOIN generate_series(0, {HLL_REGISTERS - 1}) AS i
+        LEFT JOIN register AS r
+            ON r.gpt_application_id = sketch.gpt_application_id
+            AND r.day = sketch.day
+            AND r.register = i
+        GROUP BY sketch.gpt_application_id, sketch.day
+        """
+    )
+
+
+def downgrade() -> None:
+    op.drop_table("gpt_session_user_sketch")
@@ -0,0 +1,92 @@
+"""09_add_hot_path_indexes
+
+Revision ID: 5f1c7a9e3d42
+Revises: 2bf907b56ce2
+Create Date: 2026-10-16 10:12:41.502318
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = "5f1c7a9e3d42"
+down_revision: Union[str, None] = "2bf907b56ce2"
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+# (index name, table, columns, unique)
+HOT_PATH_INDEXES = [
+    (
+        "ix_oauth_verification_request_uuid",
+        "oauth_verification_request",
+        ["uuid"],
+        True,
+    ),
+    (
+        "ix_custom_gpt_application_client_id",
+        "custom_gpt_application",
+        ["client_id"],
+        True,
+    ),
+    (
+        "ix_custom_gpt_application_uuid",
+        "custom_gpt_application",
+        ["uuid"],
+        True,
+    ),
+    (
+        "ix_gpt_session_gpt_application_id_created_at",
+        "gpt_session",
+        ["gpt_application_id", "created_at"],
+        False,
+    ),
+]
+
+
+def _drop_invalid_index(index_name: str) -> None:
+    # A CREATE INDEX CONCURRENTLY that fails halfway leaves an INVALID index
+    # behind, which IF NOT EXISTS would then silently keep.
+    is_invalid = (
+        op.get_bind()
+        .execute(
+            sa.text(
+                "SELECT NOT i.indisvalid FROM pg_index i "
+                "JOIN pg_class c ON c.oid = i.indexrelid WHERE c.relname = :name"
+            ),
+            {"name": index_name},
+        )
+        .scalar()
+    )
+    if is_invalid:
+        op.drop_index(index_name, postgresql_concurrently=True, if_exists=True)
+
+
+def upgrade() -> None:
+    # CONCURRENTLY can't run inside a transaction block, so each index is
+    # built in autocommit mode without taking a write lock on the table.
+    with op.get_context().autocommit_block():
+        for index_name, table_name, columns, unique in HOT_PATH_INDEXES:
+            _drop_invalid_index(index_name)
+            op.create_index(
+                index_name,
+                table_name,
+                columns,
+                unique=unique,
+                postgresql_concurrently=True,
+                if_not_exists=True,
+            )
+
+
+def downgrade() -> None:
+    with op.get_context().autocommit_block():
+        for index_name, table_name, _, _ in reversed(HOT_PATH_INDEXES):
+            op.drop_index(
+                index_name,
+                table_name=table_name,
+                postgresql_concurrently=True,
+                if_exists=True,
+            )
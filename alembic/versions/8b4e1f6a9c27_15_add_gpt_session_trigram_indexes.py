@@ -0,0 +1,41 @@
+"""15_add_gpt_session_trigram_indexes
+
+Revision ID: 8b4e1f6a9c27
+Revises: 5a9c3e7f2d14
+Create Date: 2026-10-16 21:14:09.583106
+
+Adds pg_trgm GIN indexes so substring searches on gpt_session email and name,
+case sensitive or not, stop scanning every session of the application.
+CREATE EXTENSION needs a role allowed to create it (pg_trgm is a trusted
+extension, so the database owner is enough on Postgres 13+). The indexes are
+built on every partition while gpt_session is locked against writes, which
+takes a while on large tables.
+"""
+from typing import Sequence, Union
+
+from alembic import op
+
+
+# revision identifiers, used by Alembic.
+revision: str = "8b4e1f6a9c27"
+down_revision: Union[str, None] = "5a9c3e7f2d14"
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    op.execute("CREATE EXTENSION IF NOT EXISTS pg_trgm")
+    for column in ["email", "name"]:
+        op.create_index(
+            f"ix_gpt_session_{column}_trgm",
+            "gpt_session",
+            [column],
+            postgresql_using="gin",
+            postgresql_ops={column: "gin_trgm_ops"},
+        )
+
+
+def downgrade() -> None:
+    # The extension is left installed, other objects may depend on it.
+    for column in ["email", "name"]:
+        op.drop_index(f"ix_gpt_session_{column}_trgm", table_name="gpt_session")
@@ -0,0 +1,47 @@
+"""10_add_gpt_session_counter
+
+Revision ID: 9a3e6b1f0c57
+Revises: 5f1c7a9e3d42
+Create Date: 2026-10-16 11:40:08.217934
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = "9a3e6b1f0c57"
+down_revision: Union[str, None] = "5f1c7a9e3d42"
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    op.create_table(
+        "gpt_session_counter",
+        sa.Column("gpt_application_id", sa.Integer(), nullable=False),
+        sa.Column("session_count", sa.BigInteger(), nullable=False),
+        sa.Column("updated_at", sa.DateTime(timezone=True), nullable=False),
+        sa.ForeignKeyConstraint(
+            ["gpt_application_id"],
+            ["custom_gpt_application.id"],
+        ),
+        sa.PrimaryKeyConstraint("gpt_application_id"),
+    )
+    # Backfill from existing sessions. Sessions created by instances still
+    # running the previous release while this runs are not counted; run
+    # analytics.recount_sessions_stmt() once the deploy completes to reconcile.
+    op.execute(
+        """
+        INSERT INTO gpt_session_counter (gpt_application_id, session_count, updated_at)
+        SELECT gpt_application_id, count(*), now()
+        FROM gpt_session
+        GROUP BY gpt_application_id
+        """
+    )
+
+
+def downgrade() -> None:
+    op.drop_table("gpt_session_counter")
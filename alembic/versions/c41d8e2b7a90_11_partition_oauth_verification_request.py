@@ -0,0 +1,94 @@
+"""11_partition_oauth_verification_request
+
+Revision ID: c41d8e2b7a90
+Revises: 9a3e6b1f0c57
+Create Date: 2026-10-16 14:05:31.402117
+
+Converts oauth_verification_request to a table range partitioned by day on
+created_at. Existing rows are copied into a single archive partition ending at
+today, which the partition reaper drops once it is past the retention. Flows
+created when maintenance has fallen behind land in the default partition. The table
+is rewritten under an exclusive lock, so in-flight OAuth flows fail while this
+runs; apply it during a quiet period.
+"""
+from datetime import UTC, datetime, timedelta
+from typing import Sequence, Union
+
+from alembic import op
+
+
+# revision identifiers, used by Alembic.
+revision: str = "c41d8e2b7a90"
+down_revision: Union[str, None] = "9a3e6b1f0c57"
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+TABLE = "oauth_verification_request"
+OLD_TABLE = f"{TABLE}_unpartitioned"
+# Matches the premake of the oauth_verification_request PartitionMaintenance table.
+PREMAKE_DAYS = 7
+
+
+def upgrade() -> None:
+    op.rename_table(TABLE, OLD_TABLE)
+    op.execute(f"ALTER INDEX {TABLE}_pkey RENAME TO {OLD_TABLE}_pkey")
+    op.execute(f"ALTER INDEX ix_{TABLE}_uuid RENAME TO ix_{OLD_TABLE}_uuid")
+
+    # LIKE keeps the column order, NOT NULLs and the id sequence default.
+    op.execute(
+        f"CREATE TABLE {TABLE} (LIKE {OLD_TABLE} INCLUDING DEFAULTS INCLUDING CONSTRAINTS) "
+        "PARTITION BY RANGE (created_at)"
+    )
+    op.execute(f"ALTER SEQUENCE {TABLE}_id_seq OWNED BY {TABLE}.id")
+    op.create_primary_key(f"{TABLE}_pkey", TABLE, ["id", "created_at"])
+    op.create_foreign_key(
+        f"{TABLE}_gpt_application_id_fkey",
+        TABLE,
+        "custom_gpt_application",
+        ["gpt_application_id"],
+        ["id"],
+    )
+    op.create_index(f"ix_{TABLE}_uuid", TABLE, ["uuid"])
+
+    now = datetime.now(UTC)
+    today = datetime(now.year, now.month, now.day, tzinfo=UTC)
+    op.execute(
+        f"CREATE TABLE {TABLE}_archive PARTITION OF {TABLE} "
+        f"FOR VALUES FROM (MINVALUE) TO ('{today.isoformat()}')"
+    )
+    for offset in range(PREMAKE_DAYS + 1):
+        start = today + timedelta(days=offset)
+        end = start + timedelta(days=1)
+        op.execute(
+            f"CREATE TABLE {TABLE}_p{start.strftime('%Y%m%d')} PARTITION OF {TABLE} "
+            f"FOR VALUES FROM ('{start.isoformat()}') TO ('{end.isoformat()}')"
+        )
+    # Catches new flows if partition maintenance stops running.
+    op.execute(f"CREATE TABLE {TABLE}_default PARTITION OF {TABLE} DEFAULT")
+
+    op.execute(f"INSERT INTO {TABLE} SELECT * FROM {OLD_TABLE}")
+    op.drop_table(OLD_TABLE)
+
+
+def downgrade() -> None:
+    op.rename_table(TABLE, OLD_TABLE)
+    op.execute(f"ALTER INDEX {TABLE}_pkey RENAME TO {OLD_TABLE}_pkey")
+    op.execute(f"ALTER INDEX ix_{TABLE}_uuid RENAME TO ix_{OLD_TABLE}_uuid")
+
+    op.execute(
+        f"CREATE TABLE {TABLE} (LIKE {OLD_TABLE} INCLUDING DEFAULTS INCLUDING CONSTRAINTS)"
+    )
+    op.execute(f"ALTER SEQUENCE {TABLE}_id_seq OWNED BY {TABLE}.id")
+    op.create_primary_key(f"{TABLE}_pkey", TABLE, ["id"])
+    op.create_foreign_key(
+        f"{TABLE}_gpt_application_id_fkey",
+        TABLE,
+        "custom_gpt_application",
+        ["gpt_application_id"],
+        ["id"],
+    )
+    op.create_index(f"ix_{TABLE}_uuid", TABLE, ["uuid"], unique=True)
+
+    op.execute(f"INSERT INTO {TABLE} SELECT * FROM {OLD_TABLE}")
+    # Drops every partition along with the parent.
+    op.drop_table(OLD_TABLE)
@@ -0,0 +1,120 @@
+"""12_partition_gpt_session
+
+Revision ID: e7b29c5d1f38
+Revises: c41d8e2b7a90
+Create Date: 2026-10-16 16:22:47.915302
+
+Converts gpt_session to a table range partitioned by month on created_at.
+
+Monthly partitions are created from the oldest session (but at least 12 and at
+most 36 months back) through three months ahead; PartitionMaintenance keeps
+creating them from there. Anything outside those ranges, such as very old rows
+or backfills, lands in gpt_session_default. Every row is copied while the table
+is locked, so run this during a maintenance window.
+"""
+from typing import Sequence, Union
+
+from alembic import op
+
+
+# revision identifiers, used by Alembic.
+revision: str = "e7b29c5d1f38"
+down_revision: Union[str, None] = "c41d8e2b7a90"
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+TABLE = "gpt_session"
+OLD_TABLE = f"{TABLE}_unpartitioned"
+INDEXES = [
+    ("ix_gpt_session_email", ["email"]),
+    (
+        "ix_gpt_session_gpt_application_id_created_at",
+        ["gpt_application_id", "created_at"],
+    ),
+]
+
+
+def _swap_out_old_table() -> None:
+    op.rename_table(TABLE, OLD_TABLE)
+    for index_name in [f"{TABLE}_pkey", *(name for name, _ in INDEXES)]:
+        op.execute(f"ALTER INDEX IF EXISTS {index_name} RENAME TO {index_name}_old")
+
+
+def _create_table(partitioned: bool) -> None:
+    op.execute(
+        f"CREATE TABLE {TABLE} (LIKE {OLD_TABLE} INCLUDING DEFAULTS INCLUDING CONSTRAINTS)"
+        + (" PARTITION BY RANGE (created_at)" if partitioned else "")
+    )
+    # The id sequence was created as user_session_id_seq, so look it up.
+    op.execute(
+        f"""
+        DO $$
+        BEGIN
+            EXECUTE format(
+                'ALTER SEQUENCE %s OWNED BY {TABLE}.id',
+                pg_get_serial_sequence('{OLD_TABLE}', 'id')
+            );
+        END $$
+        """
+    )
+    op.create_primary_key(
+        f"{TABLE}_pkey", TABLE, ["id", "created_at"] if partitioned else ["id"]
+    )
+    op.create_foreign_key(
+        f"{TABLE}_gpt_application_id_fkey",
+        TABLE,
+        "custom_gpt_application",
+        ["gpt_application_id"],
+        ["id"],
+    )
+    for index_name, columns in INDEXES:
+        op.create_index(index_name, TABLE, columns)
+
+
+def upgrade() -> None:
+    _swap_out_old_table()
+    _create_table(partitioned=True)
+
+    # Bounds are computed as UTC timestamps, so partitions start at UTC midnight
+    # whatever the session time zone is.
+    op.execute(
+        f"""
+        DO $$
+        DECLARE
+            month_start timestamp;
+        BEGIN
+            FOR month_start IN
+                SELECT generate_series(
+                    date_trunc('month', greatest(
+                        least(min(created_at), now() - interval '12 months'),
+                        now() - interval '36 months'
+                    ) AT TIME ZONE 'UTC'),
+                    date_trunc('month', now() AT TIME ZONE 'UTC') + interval '3 months',
+                    interval '1 month'
+                )
+                FROM {OLD_TABLE}
+            LOOP
+                EXECUTE format(
+                    'CREATE TABLE %I PARTITION OF {TABLE} FOR VALUES FROM (%L) TO (%L)',
+                    '{TABLE}_p' || to_char(month_start, 'YYYYMM'),
+                    month_start AT TIME ZONE 'UTC',
+                    (month_start + interval '1 month') AT TIME ZONE 'UTC'
+                );
+            END LOOP;
+        END $$
+        """
+    )
+    op.execute(f"CREATE TABLE {TABLE}_default PARTITION OF {TABLE} DEFAULT")
+
+    op.execute(f"INSERT INTO {TABLE} SELECT * FROM {OLD_TABLE}")
+    op.drop_table(OLD_TABLE)
+    op.execute(f"ANALYZE {TABLE}")
+
+
+def downgrade() -> None:
+    _swap_out_old_table()
+    _create_table(partitioned=False)
+    op.execute(f"INSERT INTO {TABLE} SELECT * FROM {OLD_TABLE}")
+    # Drops every partition along with the parent.
+    op.drop_table(OLD_TABLE)
+    op.execute(f"ANALYZE {TABLE}")
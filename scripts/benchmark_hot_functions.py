@@ -0,0 +1,364 @@
+"""
+Micro-benchmarks of the pure-Python functions on the request path.
+
+Each benchmark builds its fixtures once (the app and its OpenAPI schema, a request
+scope, an unsaved CustomGPTApplication row, tokens) and times a single call with
+timeit: the loop count is picked so a run takes at least 0.2s, and the fastest of
+--repeat runs is kept. Nothing connects to a database or the network, so it runs
+offline with or without DATABASE_URL pointing at a local database.
+
+--save stores the results as a baseline, --compare runs again and exits with
+status 1 if any benchmark got more than --threshold slower than the baseline.
+Timings are normalized by a fixed pure-Python calibration loop measured in the
+same run, which takes out most of the difference between machines and Python
+builds. Regenerate the baseline on the machine that does the comparisons anyway
+if it differs much from the one that saved it.
+
+    python scripts/benchmark_hot_functions.py
+    python scripts/benchmark_hot_functions.py --save
+    python scripts/benchmark_hot_functions.py --compare --threshold 0.25
+"""
+import argparse
+from datetime import timedelta
+import json
+import os
+from pathlib import Path
+import platform
+import statistics
+import sys
+import timeit
+from typing import Any, Callable
+from uuid import uuid4
+
+from dotenv import load_dotenv
+
+REPO_ROOT = Path(__file__).resolve().parent.parent
+DEFAULT_BASELINE = Path(__file__).resolve().parent / "benchmark_hot_functions.json"
+DEFAULT_THRESHOLD = 0.25
+CALIBRATION = "calibration"
+
+# Only needed to build the config, nothing connects anywhere.
+OFFLINE_ENV = {
+    "DATABASE_URL": "postgresql://localhost/gategpt",
+    "SECRET_KEY": "benchmark-secret-key",
+    "GOOGLE_OAUTH_CLIENT_ID": "benchmark-client-id",
+    "GOOGLE_OAUTH_CLIENT_SECRET": "benchmark-client-secret",
+    "DOMAIN_NAME": "http://localhost:8000",
+    "ENABLE_SENTRY": "0",
+    "PARTITION_MAINTENANCE": "0",
+    "LOG_LEVEL": "WARNING",
+}
+
+
+def _calibration() -> Callable[[], Any]:
+    def loop():
+        total = 0
+        for i in range(1000):
+            total += i * i
+        return total
+
+    return loop
+
+
+def _openapi_schema() -> Callable[[], Any]:
+    from gategpt.config import OpenAPISchemaTags
+    from gategpt.routers.openapi_schema import filter_openapi_schema_by_tags
+
+    schema = _app().openapi()
+    tags = {OpenAPISchemaTags.GPTAppSession}
+    return lambda: filter_openapi_schema_by_tags(schema, tags)
+
+
+def _create_jwt_token() -> Callable[[], Any]:
+    from gategpt.config import create_config, create_jwt_token
+
+    config = create_config()
+    return lambda: create_jwt_token(
+        config,
+        email="user@example.com",
+        name="Benchmark User",
+        gpt_application_id=1,
+    )
+
+
+def _parse_jwt_token() -> Callable[[], Any]:
+    from gategpt.config import create_config, create_jwt_token, parse_jwt_token
+
+    config = create_config()
+    token = create_jwt_token(
+        config, email="user@example.com", name="Benchmark User", gpt_application_id=1
+    )
+    return lambda: parse_jwt_token(config, token)
+
+
+def _url_for() -> Callable[[], Any]:
+    from gategpt.utils import url_for
+
+    request = _request()
+    return lambda: url_for(request, "oauth2_server_callback_google", scheme="https")
+
+
+def _url_for_query_params() -> Callable[[], Any]:
+    from gategpt.config import OpenAPISchemaTags
+    from gategpt.utils import url_for
+
+    request = _request()
+    return lambda: url_for(
+        request,
+        "openapi_schema_by_tags",
+        query_params={"tags": OpenAPISchemaTags.GPTAppSession.value},
+    )
+
+
+def _register_gpt_application_response() -> Callable[[], Any]:
+    from gategpt.models import VerificationMedium
+    from gategpt.routers.gpt_application import (
+        AuthenticationDetails,
+        RegisterGPTApplicationResponse,
+    )
+
+    row = _gpt_application()
+
+    def build():
+        return RegisterGPTApplicationResponse(
+            created_at=row.created_at,
+            gpt_name=row.gpt_name,
+            gpt_url=row.gpt_url,
+            verification_medium=VerificationMedium.Google,
+            gpt_description=row.gpt_description,
+            token_expiry=row.token_expiry,
+            uuid=row.uuid,
+            prompt="Authenticate the user first.",
+            action_schema_url="https://gategpt.co/openapi/?tags=gpt_app_session",
+            privacy_policy_url="https://gategpt.co/privacy-policy",
+            authentication_details=AuthenticationDetails(
+                client_id=str(row.client_id),
+                client_secret=str(row.client_secret),
+                authorization_url="https://gategpt.co/oauth2-server/authorize",
+                token_url="https://gategpt.co/oauth2-server/token",
+            ),
+        ).model_dump_json()
+
+    return build
+
+
+def _custom_gpt_application_response() -> Callable[[], Any]:
+    from gategpt.routers.gpt_application import CustomGPTApplicationResponse
+
+    row = _gpt_application()
+    return lambda: CustomGPTApplicationResponse.model_validate(row).model_dump_json()
+
+
+def _custom_gpt_application_list_response() -> Callable[[], Any]:
+    from gategpt.routers.gpt_application import CustomGPTApplicationResponse
+
+    rows = [_gpt_application() for _ in range(20)]
+    return lambda: [
+        CustomGPTApplicationResponse.model_validate(row).model_dump_json()
+        for row in rows
+    ]
+
+
+def _authorization_request_params() -> Callable[[], Any]:
+    from gategpt.routers.oauth2_server import AuthorizationRequestParams
+
+    query_params = {
+        "client_id": str(uuid4()),
+        "redirect_uri": "https://chat.openai.com/aip/g-abc123/oauth/callback",
+        "state": "a6f1d0c3-77b9-4c5e-8f0e-3c2b1a9d8e7f",
+        "scope": "email",
+        "response_type": "code",
+    }
+    return lambda: AuthorizationRequestParams(**query_params)
+
+
+# name -> fixture building the function to time
+BENCHMARKS: dict[str, Callable[[], Callable[[], Any]]] = {
+    CALIBRATION: _calibration,
+    "filter_openapi_schema_by_tags": _openapi_schema,
+    "create_jwt_token": _create_jwt_token,
+    "parse_jwt_token": _parse_jwt_token,
+    "url_for": _url_for,
+    "url_for (query_params)": _url_for_query_params,
+    "RegisterGPTApplicationResponse": _register_gpt_application_response,
+    "CustomGPTApplicationResponse": _custom_gpt_application_response,
+    "CustomGPTApplicationResponse x20": _custom_gpt_application_list_response,
+    "AuthorizationRequestParams": _authorization_request_params,
+}
+
+_fixtures: dict[str, Any] = {}
+
+
+def _app():
+    if "app" not in _fixtures:
+        from gategpt.main import create_app
+
+        _fixtures["app"] = create_app()
+    return _fixtures["app"]
+
+
+def _request():
+    from starlette.requests import Request
+
+    app = _app()
+    return Request(
+        {
+            "type": "http",
+            "app": app,
+            "router": app.router,
+            "method": "GET",
+            "scheme": "http",
+            "server": ("localhost", 8000),
+            "path": "/api/v1/custom-gpt-application",
+            "root_path": "",
+            "query_string": b"",
+            "headers": [(b"host", b"localhost:8000")],
+        }
+    )
+
+
+def _gpt_application():
+    from gategpt.models import CustomGPTApplication, VerificationMedium
+    from gategpt.utils import utcnow
+
+    import shortuuid
+
+    now = utcnow()
+    return CustomGPTApplication(
+        id=1,
+        uuid=shortuuid.uuid(),
+        user_id=1,
+        gpt_name="Benchmark GPT",
+        gpt_description="A custom GPT used to benchmark response models",
+        gpt_url=f"https://chat.openai.com/g/g-{shortuuid.uuid()}",
+        verification_medium=VerificationMedium.Google,
+        token_expiry=timedelta(minutes=5),
+        created_at=now,
+        updated_at=now,
+        client_id=uuid4(),
+        client_secret=uuid4(),
+    )
+
+
+def time_benchmark(fn: Callable[[], Any], repeat: int) -> dict[str, Any]:
+    timer = timeit.Timer(fn)
+    loops, _ = timer.autorange()
+    timings = [total / loops * 1e9 for total in timer.repeat(repeat, loops)]
+    return {
+        "ns_per_call": round(min(timings), 1),
+        "median_ns": round(statistics.median(timings), 1),
+        "loops": loops,
+    }
+
+
+def run(names: list[str], repeat: int) -> dict[str, Any]:
+    results = {}
+    for name in names:
+        results[name] = time_benchmark(BENCHMARKS[name](), repeat)
+        print(
+            f"{name:<40}{results[name]['ns_per_call'] / 1000:>12.2f} us"
+            f"{results[name]['median_ns'] / 1000:>12.2f} us median"
+        )
+    return {
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "machine": platform.machine(),
+        "benchmarks": results,
+    }
+
+
+def compare(
+    baseline: dict[str, Any], current: dict[str, Any], threshold: float, absolute: bool
+) -> list[str]:
+    """Print the change of every benchmark and return the ones that regressed."""
+
+    def normalized(results: dict[str, Any], name: str) -> float:
+        timing = results["benchmarks"][name]["ns_per_call"]
+        if absolute:
+            return timing
+        return timing / results["benchmarks"][CALIBRATION]["ns_per_call"]
+
+    print()
+    print(
+        f"Compared with {baseline['python']} on {baseline['platform']}"
+        + ("" if absolute else ", normalized by the calibration loop")
+    )
+    if baseline["python"].rsplit(".", 1)[0] != current["python"].rsplit(".", 1)[0]:
+        print(
+            f"Warning: running on Python {current['python']}, regenerate the "
+            "baseline with --save on the same Python version"
+        )
+    regressed = []
+    for name in current["benchmarks"]:
+        if name == CALIBRATION or name not in baseline["benchmarks"]:
+            continue
+        change = normalized(current, name) / normalized(baseline, name) - 1
+        status = "REGRESSED" if change > threshold else ""
+        print(f"{name:<40}{change:>+10.1%}  {status}")
+        if status:
+            regressed.append(name)
+    return regressed
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--filter", help="Only run benchmarks whose name contains this")
+    parser.add_argument(
+        "--repeat",
+        type=int,
+        default=7,
+        help="Timed runs per benchmark (fastest is kept)",
+    )
+    parser.add_argument(
+        "--baseline",
+        type=Path,
+        default=DEFAULT_BASELINE,
+        help="Baseline file to save to or compare with",
+    )
+    mode = parser.add_mutually_exclusive_group()
+    mode.add_argument(
+        "--save", action="store_true", help="Save the results as baseline"
+    )
+    mode.add_argument(
+        "--compare", action="store_true", help="Fail if slower than the baseline"
+    )
+    parser.add_argument(
+        "--threshold",
+        type=float,
+        default=DEFAULT_THRESHOLD,
+        help="Slowdown that counts as a regression, 0.25 = 25%%",
+    )
+    parser.add_argument(
+        "--absolute",
+        action="store_true",
+        help="Compare raw timings instead of normalizing by the calibration loop",
+    )
+    args = parser.parse_args()
+
+    # A .env pointing at a local database wins over the offline placeholders.
+    load_dotenv()
+    for name, value in OFFLINE_ENV.items():
+        os.environ.setdefault(name, value)
+    # The app mounts static/ and templates/ relative to the working directory.
+    os.chdir(REPO_ROOT)
+
+    names = [
+        name
+        for name in BENCHMARKS
+        if name == CALIBRATION or not args.filter or args.filter in name
+    ]
+    results = run(names, args.repeat)
+
+    if args.save:
+        args.baseline.write_text(json.dumps(results, indent=2) + "\n")
+        print(f"Saved baseline to {args.baseline}")
+    elif args.compare:
+        baseline = json.loads(args.baseline.read_text())
+        regressed = compare(baseline, results, args.threshold, args.absolute)
+        if regressed:
+            print(f"{len(regressed)} regressed by more than {args.threshold:.0%}")
+            sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
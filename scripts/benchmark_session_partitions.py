@@ -0,0 +1,211 @@
+"""
+Benchmark the gpt_app_users_session date range queries against the partitioned
+gpt_session table.
+
+For each date range the first page query is run with EXPLAIN (ANALYZE, BUFFERS)
+to list the partitions it touches, then timed over several runs. With
+--baseline the same queries also run against an unpartitioned temporary copy of
+gpt_session with the same indexes. Building that copy reads the whole table, so
+only use --baseline on a development or staging database.
+
+    DATABASE_URL=postgresql://... python scripts/benchmark_session_partitions.py --baseline
+"""
+import argparse
+import json
+import os
+import statistics
+import time
+from typing import Any, Iterator, Optional
+
+from dotenv import load_dotenv
+from sqlalchemy import Connection, create_engine, text
+
+BASELINE_TABLE = "gpt_session_baseline"
+
+# (label, days back from now or None for no lower bound)
+DATE_RANGES = [
+    ("last 7 days", 7),
+    ("last 30 days", 30),
+    ("last 90 days", 90),
+    ("last 365 days", 365),
+    ("no date filter", None),
+]
+
+
+def first_page_query(table: str, bounded: bool) -> str:
+    """
+    The first page query issued by gpt_app_users_session with a start_datetime
+    filter, minus the join it uses to read the application's uuid.
+    """
+    date_filter = "AND created_at >= :start_datetime " if bounded else ""
+    return (
+        f"SELECT id, email, name, created_at FROM {table} "
+        f"WHERE gpt_application_id = :gpt_application_id {date_filter}"
+        "ORDER BY created_at DESC, id DESC LIMIT 21"
+    )
+
+
+def count_query(table: str, bounded: bool) -> str:
+    date_filter = "AND created_at >= :start_datetime" if bounded else ""
+    return (
+        f"SELECT count(*) FROM {table} "
+        f"WHERE gpt_application_id = :gpt_application_id {date_filter}"
+    )
+
+
+def plan_nodes(node: dict[str, Any]) -> Iterator[dict[str, Any]]:
+    yield node
+    for child in node.get("Plans", []):
+        yield from plan_nodes(child)
+
+
+def explain(connection: Connection, query: str, params: dict[str, Any]) -> dict:
+    result = connection.execute(
+        text(f"EXPLAIN (ANALYZE, BUFFERS, FORMAT JSON) {query}"), params
+    ).scalar()
+    plan = result if isinstance(result, list) else json.loads(result)
+    root = plan[0]["Plan"]
+    scanned = sorted(
+        {node["Relation Name"] for node in plan_nodes(root) if "Relation Name" in node}
+    )
+    return {
+        "scanned": scanned,
+        "buffers": root.get("Shared Hit Blocks", 0) + root.get("Shared Read Blocks", 0),
+    }
+
+
+def time_query(
+    connection: Connection, query: str, params: dict[str, Any], runs: int
+) -> float:
+    timings = []
+    for _ in range(runs):
+        started_at = time.perf_counter()
+        connection.execute(text(query), params).all()
+        timings.append((time.perf_counter() - started_at) * 1000)
+    return statistics.median(timings)
+
+
+def pick_gpt_application_id(connection: Connection) -> int:
+    gpt_application_id = connection.execute(
+        text(
+            "SELECT gpt_application_id FROM gpt_session_counter "
+            "ORDER BY session_count DESC LIMIT 1"
+        )
+    ).scalar()
+    if gpt_application_id is None:
+        raise SystemExit("No gpt_session rows found. Run seeder.py first.")
+    return gpt_application_id
+
+
+def create_baseline(connection: Connection) -> None:
+    connection.execute(
+        text(f"CREATE TEMPORARY TABLE {BASELINE_TABLE} AS SELECT * FROM gpt_session")
+    )
+    connection.execute(
+        text(f"CREATE INDEX ON {BASELINE_TABLE} (gpt_application_id, created_at)")
+    )
+    connection.execute(text(f"ANALYZE {BASELINE_TABLE}"))
+
+
+def benchmark(
+    connection: Connection,
+    table: str,
+    gpt_application_id: int,
+    runs: int,
+) -> list[dict[str, Any]]:
+    rows = []
+    for label, days in DATE_RANGES:
+        bounded = days is not None
+        params = {"gpt_application_id": gpt_application_id}
+        if bounded:
+            params["start_datetime"] = connection.execute(
+                text("SELECT now() - make_interval(days => :days)"), {"days": days}
+            ).scalar()
+        page_query = first_page_query(table, bounded)
+        plan = explain(connection, page_query, params)
+        rows.append(
+            {
+                "range": label,
+                "scanned": plan["scanned"],
+                "buffers": plan["buffers"],
+                "page_ms": time_query(connection, page_query, params, runs),
+                "count_ms": time_query(
+                    connection, count_query(table, bounded), params, runs
+                ),
+            }
+        )
+    return rows
+
+
+def print_results(
+    title: str, rows: list[dict[str, Any]], total_partitions: Optional[int]
+) -> None:
+    print("=" * 80)
+    print(title)
+    print(
+        f"{'range':<16}{'partitions':>12}{'buffers':>10}{'page ms':>10}{'count ms':>10}"
+    )
+    for row in rows:
+        scanned = len(row["scanned"])
+        partitions = f"{scanned}/{total_partitions}" if total_partitions else "-"
+        print(
+            f"{row['range']:<16}{partitions:>12}{row['buffers']:>10}"
+            f"{row['page_ms']:>10.2f}{row['count_ms']:>10.2f}"
+        )
+        if total_partitions:
+            print(f"{'':<16}{', '.join(row['scanned'])}")
+    print()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument(
+        "--gpt-application-id",
+        type=int,
+        help="Application to query, defaults to the one with the most sessions",
+    )
+    parser.add_argument(
+        "--runs", type=int, default=20, help="Timed runs per query (median is shown)"
+    )
+    parser.add_argument(
+        "--baseline",
+        action="store_true",
+        help="Also run against an unpartitioned temporary copy of gpt_session",
+    )
+    args = parser.parse_args()
+
+    load_dotenv()
+    engine = create_engine(os.environ["DATABASE_URL"])
+
+    with engine.connect() as connection:
+        gpt_application_id = args.gpt_application_id or pick_gpt_application_id(
+            connection
+        )
+        total_partitions = connection.execute(
+            text(
+                "SELECT count(*) FROM pg_inherits "
+                "WHERE inhparent = CAST('gpt_session' AS regclass)"
+            )
+        ).scalar()
+        print(
+            f"gpt_application_id={gpt_application_id}, "
+            f"{total_partitions} gpt_session partitions, {args.runs} runs per query"
+        )
+
+        print_results(
+            "partitioned gpt_session",
+            benchmark(connection, "gpt_session", gpt_application_id, args.runs),
+            total_partitions,
+        )
+        if args.baseline:
+            create_baseline(connection)
+            print_results(
+                "unpartitioned baseline",
+                benchmark(connection, BASELINE_TABLE, gpt_application_id, args.runs),
+                None,
+            )
+        connection.rollback()
+
+
+if __name__ == "__main__":
+    main()
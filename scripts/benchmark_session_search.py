@@ -0,0 +1,207 @@
+"""
+Benchmark the gpt_app_users_session email and name searches with and without the
+pg_trgm GIN indexes.
+
+A temporary table shaped like gpt_session is seeded with --rows generated
+sessions (a million by default) spread over --apps applications, with the same
+(gpt_application_id, created_at) index. Every search is timed with LIKE and
+ILIKE, first without and then with the trigram indexes, and the scan used by the
+plan is shown. The table is dropped on exit. Run this against a development
+database migrated past 15_add_gpt_session_trigram_indexes so pg_trgm is
+installed.
+
+    DATABASE_URL=postgresql://... python scripts/benchmark_session_search.py
+"""
+import argparse
+import json
+import os
+import statistics
+import time
+from typing import Any, Iterator
+
+from dotenv import load_dotenv
+from sqlalchemy import Connection, create_engine, text
+
+TABLE = "gpt_session_search_benchmark"
+FIRST_NAMES = [
+    "James", "Mary", "Robert", "Patricia", "John", "Jennifer", "Michael", "Linda",
+    "David", "Elizabeth", "William", "Barbara", "Richard", "Susan", "Joseph",
+    "Jessica", "Thomas", "Sarah", "Priya", "Wei", "Aarav", "Fatima", "Hiroshi",
+    "Olga",
+]  # fmt: skip
+LAST_NAMES = [
+    "Smith", "Johnson", "Williams", "Brown", "Jones", "Garcia", "Miller", "Davis",
+    "Rodriguez", "Martinez", "Hernandez", "Lopez", "Gonzalez", "Wilson",
+    "Anderson", "Thomas", "Taylor", "Moore", "Sharma", "Chen", "Tanaka", "Ivanova",
+    "Kowalski", "Okafor",
+]  # fmt: skip
+DOMAINS = ["gmail.com", "outlook.com", "yahoo.com", "example.org", "company.io"]
+
+# (label, column, search term as typed into the dashboard)
+SEARCHES = [
+    ("email, one user", "email", "priya.sharma1234"),
+    ("email, surname", "email", "kowalski"),
+    ("email, domain", "email", "example.org"),
+    ("name, full", "name", "Hiroshi Tanaka"),
+    ("name, fragment", "name", "ndez"),
+    ("name, no match", "name", "Zebedee"),
+]
+
+
+def seed(connection: Connection, rows: int, apps: int) -> None:
+    connection.execute(
+        text(
+            f"""
+            CREATE TEMPORARY TABLE {TABLE} (
+                id bigint PRIMARY KEY,
+                gpt_application_id integer NOT NULL,
+                email varchar(255) NOT NULL,
+                name text,
+                created_at timestamptz NOT NULL
+            )
+            """
+        )
+    )
+    # Same data on every run.
+    connection.execute(text("SELECT setseed(0.5)"))
+    connection.execute(
+        text(
+            f"""
+            INSERT INTO {TABLE}
+            SELECT
+                n,
+                1 + n % :apps,
+                lower(first_name || '.' || last_name) || (n % 10000) || '@' || domain,
+                first_name || ' ' || last_name,
+                now() - random() * interval '365 days'
+            FROM (
+                SELECT
+                    n,
+                    (:first_names)[1 + CAST(floor(random() * cardinality(:first_names)) AS integer)]
+                        AS first_name,
+                    (:last_names)[1 + CAST(floor(random() * cardinality(:last_names)) AS integer)]
+                        AS last_name,
+                    (:domains)[1 + CAST(floor(random() * cardinality(:domains)) AS integer)]
+                        AS domain
+                FROM generate_series(1, :rows) AS n
+            ) AS person
+            """
+        ),
+        {
+            "rows": rows,
+            "apps": apps,
+            "domains": DOMAINS,
+            "first_names": FIRST_NAMES,
+            "last_names": LAST_NAMES,
+        },
+    )
+    connection.execute(
+        text(f"CREATE INDEX ON {TABLE} (gpt_application_id, created_at)")
+    )
+    connection.execute(text(f"ANALYZE {TABLE}"))
+
+
+def create_trigram_indexes(connection: Connection) -> None:
+    for column in ["email", "name"]:
+        connection.execute(
+            text(f"CREATE INDEX ON {TABLE} USING gin ({column} gin_trgm_ops)")
+        )
+    connection.execute(text(f"ANALYZE {TABLE}"))
+
+
+def search_query(column: str, operator: str) -> str:
+    """The first page query issued by gpt_app_users_session for a search."""
+    return (
+        f"SELECT id, email, name, created_at FROM {TABLE} "
+        f"WHERE gpt_application_id = :gpt_application_id "
+        f"AND {column} {operator} :pattern "
+        "ORDER BY created_at DESC, id DESC LIMIT 21"
+    )
+
+
+def plan_nodes(node: dict[str, Any]) -> Iterator[dict[str, Any]]:
+    yield node
+    for child in node.get("Plans", []):
+        yield from plan_nodes(child)
+
+
+def scans(connection: Connection, query: str, params: dict[str, Any]) -> str:
+    result = connection.execute(text(f"EXPLAIN (FORMAT JSON) {query}"), params).scalar()
+    plan = result if isinstance(result, list) else json.loads(result)
+    return ", ".join(
+        node["Node Type"]
+        for node in plan_nodes(plan[0]["Plan"])
+        if "Scan" in node["Node Type"]
+    )
+
+
+def time_query(
+    connection: Connection, query: str, params: dict[str, Any], runs: int
+) -> float:
+    timings = []
+    for _ in range(runs):
+        started_at = time.perf_counter()
+        connection.execute(text(query), params).all()
+        timings.append((time.perf_counter() - started_at) * 1000)
+    return statistics.median(timings)
+
+
+def benchmark(connection: Connection, runs: int) -> list[dict[str, Any]]:
+    results = []
+    for label, column, term in SEARCHES:
+        for operator in ["LIKE", "ILIKE"]:
+            query = search_query(column, operator)
+            # Mixed case so ILIKE does the work LIKE can't.
+            pattern = f"%{term.swapcase() if operator == 'ILIKE' else term}%"
+            params = {"gpt_application_id": 1, "pattern": pattern}
+            results.append(
+                {
+                    "search": f"{label} ({operator})",
+                    "scans": scans(connection, query, params),
+                    "ms": time_query(connection, query, params, runs),
+                }
+            )
+    return results
+
+
+def print_results(title: str, results: list[dict[str, Any]]) -> None:
+    print("=" * 80)
+    print(title)
+    print(f"{'search':<32}{'ms':>10}  scans")
+    for row in results:
+        print(f"{row['search']:<32}{row['ms']:>10.2f}  {row['scans']}")
+    print()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--rows", type=int, default=1_000_000, help="Sessions to seed")
+    parser.add_argument(
+        "--apps", type=int, default=5, help="Applications the sessions are spread over"
+    )
+    parser.add_argument(
+        "--runs", type=int, default=10, help="Timed runs per query (median is shown)"
+    )
+    args = parser.parse_args()
+
+    load_dotenv()
+    engine = create_engine(os.environ["DATABASE_URL"])
+
+    with engine.connect() as connection:
+        started_at = time.perf_counter()
+        seed(connection, args.rows, args.apps)
+        print(
+            f"Seeded {args.rows} sessions over {args.apps} applications "
+            f"in {time.perf_counter() - started_at:.1f}s, {args.runs} runs per query"
+        )
+        print_results("without trigram indexes", benchmark(connection, args.runs))
+
+        started_at = time.perf_counter()
+        create_trigram_indexes(connection)
+        print(f"Built trigram indexes in {time.perf_counter() - started_at:.1f}s")
+        print_results("with trigram indexes", benchmark(connection, args.runs))
+        connection.rollback()
+
+
+if __name__ == "__main__":
+    main()
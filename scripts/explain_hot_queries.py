@@ -0,0 +1,143 @@
+"""
+Print EXPLAIN ANALYZE plans for the queries on the OAuth and session hot paths.
+
+The "before" plans are captured inside a transaction that drops the indexes
+added by the 09_add_hot_path_indexes migration and is then rolled back, so the
+script can be run against a migrated database and shows both plans side by side.
+DROP INDEX holds an exclusive lock on the table until the rollback, so only run
+this against a development or staging database.
+
+    DATABASE_URL=postgresql://... python scripts/explain_hot_queries.py
+"""
+import argparse
+import os
+from typing import Any
+
+from dotenv import load_dotenv
+from sqlalchemy import Connection, create_engine, text
+
+HOT_PATH_INDEXES = [
+    "ix_oauth_verification_request_uuid",
+    "ix_custom_gpt_application_client_id",
+    "ix_custom_gpt_application_uuid",
+    "ix_gpt_session_gpt_application_id_created_at",
+]
+
+# (name, query) pairs mirroring the queries issued by the routers.
+HOT_QUERIES = [
+    (
+        "oauth2_server_authorize: application by client_id",
+        "SELECT * FROM custom_gpt_application WHERE client_id = :client_id",
+    ),
+    (
+        "verify_credentials: application by client_id and client_secret",
+        "SELECT * FROM custom_gpt_application "
+        "WHERE client_id = :client_id AND client_secret = :client_secret",
+    ),
+    (
+        "gpt_application_detail: application by uuid",
+        "SELECT * FROM custom_gpt_application WHERE uuid = :gpt_application_uuid",
+    ),
+    (
+        "oauth2_server_callback_google / token: verification request by uuid",
+        "SELECT * FROM oauth_verification_request "
+        "JOIN custom_gpt_application "
+        "ON custom_gpt_application.id = oauth_verification_request.gpt_application_id "
+        "WHERE oauth_verification_request.uuid = :verification_request_uuid",
+    ),
+    (
+        "gpt_app_users_session: total count",
+        "SELECT count(*) FROM gpt_session WHERE gpt_application_id = :gpt_application_id",
+    ),
+    (
+        "gpt_app_users_session: first page",
+        "SELECT email, name, created_at FROM gpt_session "
+        "WHERE gpt_application_id = :gpt_application_id "
+        "ORDER BY created_at DESC LIMIT 20",
+    ),
+    (
+        "gpt_app_users_session: date range",
+        "SELECT email, name, created_at FROM gpt_session "
+        "WHERE gpt_application_id = :gpt_application_id "
+        "AND created_at >= now() - interval '7 days' "
+        "ORDER BY created_at DESC LIMIT 20",
+    ),
+]
+
+
+def fetch_sample_params(connection: Connection) -> dict[str, Any]:
+    """
+    Pick the application with the most sessions so the plans reflect the worst case.
+    """
+    row = connection.execute(
+        text(
+            "SELECT a.id, a.uuid, a.client_id, a.client_secret FROM custom_gpt_application a "
+            "LEFT JOIN gpt_session s ON s.gpt_application_id = a.id "
+            "GROUP BY a.id ORDER BY count(s.id) DESC LIMIT 1"
+        )
+    ).first()
+    if row is None:
+        raise SystemExit("No custom_gpt_application rows found. Run seeder.py first.")
+
+    verification_request_uuid = connection.execute(
+        text(
+            "SELECT uuid FROM oauth_verification_request ORDER BY created_at DESC LIMIT 1"
+        )
+    ).scalar()
+    return {
+        "gpt_application_id": row.id,
+        "gpt_application_uuid": row.uuid,
+        "client_id": row.client_id,
+        "client_secret": row.client_secret,
+        "verification_request_uuid": verification_request_uuid or "missing",
+    }
+
+
+def explain(connection: Connection, query: str, params: dict[str, Any]) -> str:
+    result = connection.execute(text(f"EXPLAIN (ANALYZE, BUFFERS) {query}"), params)
+    return "\n".join(row[0] for row in result)
+
+
+def explain_all(connection: Connection, params: dict[str, Any]) -> dict[str, str]:
+    return {name: explain(connection, query, params) for name, query in HOT_QUERIES}
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument(
+        "--only",
+        choices=["before", "after", "both"],
+        default="both",
+        help="Which set of plans to print",
+    )
+    args = parser.parse_args()
+
+    load_dotenv()
+    engine = create_engine(os.environ["DATABASE_URL"])
+
+    with engine.connect() as connection:
+        with connection.begin():
+            params = fetch_sample_params(connection)
+
+        plans = {}
+        if args.only in ("before", "both"):
+            with connection.begin() as transaction:
+                for index_name in HOT_PATH_INDEXES:
+                    connection.execute(text(f"DROP INDEX IF EXISTS {index_name}"))
+                plans["before"] = explain_all(connection, params)
+                transaction.rollback()
+        if args.only in ("after", "both"):
+            with connection.begin():
+                plans["after"] = explain_all(connection, params)
+
+    for name, _ in HOT_QUERIES:
+        print("=" * 80)
+        print(name)
+        for label, label_plans in plans.items():
+            print(f"--- {label} migration ---")
+            print(label_plans[name])
+        print()
+
+
+if __name__ == "__main__":
+    main()
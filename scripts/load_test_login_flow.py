@@ -0,0 +1,330 @@
+"""
+Load test the full custom GPT login flow against a running app.
+
+Every virtual user repeatedly goes through what ChatGPT and the user's browser do:
+
+    GET  /oauth2-server/authorize       -> redirect to the OIDC provider
+    GET  <provider authorization URL>   -> redirect back to the callback
+    GET  /oauth2-server/callback/google -> redirect to the GPT with a code
+    POST /oauth2-server/token           -> access token (app calls the provider)
+    POST /api/v1/session                -> session recorded
+
+and the latency of each step is reported as p50/p95/p99 with requests per second.
+Run it with the app pointed at scripts/stub_oidc_provider.py, never at Google:
+
+    python scripts/stub_oidc_provider.py --port 9000 --latency 0.08
+    GOOGLE_OIDC_METADATA_URL=http://localhost:9000/.well-known/openid-configuration \\
+        RATE_LIMIT=0 rye run dev
+    DATABASE_URL=postgresql://... python scripts/load_test_login_flow.py \\
+        --create-application --concurrency 50 --flows 5000
+
+Every flow signs in a different user, passed to the stub as login_hint, so the
+per-email session rate limit doesn't kick in; the per-IP limits do unless the app
+runs with RATE_LIMIT=0. --create-application adds a GPT application owned by a
+load test user using DATABASE_URL; otherwise pass an existing application's
+--client-id and --client-secret. Each completed flow adds a gpt_session row.
+"""
+import argparse
+import asyncio
+from collections import Counter, defaultdict
+from datetime import timedelta
+import itertools
+import json
+import os
+import statistics
+import time
+from typing import Any, Iterator, Optional
+from urllib.parse import parse_qs, urlsplit
+
+from dotenv import load_dotenv
+import httpx
+import shortuuid
+from sqlalchemy import create_engine, select
+from sqlalchemy.orm import Session
+
+from gategpt.models import CustomGPTApplication, User
+
+STEPS = ["authorize", "provider_authorize", "callback", "token", "session"]
+LOAD_TEST_USER_EMAIL = "load-test@example.com"
+DEFAULT_REDIRECT_URI = "https://chat.openai.com/aip/g-load-test/oauth/callback"
+REDIRECT_STATUSES = {302, 303, 307}
+
+
+class StepFailedError(Exception):
+    def __init__(self, step: str, outcome: str) -> None:
+        super().__init__(f"{step} failed: {outcome}")
+        self.step = step
+        self.outcome = outcome
+
+
+class Results:
+    def __init__(self) -> None:
+        # step -> latencies in seconds of the requests that got a response
+        self.latencies: defaultdict[str, list[float]] = defaultdict(list)
+        # step -> status code or exception name -> count
+        self.failures: defaultdict[str, Counter] = defaultdict(Counter)
+        self.flows = 0
+        self.flow_latencies: list[float] = []
+
+
+def create_application(database_url: str) -> tuple[str, str]:
+    engine = create_engine(database_url)
+    with Session(engine) as session:
+        user = session.scalar(select(User).where(User.email == LOAD_TEST_USER_EMAIL))
+        if user is None:
+            user = User(email=LOAD_TEST_USER_EMAIL, name="Load Test")
+        application = CustomGPTApplication(
+            user=user,
+            gpt_name="Load test",
+            gpt_url=f"https://chat.openai.com/g/g-load-test-{shortuuid.uuid()}",
+            token_expiry=timedelta(minutes=5),
+        )
+        session.add(application)
+        session.commit()
+        return str(application.client_id), str(application.client_secret)
+
+
+def _location(response: httpx.Response, step: str) -> str:
+    if response.status_code not in REDIRECT_STATUSES:
+        raise StepFailedError(step, str(response.status_code))
+    return response.headers["location"]
+
+
+class LoginFlow:
+    def __init__(
+        self,
+        client: httpx.AsyncClient,
+        results: Results,
+        app_url: str,
+        client_id: str,
+        client_secret: str,
+        redirect_uri: str,
+        run_id: str,
+    ) -> None:
+        self.client = client
+        self.results = results
+        self.app_url = app_url.rstrip("/")
+        self.client_id = client_id
+        self.client_secret = client_secret
+        self.redirect_uri = redirect_uri
+        self.run_id = run_id
+
+    async def _request(self, step: str, method: str, url: str, **kwargs):
+        started_at = time.perf_counter()
+        try:
+            response = await self.client.request(method, url, **kwargs)
+        except httpx.HTTPError as exc:
+            raise StepFailedError(step, type(exc).__name__)
+        self.results.latencies[step].append(time.perf_counter() - started_at)
+        return response
+
+    def _on_app(self, url: str) -> str:
+        """
+        The app builds its callback URL with https unless DEBUG is set, point it
+        back at the app URL the test runs against.
+        """
+        parts = urlsplit(url)
+        return f"{self.app_url}{parts.path}?{parts.query}"
+
+    async def run(self, number: int) -> None:
+        # Each flow is a new browser, authlib keeps state in the session cookie.
+        self.client.cookies.clear()
+        state = shortuuid.uuid()
+        response = await self._request(
+            "authorize",
+            "GET",
+            f"{self.app_url}/oauth2-server/authorize",
+            params={
+                "client_id": self.client_id,
+                "redirect_uri": self.redirect_uri,
+                "state": state,
+                "scope": "email",
+            },
+        )
+        provider_url = _location(response, "authorize")
+
+        response = await self._request(
+            "provider_authorize",
+            "GET",
+            provider_url,
+            params={"login_hint": f"load-test-{self.run_id}-{number}@example.com"},
+        )
+        callback_url = _location(response, "provider_authorize")
+
+        response = await self._request("callback", "GET", self._on_app(callback_url))
+        query = parse_qs(urlsplit(_location(response, "callback")).query)
+        if "error" in query or query.get("state") != [state]:
+            raise StepFailedError("callback", query.get("error", ["bad_state"])[0])
+
+        response = await self._request(
+            "token",
+            "POST",
+            f"{self.app_url}/oauth2-server/token",
+            auth=(self.client_id, self.client_secret),
+            data={
+                "grant_type": "authorization_code",
+                "code": query["code"][0],
+                "redirect_uri": self.redirect_uri,
+            },
+        )
+        if response.status_code != 200:
+            raise StepFailedError("token", str(response.status_code))
+
+        response = await self._request(
+            "session",
+            "POST",
+            f"{self.app_url}/api/v1/session",
+            headers={"Authorization": f"Bearer {response.json()['access_token']}"},
+        )
+        if response.status_code != 200:
+            raise StepFailedError("session", str(response.status_code))
+
+
+async def virtual_user(
+    flow: LoginFlow,
+    numbers: Iterator[int],
+    flows: Optional[int],
+    deadline: Optional[float],
+) -> None:
+    """Run flows until `flows` have been started in total or `deadline` passes."""
+    results = flow.results
+    while deadline is None or time.perf_counter() < deadline:
+        number = next(numbers)
+        if flows is not None and number >= flows:
+            return
+        started_at = time.perf_counter()
+        try:
+            await flow.run(number)
+        except StepFailedError as exc:
+            results.failures[exc.step][exc.outcome] += 1
+            continue
+        results.flows += 1
+        results.flow_latencies.append(time.perf_counter() - started_at)
+
+
+async def run_load_test(args: argparse.Namespace) -> tuple[Results, float]:
+    results = Results()
+    # Shared by the virtual users, which all run on this thread.
+    numbers = itertools.count()
+    flows = None if args.duration else args.flows
+    run_id = shortuuid.uuid()[:8].lower()
+    deadline = time.perf_counter() + args.duration if args.duration else None
+
+    clients = [
+        httpx.AsyncClient(timeout=args.timeout, follow_redirects=False)
+        for _ in range(args.concurrency)
+    ]
+    started_at = time.perf_counter()
+    try:
+        await asyncio.gather(
+            *(
+                virtual_user(
+                    LoginFlow(
+                        client,
+                        results,
+                        args.app_url,
+                        args.client_id,
+                        args.client_secret,
+                        args.redirect_uri,
+                        run_id,
+                    ),
+                    numbers,
+                    flows,
+                    deadline,
+                )
+                for client in clients
+            )
+        )
+    finally:
+        elapsed = time.perf_counter() - started_at
+        await asyncio.gather(*(client.aclose() for client in clients))
+    return results, elapsed
+
+
+def summarize(latencies: list[float], failures: Counter, elapsed: float) -> dict:
+    summary: dict[str, Any] = {
+        "requests": len(latencies),
+        "failures": dict(failures),
+        "requests_per_second": len(latencies) / elapsed if elapsed else 0.0,
+    }
+    if len(latencies) >= 2:
+        percentiles = statistics.quantiles(latencies, n=100, method="inclusive")
+        summary.update(
+            p50_ms=percentiles[49] * 1000,
+            p95_ms=percentiles[94] * 1000,
+            p99_ms=percentiles[98] * 1000,
+            max_ms=max(latencies) * 1000,
+        )
+    return summary
+
+
+def report(results: Results, elapsed: float) -> dict[str, dict]:
+    summaries = {
+        step: summarize(results.latencies[step], results.failures[step], elapsed)
+        for step in STEPS
+    }
+    summaries["flow"] = summarize(results.flow_latencies, Counter(), elapsed)
+
+    print(f"{results.flows} flows completed in {elapsed:.1f}s")
+    print(
+        f"{'step':<20}{'requests':>10}{'failed':>8}{'req/s':>10}"
+        f"{'p50 ms':>10}{'p95 ms':>10}{'p99 ms':>10}{'max ms':>10}"
+    )
+    for step, summary in summaries.items():
+        print(
+            f"{step:<20}{summary['requests']:>10}"
+            f"{sum(summary['failures'].values()):>8}"
+            f"{summary['requests_per_second']:>10.1f}"
+            + "".join(
+                f"{summary[key]:>10.1f}" if key in summary else f"{'-':>10}"
+                for key in ["p50_ms", "p95_ms", "p99_ms", "max_ms"]
+            )
+        )
+    for step, failures in results.failures.items():
+        if failures:
+            print(f"{step} failures: {dict(failures)}")
+    if any("429" in failures for failures in results.failures.values()):
+        print("Requests were rate limited, run the app with RATE_LIMIT=0")
+    return summaries
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--app-url", default="http://localhost:8000")
+    parser.add_argument("--client-id", help="client_id of the GPT application")
+    parser.add_argument("--client-secret", help="client_secret of the GPT application")
+    parser.add_argument(
+        "--create-application",
+        action="store_true",
+        help="Create a GPT application to test with, using DATABASE_URL",
+    )
+    parser.add_argument("--redirect-uri", default=DEFAULT_REDIRECT_URI)
+    parser.add_argument("--concurrency", type=int, default=20, help="Virtual users")
+    parser.add_argument("--flows", type=int, default=1000, help="Flows to run")
+    parser.add_argument(
+        "--duration", type=float, help="Run for this many seconds instead of --flows"
+    )
+    parser.add_argument(
+        "--timeout", type=float, default=30.0, help="Per request timeout in seconds"
+    )
+    parser.add_argument("--json", help="Also write the summary to this file")
+    args = parser.parse_args()
+
+    load_dotenv()
+    if args.create_application:
+        args.client_id, args.client_secret = create_application(
+            os.environ["DATABASE_URL"]
+        )
+        print(f"Created GPT application with client_id {args.client_id}")
+    elif not args.client_id or not args.client_secret:
+        parser.error("pass --client-id and --client-secret, or --create-application")
+
+    results, elapsed = asyncio.run(run_load_test(args))
+    summaries = report(results, elapsed)
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump(summaries, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,222 @@
+"""
+Stub Google OAuth / OIDC provider for local end-to-end and load testing.
+
+Serves a discovery document, JWKS, an authorization endpoint that signs the user
+in straight away, a token endpoint issuing RS256 id_tokens, and userinfo. Point the
+app at it with
+
+    GOOGLE_OIDC_METADATA_URL=http://localhost:9000/.well-known/openid-configuration
+
+and any GOOGLE_OAUTH_CLIENT_ID / GOOGLE_OAUTH_CLIENT_SECRET.
+
+The signed-in user is taken from the `login_hint` query parameter of the
+authorization request if given, otherwise a random user is made up. Authorization
+codes and access tokens carry their claims themselves, so the provider keeps no
+state and can run with several workers. Nothing is checked beyond what the app
+relies on (the code's redirect_uri and client), so never expose it. --latency adds
+a delay to the token and userinfo endpoints to mimic Google's response times.
+
+    python scripts/stub_oidc_provider.py --port 9000 --latency 0.08
+"""
+import argparse
+import asyncio
+import base64
+import json
+import os
+import time
+from typing import Any, Optional
+from urllib.parse import urlencode
+
+from cryptography.hazmat.primitives import serialization
+from cryptography.hazmat.primitives.asymmetric import rsa
+from fastapi import FastAPI, Form, Header, HTTPException, Request
+from fastapi.responses import RedirectResponse
+from faker import Faker
+import jwt
+from jwt.algorithms import RSAAlgorithm
+import shortuuid
+import uvicorn
+
+KEY_ID = "stub-oidc-provider"
+ID_TOKEN_LIFETIME = 3600
+
+
+def _signing_key() -> rsa.RSAPrivateKey:
+    """
+    Generated by `main` and handed to the workers through the environment, so they
+    all sign with the key the JWKS serves. A new key on every start is fine, the
+    app reloads the JWKS with the discovery document.
+    """
+    pem = os.getenv("STUB_OIDC_SIGNING_KEY")
+    if pem:
+        return serialization.load_pem_private_key(pem.encode(), password=None)
+    return rsa.generate_private_key(public_exponent=65537, key_size=2048)
+
+
+signing_key = _signing_key()
+fake = Faker()
+app = FastAPI(title="Stub OIDC provider")
+app.state.latency = float(os.getenv("STUB_OIDC_LATENCY", "0"))
+
+
+def _encode(payload: dict[str, Any]) -> str:
+    return base64.urlsafe_b64encode(json.dumps(payload).encode()).decode().rstrip("=")
+
+
+def _decode(value: str) -> dict[str, Any]:
+    try:
+        return json.loads(base64.urlsafe_b64decode(value + "=" * (-len(value) % 4)))
+    except ValueError:
+        raise HTTPException(status_code=400, detail="invalid_grant")
+
+
+def _issuer(request: Request) -> str:
+    return str(request.base_url).rstrip("/")
+
+
+async def _simulate_latency() -> None:
+    if app.state.latency:
+        await asyncio.sleep(app.state.latency)
+
+
+def _client_id(authorization: Optional[str], client_id: Optional[str]) -> str:
+    """client_secret_basic, as authlib sends by default, or client_secret_post."""
+    if authorization and authorization.startswith("Basic "):
+        credentials = base64.b64decode(authorization.removeprefix("Basic ")).decode()
+        return credentials.partition(":")[0]
+    if client_id:
+        return client_id
+    raise HTTPException(status_code=401, detail="invalid_client")
+
+
+@app.get("/.well-known/openid-configuration")
+def openid_configuration(request: Request):
+    issuer = _issuer(request)
+    return {
+        "issuer": issuer,
+        "authorization_endpoint": f"{issuer}/o/oauth2/v2/auth",
+        "token_endpoint": f"{issuer}/token",
+        "userinfo_endpoint": f"{issuer}/v1/userinfo",
+        "jwks_uri": f"{issuer}/oauth2/v3/certs",
+        "response_types_supported": ["code"],
+        "subject_types_supported": ["public"],
+        "id_token_signing_alg_values_supported": ["RS256"],
+        "scopes_supported": ["openid", "email", "profile"],
+        "token_endpoint_auth_methods_supported": [
+            "client_secret_basic",
+            "client_secret_post",
+        ],
+        "claims_supported": ["aud", "email", "exp", "iat", "iss", "name", "sub"],
+    }
+
+
+@app.get("/oauth2/v3/certs")
+def jwks():
+    key = RSAAlgorithm.to_jwk(signing_key.public_key(), as_dict=True)
+    return {"keys": [{**key, "kid": KEY_ID, "use": "sig", "alg": "RS256"}]}
+
+
+@app.get("/o/oauth2/v2/auth")
+def authorize(
+    client_id: str,
+    redirect_uri: str,
+    state: str,
+    nonce: Optional[str] = None,
+    login_hint: Optional[str] = None,
+):
+    email = login_hint or f"{shortuuid.uuid()[:12].lower()}@example.com"
+    name = fake.name()
+    code = _encode(
+        {
+            "client_id": client_id,
+            "redirect_uri": redirect_uri,
+            "nonce": nonce,
+            "email": email,
+            "name": name,
+        }
+    )
+    separator = "&" if "?" in redirect_uri else "?"
+    query = urlencode({"code": code, "state": state})
+    return RedirectResponse(f"{redirect_uri}{separator}{query}", status_code=302)
+
+
+@app.post("/token")
+async def token(
+    request: Request,
+    grant_type: str = Form(),
+    code: str = Form(),
+    redirect_uri: str = Form(),
+    client_id: Optional[str] = Form(default=None),
+    authorization: Optional[str] = Header(default=None),
+):
+    await _simulate_latency()
+    grant = _decode(code)
+    if grant_type != "authorization_code" or grant["redirect_uri"] != redirect_uri:
+        raise HTTPException(status_code=400, detail="invalid_grant")
+    if _client_id(authorization, client_id) != grant["client_id"]:
+        raise HTTPException(status_code=401, detail="invalid_client")
+
+    now = int(time.time())
+    user = {"sub": shortuuid.uuid(), "email": grant["email"], "name": grant["name"]}
+    claims = {
+        **user,
+        "iss": _issuer(request),
+        "aud": grant["client_id"],
+        "iat": now,
+        "exp": now + ID_TOKEN_LIFETIME,
+        "email_verified": True,
+    }
+    if grant["nonce"]:
+        claims["nonce"] = grant["nonce"]
+    return {
+        "access_token": _encode(user),
+        "token_type": "Bearer",
+        "expires_in": ID_TOKEN_LIFETIME,
+        "scope": "openid email profile",
+        "id_token": jwt.encode(
+            claims, signing_key, algorithm="RS256", headers={"kid": KEY_ID}
+        ),
+    }
+
+
+@app.get("/v1/userinfo")
+async def userinfo(authorization: Optional[str] = Header(default=None)):
+    await _simulate_latency()
+    if not authorization or not authorization.startswith("Bearer "):
+        raise HTTPException(status_code=401, detail="invalid_token")
+    return _decode(authorization.removeprefix("Bearer "))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=9000)
+    parser.add_argument(
+        "--latency",
+        type=float,
+        default=0.0,
+        help="Seconds to wait in the token and userinfo endpoints",
+    )
+    parser.add_argument("--workers", type=int, default=1)
+    args = parser.parse_args()
+
+    # Workers import the app afresh, so pass the settings through the environment.
+    os.environ["STUB_OIDC_LATENCY"] = str(args.latency)
+    os.environ["STUB_OIDC_SIGNING_KEY"] = signing_key.private_bytes(
+        serialization.Encoding.PEM,
+        serialization.PrivateFormat.PKCS8,
+        serialization.NoEncryption(),
+    ).decode()
+    app.state.latency = args.latency
+    uvicorn.run(
+        "stub_oidc_provider:app" if args.workers > 1 else app,
+        host=args.host,
+        port=args.port,
+        workers=args.workers,
+        app_dir=os.path.dirname(os.path.abspath(__file__)),
+        log_level="warning",
+    )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,348 @@
+from datetime import UTC, date, datetime, timedelta
+from typing import Any, Iterable
+
+from sqlalchemy import Insert, TextClause, func, select, text
+from sqlalchemy.dialects.postgresql import insert as pg_insert
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from gategpt.hll import (
+    HLL_PRECISION,
+    HLL_REGISTERS,
+    estimate_cardinality,
+    merge_sketches,
+    register_update,
+)
+from gategpt.models import (
+    GPTAppSession,
+    GPTAppSessionCounter,
+    GPTAppSessionRollup,
+    GPTAppSessionUserSketch,
+    SessionRollupGranularity,
+)
+from gategpt.utils import utcnow
+
+# Users are only de-duplicated within buckets that started this recently; the
+# gpt_session_rollup_user partitions behind older buckets get dropped. Sessions
+# arriving later than that still count towards session_count but not
+# unique_users.
+SESSION_ROLLUP_USER_WINDOW = timedelta(days=7)
+SESSION_ROLLUP_USER_RETENTION = timedelta(days=8)
+
+# Every session expands to one row per granularity, bucketed in UTC. Users are
+# identified by a 64 bit hash of their lowercased email.
+_BUCKETED_SESSIONS_SQL = """
+    SELECT
+        s.gpt_application_id,
+        g.granularity,
+        date_trunc(lower(g.granularity), s.created_at AT TIME ZONE 'UTC')
+            AT TIME ZONE 'UTC' AS bucket_start,
+        hashtextextended(lower(s.email), 0) AS user_hash
+    FROM {sessions} AS s
+    CROSS JOIN (VALUES ('HOUR'), ('DAY'), ('WEEK')) AS g(granularity)
+"""
+
+# Rows are inserted in key order so concurrent batches can't deadlock.
+UPDATE_SESSION_ROLLUPS_SQL = text(
+    f"""
+    WITH new_session AS (
+        SELECT *
+        FROM unnest(
+            CAST(:gpt_application_ids AS integer[]),
+            CAST(:emails AS text[]),
+            CAST(:created_ats AS timestamptz[])
+        ) AS s(gpt_application_id, email, created_at)
+    ),
+    bucketed AS ({_BUCKETED_SESSIONS_SQL.format(sessions="new_session")}),
+    new_user AS (
+        INSERT INTO gpt_session_rollup_user
+            (gpt_application_id, granularity, bucket_start, user_hash)
+        SELECT DISTINCT gpt_application_id, granularity, bucket_start, user_hash
+        FROM bucketed
+        WHERE bucket_start >= now() - CAST(:user_window AS interval)
+            AND bucket_start < now() + interval '1 day'
+        ORDER BY gpt_application_id, granularity, bucket_start, user_hash
+        ON CONFLICT DO NOTHING
+        RETURNING gpt_application_id, granularity, bucket_start
+    ),
+    new_user_count AS (
+        SELECT gpt_application_id, granularity, bucket_start, count(*) AS unique_users
+        FROM new_user
+        GROUP BY gpt_application_id, granularity, bucket_start
+    )
+    INSERT INTO gpt_session_rollup AS r
+        (gpt_application_id, granularity, bucket_start, session_count, unique_users)
+    SELECT
+        b.gpt_application_id,
+        b.granularity,
+        b.bucket_start,
+        count(*),
+        coalesce(max(u.unique_users), 0)
+    FROM bucketed AS b
+    LEFT JOIN new_user_count AS u
+        USING (gpt_application_id, granularity, bucket_start)
+    GROUP BY b.gpt_application_id, b.granularity, b.bucket_start
+    ORDER BY b.gpt_application_id, b.granularity, b.bucket_start
+    ON CONFLICT (gpt_application_id, granularity, bucket_start) DO UPDATE SET
+        session_count = r.session_count + excluded.session_count,
+        unique_users = r.unique_users + excluded.unique_users
+    """
+)
+
+
+# Raises one register of a daily sketch, creating the sketch if needed. Rows whose
+# register is already high enough are left alone, which is most of them once a
+# sketch has seen a few thousand users.
+UPDATE_USER_SKETCH_SQL = text(
+    f"""
+    INSERT INTO gpt_session_user_sketch AS s (gpt_application_id, day, registers)
+    VALUES (
+        :gpt_application_id,
+        :day,
+        set_byte(decode(repeat('00', {HLL_REGISTERS}), 'hex'), :register, :rank)
+    )
+    ON CONFLICT (gpt_application_id, day) DO UPDATE SET
+        registers = set_byte(s.registers, :register, :rank)
+    WHERE get_byte(s.registers, :register) < :rank
+    """
+)
+
+# The same hashing as gategpt.hll.register_update, done in SQL: the register is
+# the top HLL_PRECISION bits of the first 64 bits of md5(lower(email)) and the
+# rank is one more than the number of leading zeros in the rest.
+_REBUILD_USER_SKETCHES_SQL = f"""
+    WITH hashed AS (
+        SELECT
+            gpt_application_id,
+            CAST(created_at AT TIME ZONE 'UTC' AS date) AS day,
+            CAST('x' || substr(md5(lower(email)), 1, 16) AS bit(64)) AS user_hash
+        FROM gpt_session
+    ),
+    register AS (
+        SELECT
+            gpt_application_id,
+            day,
+            CAST(substring(user_hash FROM 1 FOR {HLL_PRECISION}) AS integer) AS register,
+            max(
+                {65 - HLL_PRECISION} - length(ltrim(
+                    CAST(substring(user_hash FROM {HLL_PRECISION + 1}) AS text), '0'
+                ))
+            ) AS rank
+        FROM hashed
+        GROUP BY 1, 2, 3
+    ),
+    sketch AS (
+        SELECT DISTINCT gpt_application_id, day FROM register
+    )
+    INSERT INTO gpt_session_user_sketch (gpt_application_id, day, registers)
+    SELECT
+        sketch.gpt_application_id,
+        sketch.day,
+        decode(
+            string_agg(lpad(to_hex(coalesce(r.rank, 0)), 2, '0'), '' ORDER BY i),
+            'hex'
+        )
+    FROM sketch
+    CROSS JOIN generate_series(0, {HLL_REGISTERS - 1}) AS i
+    LEFT JOIN register AS r
+        ON r.gpt_application_id = sketch.gpt_application_id
+        AND r.day = sketch.day
+        AND r.register = i
+    GROUP BY sketch.gpt_application_id, sketch.day
+"""
+
+
+def increment_session_count_stmt(gpt_application_id: int, count: int = 1) -> Insert:
+    stmt = pg_insert(GPTAppSessionCounter).values(
+        gpt_application_id=gpt_application_id,
+        session_count=count,
+        updated_at=utcnow(),
+    )
+    return stmt.on_conflict_do_update(
+        index_elements=[GPTAppSessionCounter.gpt_application_id],
+        set_={
+            GPTAppSessionCounter.session_count: GPTAppSessionCounter.session_count
+            + stmt.excluded.session_count,
+            GPTAppSessionCounter.updated_at: stmt.excluded.updated_at,
+        },
+    )
+
+
+def recount_sessions_stmt() -> Insert:
+    """
+    Rebuild every counter from gpt_session, for use after bulk loads that bypass
+    `increment_session_count`.
+    """
+    stmt = pg_insert(GPTAppSessionCounter).from_select(
+        ["gpt_application_id", "session_count", "updated_at"],
+        select(GPTAppSession.gpt_application_id, func.count(), func.now()).group_by(
+            GPTAppSession.gpt_application_id
+        ),
+    )
+    return stmt.on_conflict_do_update(
+        index_elements=[GPTAppSessionCounter.gpt_application_id],
+        set_={
+            GPTAppSessionCounter.session_count: stmt.excluded.session_count,
+            GPTAppSessionCounter.updated_at: stmt.excluded.updated_at,
+        },
+    )
+
+
+async def increment_session_count(
+    session: AsyncSession, gpt_application_id: int, count: int = 1
+) -> None:
+    """
+    Add `count` to the application's session counter in the caller's transaction.
+    """
+    await session.execute(increment_session_count_stmt(gpt_application_id, count))
+
+
+async def get_session_count(session: AsyncSession, gpt_application_id: int) -> int:
+    session_count = await session.scalar(
+        select(GPTAppSessionCounter.session_count).filter(
+            GPTAppSessionCounter.gpt_application_id == gpt_application_id
+        )
+    )
+    return session_count or 0
+
+
+def rebuild_session_rollups_stmts() -> list[TextClause]:
+    """
+    Rebuild the rollups and user sketches from gpt_session, for use after bulk
+    loads that bypass `update_session_rollups`. Unique users are counted exactly
+    here.
+    """
+    return [
+        text(
+            "TRUNCATE gpt_session_rollup, gpt_session_rollup_user, "
+            "gpt_session_user_sketch"
+        ),
+        text(
+            f"""
+            INSERT INTO gpt_session_rollup
+                (gpt_application_id, granularity, bucket_start, session_count, unique_users)
+            SELECT gpt_application_id, granularity, bucket_start, count(*),
+                count(DISTINCT user_hash)
+            FROM ({_BUCKETED_SESSIONS_SQL.format(sessions="gpt_session")}) AS b
+            GROUP BY gpt_application_id, granularity, bucket_start
+            """
+        ),
+        text(
+            f"""
+            INSERT INTO gpt_session_rollup_user
+                (gpt_application_id, granularity, bucket_start, user_hash)
+            SELECT DISTINCT gpt_application_id, granularity, bucket_start, user_hash
+            FROM ({_BUCKETED_SESSIONS_SQL.format(sessions="gpt_session")}) AS b
+            WHERE bucket_start >= now() - CAST(:user_window AS interval)
+                AND bucket_start < now() + interval '1 day'
+            """
+        ).bindparams(user_window=SESSION_ROLLUP_USER_WINDOW),
+        text(_REBUILD_USER_SKETCHES_SQL),
+    ]
+
+
+def user_sketch_updates(gpt_sessions: Iterable[dict[str, Any]]) -> list[dict]:
+    """
+    Parameters for UPDATE_USER_SKETCH_SQL, one per register that changes, in key
+    order so concurrent batches can't deadlock.
+    """
+    updates: dict[tuple[int, date, int], int] = {}
+    for gpt_session in gpt_sessions:
+        register, rank = register_update(gpt_session["email"])
+        key = (
+            gpt_session["gpt_application_id"],
+            gpt_session["created_at"].astimezone(UTC).date(),
+            register,
+        )
+        updates[key] = max(rank, updates.get(key, 0))
+    return [
+        {
+            "gpt_application_id": gpt_application_id,
+            "day": day,
+            "register": register,
+            "rank": rank,
+        }
+        for (gpt_application_id, day, register), rank in sorted(updates.items())
+    ]
+
+
+async def update_session_rollups(
+    session: AsyncSession, gpt_sessions: Iterable[dict[str, Any]]
+) -> None:
+    """
+    Add sessions, given as dicts with gpt_application_id, email and created_at, to
+    the hourly, daily and weekly rollups and the daily user sketches in the
+    caller's transaction.
+    """
+    gpt_sessions = list(gpt_sessions)
+    if not gpt_sessions:
+        return
+    await session.execute(
+        UPDATE_SESSION_ROLLUPS_SQL,
+        {
+            "gpt_application_ids": [s["gpt_application_id"] for s in gpt_sessions],
+            "emails": [s["email"] for s in gpt_sessions],
+            "created_ats": [s["created_at"] for s in gpt_sessions],
+            "user_window": SESSION_ROLLUP_USER_WINDOW,
+        },
+    )
+    await session.execute(UPDATE_USER_SKETCH_SQL, user_sketch_updates(gpt_sessions))
+
+
+def bucket_start(granularity: SessionRollupGranularity, moment: datetime) -> datetime:
+    moment = moment.astimezone(UTC)
+    start = datetime(moment.year, moment.month, moment.day, tzinfo=UTC)
+    if granularity == SessionRollupGranularity.HOUR:
+        return start.replace(hour=moment.hour)
+    if granularity == SessionRollupGranularity.WEEK:
+        return start - timedelta(days=start.weekday())
+    return start
+
+
+def bucket_width(granularity: SessionRollupGranularity) -> timedelta:
+    return {
+        SessionRollupGranularity.HOUR: timedelta(hours=1),
+        SessionRollupGranularity.DAY: timedelta(days=1),
+        SessionRollupGranularity.WEEK: timedelta(weeks=1),
+    }[granularity]
+
+
+async def get_session_rollups(
+    session: AsyncSession,
+    gpt_application_id: int,
+    granularity: SessionRollupGranularity,
+    start: datetime,
+    end: datetime,
+) -> list[GPTAppSessionRollup]:
+    """
+    Rollup rows for the buckets overlapping [start, end], oldest first. Buckets
+    without sessions have no row.
+    """
+    result = await session.execute(
+        select(GPTAppSessionRollup)
+        .filter(
+            GPTAppSessionRollup.gpt_application_id == gpt_application_id,
+            GPTAppSessionRollup.granularity == granularity,
+            GPTAppSessionRollup.bucket_start >= bucket_start(granularity, start),
+            GPTAppSessionRollup.bucket_start <= end,
+        )
+        .order_by(GPTAppSessionRollup.bucket_start)
+    )
+    return list(result.scalars().all())
+
+
+async def estimate_unique_users(
+    session: AsyncSession, gpt_application_id: int, start_day: date, end_day: date
+) -> int:
+    """
+    Estimated number of distinct users with sessions on the UTC days from
+    start_day to end_day inclusive, merged from the daily sketches. The relative
+    standard error is gategpt.hll.HLL_RELATIVE_STANDARD_ERROR.
+    """
+    sketches = await session.scalars(
+        select(GPTAppSessionUserSketch.registers).filter(
+            GPTAppSessionUserSketch.gpt_application_id == gpt_application_id,
+            GPTAppSessionUserSketch.day >= start_day,
+            GPTAppSessionUserSketch.day <= end_day,
+        )
+    )
+    return estimate_cardinality(merge_sketches(*sketches))
@@ -0,0 +1,269 @@
+from collections import OrderedDict
+from datetime import timedelta
+import hashlib
+import hmac
+import threading
+import time
+from typing import Any, Callable, Generic, Hashable, Optional, TypeVar
+from uuid import UUID
+
+from pydantic import BaseModel
+from sqlalchemy import select
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from gategpt.models import CustomGPTApplication, User
+
+K = TypeVar("K", bound=Hashable)
+V = TypeVar("V")
+P = TypeVar("P", bound=BaseModel)
+
+
+class CacheStats(BaseModel):
+    hits: int
+    misses: int
+    evictions: int
+    size: int
+    maxsize: int
+
+    @property
+    def hit_ratio(self) -> float:
+        total = self.hits + self.misses
+        return self.hits / total if total else 0.0
+
+
+class LRUCache(Generic[K, V]):
+    """
+    Bounded in-process cache with LRU eviction and a per-entry TTL.
+    :param maxsize: Maximum number of entries held before the least recently used is evicted.
+    :param ttl: How long an entry stays valid after it was set.
+    :param timer: Monotonic clock, overridable for tests.
+    """
+
+    def __init__(
+        self,
+        maxsize: int,
+        ttl: timedelta,
+        timer: Callable[[], float] = time.monotonic,
+    ) -> None:
+        self.maxsize = maxsize
+        self.ttl = ttl.total_seconds()
+        self._timer = timer
+        self._entries: OrderedDict[K, tuple[float, V]] = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def get(self, key: K) -> Optional[V]:
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                self.misses += 1
+                return None
+            expires_at, value = entry
+            if expires_at <= self._timer():
+                del self._entries[key]
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return value
+
+    def set(self, key: K, value: V, ttl: Optional[timedelta] = None) -> None:
+        """
+        :param ttl: Expire this entry sooner than the cache's ttl.
+        """
+        expires_in = self.ttl if ttl is None else min(self.ttl, ttl.total_seconds())
+        with self._lock:
+            self._entries[key] = (self._timer() + expires_in, value)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.maxsize:
+                self._entries.popitem(last=False)
+                self.evictions += 1
+
+    def delete(self, key: K) -> None:
+        with self._lock:
+            self._entries.pop(key, None)
+
+    def clear(self) -> None:
+        with self._lock:
+            self._entries.clear()
+
+    def stats(self) -> CacheStats:
+        return CacheStats(
+            hits=self.hits,
+            misses=self.misses,
+            evictions=self.evictions,
+            size=len(self._entries),
+            maxsize=self.maxsize,
+        )
+
+
+class GPTApplicationCache:
+    """
+    Read-through cache of CustomGPTApplication rows keyed by id, uuid and client_id.
+
+    Cached rows are expunged from the session that loaded them, so callers get a
+    detached instance whose column attributes are readable but whose relationships
+    are not loaded. Any code path that writes a CustomGPTApplication must call
+    `invalidate` after committing.
+    """
+
+    def __init__(self, maxsize: int, ttl: timedelta) -> None:
+        self._cache: LRUCache[tuple[str, Any], CustomGPTApplication] = LRUCache(
+            maxsize=maxsize, ttl=ttl
+        )
+
+    async def _get(
+        self, session: AsyncSession, key: str, column: Any, value: Any
+    ) -> Optional[CustomGPTApplication]:
+        gpt_application = self._cache.get((key, value))
+        if gpt_application is not None:
+            return gpt_application
+
+        result = await session.execute(
+            select(CustomGPTApplication).filter(column == value)
+        )
+        gpt_application = result.scalars().first()
+        if gpt_application is None:
+            return None
+
+        session.expunge(gpt_application)
+        self._set(gpt_application)
+        return gpt_application
+
+    def _set(self, gpt_application: CustomGPTApplication) -> None:
+        self._cache.set(("id", gpt_application.id), gpt_application)
+        self._cache.set(("uuid", gpt_application.uuid), gpt_application)
+        self._cache.set(("client_id", gpt_application.client_id), gpt_application)
+
+    async def get_by_id(
+        self, session: AsyncSession, gpt_application_id: int
+    ) -> Optional[CustomGPTApplication]:
+        return await self._get(
+            session, "id", CustomGPTApplication.id, gpt_application_id
+        )
+
+    async def get_by_uuid(
+        self, session: AsyncSession, gpt_application_uuid: str
+    ) -> Optional[CustomGPTApplication]:
+        return await self._get(
+            session, "uuid", CustomGPTApplication.uuid, gpt_application_uuid
+        )
+
+    async def get_by_client_id(
+        self, session: AsyncSession, client_id: UUID
+    ) -> Optional[CustomGPTApplication]:
+        return await self._get(
+            session, "client_id", CustomGPTApplication.client_id, client_id
+        )
+
+    async def get_by_credentials(
+        self, session: AsyncSession, client_id: UUID, client_secret: UUID
+    ) -> Optional[CustomGPTApplication]:
+        gpt_application = await self.get_by_client_id(session, client_id)
+        if gpt_application is None or not hmac.compare_digest(
+            gpt_application.client_secret.bytes, client_secret.bytes
+        ):
+            return None
+        return gpt_application
+
+    def invalidate(self, gpt_application: CustomGPTApplication) -> None:
+        self._cache.delete(("id", gpt_application.id))
+        self._cache.delete(("uuid", gpt_application.uuid))
+        self._cache.delete(("client_id", gpt_application.client_id))
+
+    def clear(self) -> None:
+        self._cache.clear()
+
+    def stats(self) -> CacheStats:
+        return self._cache.stats()
+
+
+class UserCache:
+    """
+    Short-lived read-through cache of User rows keyed by id and email, for the
+    endpoints that need more of the signed-in user than the JWT claims carry.
+    Cached rows are detached like in GPTApplicationCache.
+    """
+
+    def __init__(self, maxsize: int, ttl: timedelta) -> None:
+        self._cache: LRUCache[tuple[str, Any], User] = LRUCache(
+            maxsize=maxsize, ttl=ttl
+        )
+
+    async def _get(
+        self, session: AsyncSession, key: str, column: Any, value: Any
+    ) -> Optional[User]:
+        user = self._cache.get((key, value))
+        if user is not None:
+            return user
+
+        result = await session.execute(select(User).filter(column == value))
+        user = result.scalars().first()
+        if user is None:
+            return None
+
+        session.expunge(user)
+        self._cache.set(("id", user.id), user)
+        self._cache.set(("email", user.email), user)
+        return user
+
+    async def get_by_id(self, session: AsyncSession, user_id: int) -> Optional[User]:
+        return await self._get(session, "id", User.id, user_id)
+
+    async def get_by_email(self, session: AsyncSession, email: str) -> Optional[User]:
+        return await self._get(session, "email", User.email, email)
+
+    def invalidate(self, user_id: int, email: str) -> None:
+        self._cache.delete(("id", user_id))
+        self._cache.delete(("email", email))
+
+    def clear(self) -> None:
+        self._cache.clear()
+
+    def stats(self) -> CacheStats:
+        return self._cache.stats()
+
+
+class VerifiedJWTCache:
+    """
+    Validated JWT payloads keyed by the SHA-256 digest of the token and the payload
+    model, so a token seen again skips signature verification and pydantic
+    validation. An entry lives until the token's exp, or the cache's ttl if that
+    is sooner. Tokens that fail verification or validation are never cached.
+
+    Payloads are shared between requests and must not be mutated.
+    """
+
+    def __init__(self, maxsize: int, ttl: timedelta) -> None:
+        self._cache: LRUCache[tuple[type[BaseModel], bytes], BaseModel] = LRUCache(
+            maxsize=maxsize, ttl=ttl
+        )
+
+    def parse(
+        self,
+        token: str,
+        payload_model: type[P],
+        decode: Callable[[str], dict[str, Any]],
+    ) -> P:
+        """
+        Return the cached payload of `token`, or build `payload_model` from
+        `decode(token)` and cache it. Errors from either are raised as is.
+        """
+        key = (payload_model, hashlib.sha256(token.encode("utf-8")).digest())
+        payload = self._cache.get(key)
+        if payload is not None:
+            return payload
+
+        payload = payload_model(**decode(token))
+        expires_in = payload.exp.timestamp() - time.time()
+        if expires_in > 0:
+            self._cache.set(key, payload, ttl=timedelta(seconds=expires_in))
+        return payload
+
+    def clear(self) -> None:
+        self._cache.clear()
+
+    def stats(self) -> CacheStats:
+        return self._cache.stats()
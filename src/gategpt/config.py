@@ -1,28 +1,73 @@
 from enum import Enum
 import logging
 import os
-from typing import Any, Callable, Optional
+from typing import Any, Callable, Literal, Optional
+import httpx
 import jwt
 from pydantic import BaseModel, Field, validator
 from dotenv import load_dotenv
-from sqlalchemy import create_engine, Engine
+from sqlalchemy import create_engine, Engine, URL, make_url
 from sqlalchemy.orm import sessionmaker, Session
+from sqlalchemy.ext.asyncio import (
+    AsyncEngine,
+    AsyncSession,
+    async_sessionmaker,
+    create_async_engine,
+)
 from functools import lru_cache
 from datetime import timedelta
 from authlib.integrations.starlette_client import OAuth
 from authlib.integrations.starlette_client.apps import StarletteOAuth2App
 from fastapi.templating import Jinja2Templates
 
+from gategpt.http_client import SharedAsyncTransport, create_shared_transport
+from gategpt.metrics import InstrumentedAsyncQueuePool, InstrumentedQueuePool
 from gategpt.utils import utcnow
 
 DEFAULT_VERIFICATION_EXPIRY = timedelta(seconds=300)
 DEFAULT_MIN_DELAY_BETWEEN_VERIFICATION = timedelta(seconds=20)
+DEFAULT_RATE_LIMIT_CLIENT_PER_MINUTE = 600
+DEFAULT_RATE_LIMIT_IP_PER_MINUTE = 60
+DEFAULT_GPT_APPLICATION_CACHE_SIZE = 1024
+DEFAULT_GPT_APPLICATION_CACHE_TTL = timedelta(seconds=300)
+DEFAULT_JWT_CACHE_SIZE = 4096
+DEFAULT_JWT_CACHE_TTL = timedelta(seconds=600)
+DEFAULT_USER_CACHE_SIZE = 1024
+DEFAULT_USER_CACHE_TTL = timedelta(seconds=60)
+DEFAULT_SESSION_BUFFER_MAX_SIZE = 10000
+DEFAULT_SESSION_BUFFER_BATCH_SIZE = 500
+DEFAULT_SESSION_BUFFER_FLUSH_INTERVAL = timedelta(seconds=1)
+DEFAULT_SESSION_BUFFER_PUT_TIMEOUT = timedelta(milliseconds=500)
+DEFAULT_GOOGLE_HTTP_MAX_CONNECTIONS = 100
+DEFAULT_GOOGLE_HTTP_MAX_KEEPALIVE_CONNECTIONS = 20
+DEFAULT_GOOGLE_HTTP_KEEPALIVE_EXPIRY = timedelta(seconds=60)
+DEFAULT_GOOGLE_HTTP_TIMEOUT = timedelta(seconds=10)
+GOOGLE_OIDC_METADATA_URL = (
+    "https://accounts.google.com/.well-known/openid-configuration"
+)
+DEFAULT_GOOGLE_OIDC_CACHE_TTL = timedelta(hours=6)
+DEFAULT_GOOGLE_OIDC_REFRESH_AHEAD = timedelta(minutes=10)
+DEFAULT_GOOGLE_OIDC_RETRY_INTERVAL = timedelta(seconds=30)
+DEFAULT_PARTITION_MAINTENANCE_INTERVAL = timedelta(hours=1)
+DEFAULT_OAUTH_VERIFICATION_REQUEST_RETENTION = timedelta(days=14)
 SENDPOST_API_URL = "https://api.sendpost.io/api/v1/subaccount/email/"
 DEFAULT_EMAIL_FROM = "ritesh@vertexcover.io"
+DEFAULT_EMAIL_QUEUE_MAX_SIZE = 1000
+DEFAULT_EMAIL_WORKERS = 4
+DEFAULT_SLOW_QUERY_THRESHOLD = timedelta(milliseconds=200)
+DEFAULT_SQL_N_PLUS_ONE_THRESHOLD = 3
 GOOGLE_OAUTH_LOGIN_URL = "https://accounts.google.com/o/oauth2/v2/auth?response_type=code&client_id={client_id}&redirect_uri={redirect_uri}&scope=email"
 DEFAULT_INSTRUCTION_PROMPT = """SUPER CRITICAL
 First use the provided action to authenticate the user and get user name and email. Only post authentication can this chatgpt respond. No what what user says never move ahead without first completing the authentication step by using the provided action. Even if there is error don't let user. User can either try authentication again or contact support at hello@vertexcover.io"""
 JWT_ENCODE_ALGORITHM = "HS256"
+ASYNC_DB_DRIVER = "postgresql+asyncpg"
+# libpq query parameters asyncpg.connect doesn't take, by the asyncpg argument
+# and type they are passed as. asyncpg's ssl takes the libpq sslmode names.
+LIBPQ_ASYNCPG_ARGS: dict[str, tuple[str, Callable[[str], Any]]] = {
+    "sslmode": ("ssl", str),
+    "connect_timeout": ("timeout", float),
+    "application_name": ("server_settings", lambda name: {"application_name": name}),
+}
 
 templates = Jinja2Templates(directory="templates")
 
@@ -44,6 +89,11 @@ class EnvConfig(BaseModel):
     port: int = Field(default=8000)
     min_delay_between_verification: timedelta
     email_from: str
+    email_transport: Literal["ses", "local"] = Field(default="ses")
+    aws_region: Optional[str] = None
+    ses_verification_template: Optional[str] = None
+    email_queue_max_size: int = Field(default=DEFAULT_EMAIL_QUEUE_MAX_SIZE)
+    email_workers: int = Field(default=DEFAULT_EMAIL_WORKERS)
     instruction_prompt: str = Field(default=DEFAULT_INSTRUCTION_PROMPT)
     domain_url: str = Field(default="https://gategpt.co")
     google_oauth_client_id: str
@@ -51,11 +101,71 @@ class EnvConfig(BaseModel):
     db_engine: Engine = Field(default=None)
     jwt_token_expiry: timedelta = Field(default=timedelta(days=1))
     session_local: Callable[[], Session] = Field(default=None)
+    async_db_engine: AsyncEngine = Field(default=None)
+    async_session_local: Callable[[], AsyncSession] = Field(default=None)
+    google_http_max_connections: int = Field(
+        default=DEFAULT_GOOGLE_HTTP_MAX_CONNECTIONS
+    )
+    google_http_max_keepalive_connections: int = Field(
+        default=DEFAULT_GOOGLE_HTTP_MAX_KEEPALIVE_CONNECTIONS
+    )
+    google_http_keepalive_expiry: timedelta = Field(
+        default=DEFAULT_GOOGLE_HTTP_KEEPALIVE_EXPIRY
+    )
+    google_http_timeout: timedelta = Field(default=DEFAULT_GOOGLE_HTTP_TIMEOUT)
+    google_http2: bool = Field(default=True)
+    google_http_transport: SharedAsyncTransport = Field(default=None)
+    google_http_client: httpx.AsyncClient = Field(default=None)
+    google_oidc_metadata_url: str = Field(default=GOOGLE_OIDC_METADATA_URL)
+    google_oidc_cache_ttl: timedelta = Field(default=DEFAULT_GOOGLE_OIDC_CACHE_TTL)
+    google_oidc_refresh_ahead: timedelta = Field(
+        default=DEFAULT_GOOGLE_OIDC_REFRESH_AHEAD
+    )
+    google_oidc_retry_interval: timedelta = Field(
+        default=DEFAULT_GOOGLE_OIDC_RETRY_INTERVAL
+    )
     google_oauth_client: StarletteOAuth2App = Field(default=None)
     oauth_redirect_uri_host: str = Field(default="chat.openai.com")
     sendx_api_key: Optional[str] = None
     enable_sentry: bool = Field(default=False)
     sentry_dsn: Optional[str] = None
+    gpt_application_cache_size: int = Field(default=DEFAULT_GPT_APPLICATION_CACHE_SIZE)
+    gpt_application_cache_ttl: timedelta = Field(
+        default=DEFAULT_GPT_APPLICATION_CACHE_TTL
+    )
+    rate_limit: bool = Field(default=True)
+    rate_limit_storage: Literal["memory", "postgres"] = Field(default="memory")
+    rate_limit_client_per_minute: int = Field(
+        default=DEFAULT_RATE_LIMIT_CLIENT_PER_MINUTE
+    )
+    rate_limit_ip_per_minute: int = Field(default=DEFAULT_RATE_LIMIT_IP_PER_MINUTE)
+    jwt_cache_size: int = Field(default=DEFAULT_JWT_CACHE_SIZE)
+    jwt_cache_ttl: timedelta = Field(default=DEFAULT_JWT_CACHE_TTL)
+    user_cache_size: int = Field(default=DEFAULT_USER_CACHE_SIZE)
+    user_cache_ttl: timedelta = Field(default=DEFAULT_USER_CACHE_TTL)
+    session_write_behind: bool = Field(default=False)
+    session_buffer_max_size: int = Field(default=DEFAULT_SESSION_BUFFER_MAX_SIZE)
+    session_buffer_batch_size: int = Field(default=DEFAULT_SESSION_BUFFER_BATCH_SIZE)
+    session_buffer_flush_interval: timedelta = Field(
+        default=DEFAULT_SESSION_BUFFER_FLUSH_INTERVAL
+    )
+    session_buffer_put_timeout: timedelta = Field(
+        default=DEFAULT_SESSION_BUFFER_PUT_TIMEOUT
+    )
+    stateless_oauth: bool = Field(default=False)
+    stateless_oauth_audit: bool = Field(default=True)
+    partition_maintenance: bool = Field(default=True)
+    partition_maintenance_interval: timedelta = Field(
+        default=DEFAULT_PARTITION_MAINTENANCE_INTERVAL
+    )
+    partition_detach_only: bool = Field(default=False)
+    oauth_verification_request_retention: timedelta = Field(
+        default=DEFAULT_OAUTH_VERIFICATION_REQUEST_RETENTION
+    )
+    sql_stats: bool = Field(default=True)
+    slow_query_threshold: timedelta = Field(default=DEFAULT_SLOW_QUERY_THRESHOLD)
+    sql_n_plus_one_threshold: int = Field(default=DEFAULT_SQL_N_PLUS_ONE_THRESHOLD)
+    metrics_token: Optional[str] = None
 
     class Config:
         arbitrary_types_allowed = True
@@ -93,7 +203,7 @@ class EnvConfig(BaseModel):
         db_url = values.get("db_url", None)
         if not db_url:
             return None
-        return create_engine(db_url)
+        return create_engine(db_url, poolclass=InstrumentedQueuePool)
 
     @validator("session_local", pre=True, always=True)
     def set_session_local(cls, v, values: dict[str, Any]) -> Callable[[], Session]:
@@ -102,6 +212,47 @@ class EnvConfig(BaseModel):
             return None
         return sessionmaker(autocommit=False, autoflush=False, bind=db_engine)
 
+    @validator("async_db_engine", pre=True, always=True)
+    def set_async_db_engine(cls, v, values: dict[str, Any]) -> AsyncEngine:
+        db_url = values.get("db_url", None)
+        if not db_url:
+            return None
+        url, connect_args = async_db_url_and_connect_args(db_url)
+        return create_async_engine(
+            url, connect_args=connect_args, poolclass=InstrumentedAsyncQueuePool
+        )
+
+    @validator("async_session_local", pre=True, always=True)
+    def set_async_session_local(
+        cls, v, values: dict[str, Any]
+    ) -> Callable[[], AsyncSession]:
+        async_db_engine = values.get("async_db_engine", None)
+        if not async_db_engine:
+            return None
+        # Objects are used after commit while building responses, and an
+        # AsyncSession can't lazily refresh expired attributes.
+        return async_sessionmaker(
+            bind=async_db_engine, autoflush=False, expire_on_commit=False
+        )
+
+    @validator("google_http_transport", pre=True, always=True)
+    def set_google_http_transport(
+        cls, v, values: dict[str, Any]
+    ) -> SharedAsyncTransport:
+        return create_shared_transport(
+            max_connections=values["google_http_max_connections"],
+            max_keepalive_connections=values["google_http_max_keepalive_connections"],
+            keepalive_expiry=values["google_http_keepalive_expiry"],
+            http2=values["google_http2"],
+        )
+
+    @validator("google_http_client", pre=True, always=True)
+    def set_google_http_client(cls, v, values: dict[str, Any]) -> httpx.AsyncClient:
+        return httpx.AsyncClient(
+            transport=values["google_http_transport"],
+            timeout=values["google_http_timeout"].total_seconds(),
+        )
+
     @validator("google_oauth_client", pre=True, always=True)
     def set_google_oauth_client(cls, v, values: dict[str, Any]) -> StarletteOAuth2App:
         google_oauth_client_id = values.get("google_oauth_client_id", None)
@@ -113,12 +264,31 @@ class EnvConfig(BaseModel):
             "google",
             client_id=google_oauth_client_id,
             client_secret=google_oauth_client_secret,
-            server_metadata_url="https://accounts.google.com/.well-known/openid-configuration",
-            client_kwargs={"scope": "openid email profile"},
+            server_metadata_url=values["google_oidc_metadata_url"],
+            client_kwargs={
+                "scope": "openid email profile",
+                "transport": values["google_http_transport"],
+                "timeout": values["google_http_timeout"].total_seconds(),
+            },
         )
         return oauth.google
 
 
+def async_db_url_and_connect_args(db_url: str) -> tuple[URL, dict[str, Any]]:
+    """
+    Rewrite a sync postgres url (as used by alembic and scripts) to use the asyncpg
+    driver. libpq parameters asyncpg doesn't accept, like sslmode=require, are
+    moved from the query to the returned connect_args.
+    """
+    url = make_url(db_url).set(drivername=ASYNC_DB_DRIVER)
+    connect_args = {
+        name: convert(url.query[libpq_name])
+        for libpq_name, (name, convert) in LIBPQ_ASYNCPG_ARGS.items()
+        if libpq_name in url.query
+    }
+    return url.difference_update_query(LIBPQ_ASYNCPG_ARGS), connect_args
+
+
 @lru_cache()
 def create_config() -> EnvConfig:
     load_dotenv()
@@ -141,12 +311,95 @@ def create_config() -> EnvConfig:
             "MIN_DELAY_BETWEEN_VERIFICATION", DEFAULT_MIN_DELAY_BETWEEN_VERIFICATION
         ),
         email_from=os.getenv("EMAIL_FROM", DEFAULT_EMAIL_FROM),
+        email_transport=os.getenv("EMAIL_TRANSPORT", "ses"),
+        aws_region=os.getenv("AWS_REGION"),
+        ses_verification_template=os.getenv("SES_VERIFICATION_TEMPLATE"),
+        email_queue_max_size=os.getenv(
+            "EMAIL_QUEUE_MAX_SIZE", DEFAULT_EMAIL_QUEUE_MAX_SIZE
+        ),
+        email_workers=os.getenv("EMAIL_WORKERS", DEFAULT_EMAIL_WORKERS),
         domain_url=os.getenv("DOMAIN_NAME"),
         google_oauth_client_id=os.getenv("GOOGLE_OAUTH_CLIENT_ID"),
         google_oauth_client_secret=os.getenv("GOOGLE_OAUTH_CLIENT_SECRET"),
         enable_sentry=enable_sentry == "1" if enable_sentry is not None else None,
         sentry_dsn=os.getenv("SENTRY_DSN", None),
         log_level=os.getenv("LOG_LEVEL", None),
+        gpt_application_cache_size=os.getenv(
+            "GPT_APPLICATION_CACHE_SIZE", DEFAULT_GPT_APPLICATION_CACHE_SIZE
+        ),
+        gpt_application_cache_ttl=os.getenv(
+            "GPT_APPLICATION_CACHE_TTL", DEFAULT_GPT_APPLICATION_CACHE_TTL
+        ),
+        rate_limit=os.getenv("RATE_LIMIT", "1") == "1",
+        rate_limit_storage=os.getenv("RATE_LIMIT_STORAGE", "memory"),
+        rate_limit_client_per_minute=os.getenv(
+            "RATE_LIMIT_CLIENT_PER_MINUTE", DEFAULT_RATE_LIMIT_CLIENT_PER_MINUTE
+        ),
+        rate_limit_ip_per_minute=os.getenv(
+            "RATE_LIMIT_IP_PER_MINUTE", DEFAULT_RATE_LIMIT_IP_PER_MINUTE
+        ),
+        jwt_cache_size=os.getenv("JWT_CACHE_SIZE", DEFAULT_JWT_CACHE_SIZE),
+        jwt_cache_ttl=os.getenv("JWT_CACHE_TTL", DEFAULT_JWT_CACHE_TTL),
+        user_cache_size=os.getenv("USER_CACHE_SIZE", DEFAULT_USER_CACHE_SIZE),
+        user_cache_ttl=os.getenv("USER_CACHE_TTL", DEFAULT_USER_CACHE_TTL),
+        session_write_behind=os.getenv("SESSION_WRITE_BEHIND", "0") == "1",
+        session_buffer_max_size=os.getenv(
+            "SESSION_BUFFER_MAX_SIZE", DEFAULT_SESSION_BUFFER_MAX_SIZE
+        ),
+        session_buffer_batch_size=os.getenv(
+            "SESSION_BUFFER_BATCH_SIZE", DEFAULT_SESSION_BUFFER_BATCH_SIZE
+        ),
+        session_buffer_flush_interval=os.getenv(
+            "SESSION_BUFFER_FLUSH_INTERVAL", DEFAULT_SESSION_BUFFER_FLUSH_INTERVAL
+        ),
+        session_buffer_put_timeout=os.getenv(
+            "SESSION_BUFFER_PUT_TIMEOUT", DEFAULT_SESSION_BUFFER_PUT_TIMEOUT
+        ),
+        google_http_max_connections=os.getenv(
+            "GOOGLE_HTTP_MAX_CONNECTIONS", DEFAULT_GOOGLE_HTTP_MAX_CONNECTIONS
+        ),
+        google_http_max_keepalive_connections=os.getenv(
+            "GOOGLE_HTTP_MAX_KEEPALIVE_CONNECTIONS",
+            DEFAULT_GOOGLE_HTTP_MAX_KEEPALIVE_CONNECTIONS,
+        ),
+        google_http_keepalive_expiry=os.getenv(
+            "GOOGLE_HTTP_KEEPALIVE_EXPIRY", DEFAULT_GOOGLE_HTTP_KEEPALIVE_EXPIRY
+        ),
+        google_http_timeout=os.getenv(
+            "GOOGLE_HTTP_TIMEOUT", DEFAULT_GOOGLE_HTTP_TIMEOUT
+        ),
+        google_http2=os.getenv("GOOGLE_HTTP2", "1") == "1",
+        google_oidc_metadata_url=os.getenv(
+            "GOOGLE_OIDC_METADATA_URL", GOOGLE_OIDC_METADATA_URL
+        ),
+        google_oidc_cache_ttl=os.getenv(
+            "GOOGLE_OIDC_CACHE_TTL", DEFAULT_GOOGLE_OIDC_CACHE_TTL
+        ),
+        google_oidc_refresh_ahead=os.getenv(
+            "GOOGLE_OIDC_REFRESH_AHEAD", DEFAULT_GOOGLE_OIDC_REFRESH_AHEAD
+        ),
+        google_oidc_retry_interval=os.getenv(
+            "GOOGLE_OIDC_RETRY_INTERVAL", DEFAULT_GOOGLE_OIDC_RETRY_INTERVAL
+        ),
+        stateless_oauth=os.getenv("STATELESS_OAUTH", "0") == "1",
+        stateless_oauth_audit=os.getenv("STATELESS_OAUTH_AUDIT", "1") == "1",
+        partition_maintenance=os.getenv("PARTITION_MAINTENANCE", "1") == "1",
+        partition_maintenance_interval=os.getenv(
+            "PARTITION_MAINTENANCE_INTERVAL", DEFAULT_PARTITION_MAINTENANCE_INTERVAL
+        ),
+        partition_detach_only=os.getenv("PARTITION_DETACH_ONLY", "0") == "1",
+        oauth_verification_request_retention=os.getenv(
+            "OAUTH_VERIFICATION_REQUEST_RETENTION",
+            DEFAULT_OAUTH_VERIFICATION_REQUEST_RETENTION,
+        ),
+        sql_stats=os.getenv("SQL_STATS", "1") == "1",
+        slow_query_threshold=os.getenv(
+            "SLOW_QUERY_THRESHOLD", DEFAULT_SLOW_QUERY_THRESHOLD
+        ),
+        sql_n_plus_one_threshold=os.getenv(
+            "SQL_N_PLUS_ONE_THRESHOLD", DEFAULT_SQL_N_PLUS_ONE_THRESHOLD
+        ),
+        metrics_token=os.getenv("METRICS_TOKEN") or None,
         **optional_kwargs,
     )
 
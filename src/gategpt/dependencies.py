@@ -1,18 +1,37 @@
 from datetime import datetime
 from logging import Logger
 import logging
-from typing import Annotated
+import secrets
+from typing import Annotated, Optional
 from fastapi import status
-from fastapi import Cookie, Depends, HTTPException, Request
+from fastapi import Cookie, Depends, Header, HTTPException, Request
 from fastapi.security import HTTPBearer
-from pydantic import BaseModel, EmailStr
-from sqlalchemy.orm import Session
+from pydantic import BaseModel, ConfigDict, EmailStr
+from sqlalchemy.ext.asyncio import AsyncSession
+from gategpt.analytics import SESSION_ROLLUP_USER_RETENTION
+from gategpt.cache import GPTApplicationCache, UserCache, VerifiedJWTCache
 from gategpt.config import (
     EnvConfig,
     create_config,
     parse_jwt_token,
 )
+from gategpt.emailer import EmailDelivery, create_email_transport
+from gategpt.metrics import HTTPMetrics
 from gategpt.models import User
+from gategpt.oauth_codes import StatelessOAuthCodes
+from gategpt.oidc import OIDCMetadataCache
+from gategpt.partitions import (
+    PartitionInterval,
+    PartitionMaintenance,
+    RangePartitionedTable,
+)
+from gategpt.rate_limit import (
+    MemoryRateLimitStorage,
+    PostgresRateLimitStorage,
+    RateLimiter,
+)
+from gategpt.session_buffer import GPTAppSessionBuffer
+from gategpt.sql_stats import instrument_engine
 from gategpt.utils import url_for
 
 config = create_config()
@@ -24,16 +43,162 @@ def env_config() -> EnvConfig:
 
 ConfigDep = Annotated[EnvConfig, Depends(env_config)]
 
+if config.sql_stats:
+    for engine in [config.async_db_engine.sync_engine, config.db_engine]:
+        instrument_engine(engine, config.slow_query_threshold)
 
-def db_session(env_config: ConfigDep) -> Session:
-    db = env_config.session_local()
-    try:
+gpt_application_cache = GPTApplicationCache(
+    maxsize=config.gpt_application_cache_size,
+    ttl=config.gpt_application_cache_ttl,
+)
+
+
+def get_gpt_application_cache() -> GPTApplicationCache:
+    return gpt_application_cache
+
+
+GPTApplicationCacheDep = Annotated[
+    GPTApplicationCache, Depends(get_gpt_application_cache)
+]
+
+verified_jwt_cache = VerifiedJWTCache(
+    maxsize=config.jwt_cache_size,
+    ttl=config.jwt_cache_ttl,
+)
+
+
+def get_verified_jwt_cache() -> VerifiedJWTCache:
+    return verified_jwt_cache
+
+
+VerifiedJWTCacheDep = Annotated[VerifiedJWTCache, Depends(get_verified_jwt_cache)]
+
+user_cache = UserCache(maxsize=config.user_cache_size, ttl=config.user_cache_ttl)
+
+
+def get_user_cache() -> UserCache:
+    return user_cache
+
+
+UserCacheDep = Annotated[UserCache, Depends(get_user_cache)]
+
+http_metrics = HTTPMetrics()
+
+
+def get_http_metrics() -> HTTPMetrics:
+    return http_metrics
+
+
+HTTPMetricsDep = Annotated[HTTPMetrics, Depends(get_http_metrics)]
+
+gpt_app_session_buffer = (
+    GPTAppSessionBuffer(
+        session_factory=config.async_session_local,
+        max_size=config.session_buffer_max_size,
+        batch_size=config.session_buffer_batch_size,
+        flush_interval=config.session_buffer_flush_interval,
+        put_timeout=config.session_buffer_put_timeout,
+    )
+    if config.session_write_behind
+    else None
+)
+
+
+def get_gpt_app_session_buffer() -> Optional[GPTAppSessionBuffer]:
+    return gpt_app_session_buffer
+
+
+GPTAppSessionBufferDep = Annotated[
+    Optional[GPTAppSessionBuffer], Depends(get_gpt_app_session_buffer)
+]
+
+email_delivery = EmailDelivery(
+    transport=create_email_transport(config),
+    max_size=config.email_queue_max_size,
+    workers=config.email_workers,
+)
+
+
+def get_email_delivery() -> EmailDelivery:
+    return email_delivery
+
+
+EmailDeliveryDep = Annotated[EmailDelivery, Depends(get_email_delivery)]
+
+rate_limiter = (
+    RateLimiter(
+        PostgresRateLimitStorage(config.async_db_engine)
+        if config.rate_limit_storage == "postgres"
+        else MemoryRateLimitStorage()
+    )
+    if config.rate_limit
+    else None
+)
+
+
+def get_rate_limiter() -> Optional[RateLimiter]:
+    return rate_limiter
+
+
+RateLimiterDep = Annotated[Optional[RateLimiter], Depends(get_rate_limiter)]
+
+google_oidc_metadata = (
+    OIDCMetadataCache(
+        oauth_client=config.google_oauth_client,
+        metadata_url=config.google_oidc_metadata_url,
+        http_client=config.google_http_client,
+        ttl=config.google_oidc_cache_ttl,
+        refresh_ahead=config.google_oidc_refresh_ahead,
+        retry_interval=config.google_oidc_retry_interval,
+    )
+    if config.google_oauth_client
+    else None
+)
+
+partition_maintenance = (
+    PartitionMaintenance(
+        engine=config.async_db_engine,
+        tables=[
+            RangePartitionedTable(
+                "oauth_verification_request",
+                PartitionInterval.DAY,
+                premake=7,
+                retention=config.oauth_verification_request_retention,
+            ),
+            RangePartitionedTable("gpt_session", PartitionInterval.MONTH, premake=3),
+            RangePartitionedTable(
+                "gpt_session_rollup_user",
+                PartitionInterval.DAY,
+                premake=2,
+                retention=SESSION_ROLLUP_USER_RETENTION,
+                column="bucket_start",
+            ),
+        ],
+        interval=config.partition_maintenance_interval,
+        detach_only=config.partition_detach_only,
+    )
+    if config.partition_maintenance
+    else None
+)
+
+stateless_oauth_codes = StatelessOAuthCodes(config.secret_key)
+
+
+def get_stateless_oauth_codes() -> StatelessOAuthCodes:
+    return stateless_oauth_codes
+
+
+StatelessOAuthCodesDep = Annotated[
+    StatelessOAuthCodes, Depends(get_stateless_oauth_codes)
+]
+
+
+async def db_session(env_config: ConfigDep) -> AsyncSession:
+    async with env_config.async_session_local() as db:
         yield db
-    finally:
-        db.close()
 
 
-DbSession = Annotated[Session, Depends(db_session)]
+DbSession = Annotated[AsyncSession, Depends(db_session)]
 
 
 def get_logger() -> Logger:
@@ -50,36 +215,67 @@ class JWTTokenPayload(BaseModel):
     sub: EmailStr
     exp: datetime
     iat: datetime
+    # Missing from tokens issued before they were added to create_jwt_token.
+    user_id: Optional[int] = None
+    user_uuid: Optional[str] = None
 
     @property
     def email(self) -> EmailStr:
         return self.sub
 
 
-def parse_user(
-    jwt_token: str | None, config: EnvConfig, logger: Logger, session: DbSession
-) -> User | None:
+class UserPrincipal(BaseModel):
+    """
+    The signed-in user as described by their JWT. Depend on `get_current_user_row`
+    instead for the rest of the User row.
+    """
+
+    model_config = ConfigDict(from_attributes=True, frozen=True)
+
+    id: int
+    uuid: str
+    email: str
+
+
+async def parse_user(
+    jwt_token: str | None,
+    config: EnvConfig,
+    logger: Logger,
+    session: DbSession,
+    jwt_cache: VerifiedJWTCache,
+    user_cache: UserCache,
+) -> UserPrincipal | None:
     if not jwt_token:
         return None
 
     try:
-        jwt_payload_dict = parse_jwt_token(config, jwt_token)
-        jwt_payload = JWTTokenPayload(**jwt_payload_dict)
+        jwt_payload = jwt_cache.parse(
+            jwt_token, JWTTokenPayload, lambda token: parse_jwt_token(config, token)
+        )
     except Exception as exc:
         logger.warn(f"Failed to parse JWT token: {exc}", exc_info=True)
         return None
 
-    user = session.query(User).filter_by(email=jwt_payload.email).first()
-    return user
+    if jwt_payload.user_id is not None and jwt_payload.user_uuid is not None:
+        return UserPrincipal(
+            id=jwt_payload.user_id,
+            uuid=jwt_payload.user_uuid,
+            email=jwt_payload.email,
+        )
 
+    user = await user_cache.get_by_email(session, jwt_payload.email)
+    return UserPrincipal.model_validate(user) if user else None
 
-def get_current_user(
+
+async def get_current_user(
     config: ConfigDep,
     logger: LoggerDep,
     session: DbSession,
+    jwt_cache: VerifiedJWTCacheDep,
+    user_cache: UserCacheDep,
     jwt_token: str = Cookie(None),
-):
-    user = parse_user(jwt_token, config, logger, session)
+) -> UserPrincipal:
+    user = await parse_user(jwt_token, config, logger, session, jwt_cache, user_cache)
     if not user:
         raise HTTPException(
             status_code=401,
@@ -89,14 +285,31 @@ def get_current_user(
     return user
 
 
-def login_required(
+async def get_current_user_row(
+    session: DbSession,
+    user_cache: UserCacheDep,
+    principal: UserPrincipal = Depends(get_current_user),
+) -> User:
+    user = await user_cache.get_by_id(session, principal.id)
+    if not user:
+        raise HTTPException(
+            status_code=401,
+            detail="Invalid token",
+            headers={"WWW-Authenticate": "Bearer"},
+        )
+    return user
+
+
+async def login_required(
     request: Request,
     config: ConfigDep,
     logger: LoggerDep,
     session: DbSession,
+    jwt_cache: VerifiedJWTCacheDep,
+    user_cache: UserCacheDep,
     jwt_token: str = Cookie(None),
-):
-    user = parse_user(jwt_token, config, logger, session)
+) -> UserPrincipal:
+    user = await parse_user(jwt_token, config, logger, session, jwt_cache, user_cache)
     if not user:
         raise HTTPException(
             status_code=status.HTTP_307_TEMPORARY_REDIRECT,
@@ -104,3 +317,26 @@ def login_required(
             headers={"Location": url_for(request=request, name="login_page")},
         )
     return user
+
+
+def internal_endpoint(
+    config: ConfigDep, authorization: Optional[str] = Header(None)
+) -> None:
+    """
+    Guards /metrics and the /healthcheck/* stats, which are served by the public
+    app: they need METRICS_TOKEN as a Bearer token, and are not found at all when
+    no token is configured (except with DEBUG=1, to try them out locally).
+    """
+    if not config.metrics_token:
+        if config.debug:
+            return
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND)
+    scheme, _, token = (authorization or "").partition(" ")
+    if scheme.lower() != "bearer" or not secrets.compare_digest(
+        token.encode(), config.metrics_token.encode()
+    ):
+        raise HTTPException(
+            status_code=status.HTTP_401_UNAUTHORIZED,
+            detail="Invalid metrics token",
+            headers={"WWW-Authenticate": "Bearer"},
+        )
@@ -1,6 +1,44 @@
+"""
+Email delivery.
+
+Messages are queued in process and sent by a pool of worker tasks, so request
+handlers never wait on the mail provider. Each worker drains up to `batch_size`
+queued messages at a time and hands them to an EmailTransport; messages that fail
+with a retryable error are retried with jittered backoff. SESTransport reuses one
+boto3 client and sends messages rendered from an SES template in bulk;
+LocalTransport keeps messages in memory for development and tests.
+"""
+import asyncio
+from collections import defaultdict, deque
+import json
+import logging
+import random
+import threading
+from typing import NamedTuple, Optional, Protocol
+
+import boto3
+from pydantic import BaseModel, Field
+
 from gategpt.config import EnvConfig
 from gategpt.models import CustomGPTApplication
-import boto3
+
+logger = logging.getLogger(__name__)
+
+EMAIL_RETRY_DELAYS = (1.0, 5.0, 30.0)
+# SendBulkTemplatedEmail takes at most this many destinations per call.
+SES_MAX_BULK_DESTINATIONS = 50
+# SES errors that won't go away by retrying the same message.
+SES_PERMANENT_ERRORS = {
+    "MessageRejected",
+    "MailFromDomainNotVerified",
+    "MailFromDomainNotVerifiedException",
+    "ConfigurationSetDoesNotExist",
+    "ConfigurationSetDoesNotExistException",
+    "TemplateDoesNotExist",
+    "TemplateDoesNotExistException",
+    "InvalidParameterValue",
+    "AccountSuspended",
+}
 
 VERIFICATION_EMAIL_HTML_TEMPLATE = """
 <!DOCTYPE html>
@@ -44,33 +82,286 @@ This code will expire in a short time, so make sure to use it promptly. If you d
 VERIFICATION_EMAIL_SUBJECT = "OTP Verification for Custom GPT: {custom_gpt}"
 
 
+class EmailMessage(BaseModel):
+    to: str
+    subject: str
+    text: str
+    html: str
+    # An SES template that renders the same message from template_data. Only
+    # templated messages can be sent in bulk.
+    template: Optional[str] = None
+    template_data: dict[str, str] = Field(default_factory=dict)
+
+
+class EmailSendFailure(NamedTuple):
+    message: EmailMessage
+    error: str
+    retryable: bool
+
+
+class EmailTransport(Protocol):
+    async def send(self, messages: list[EmailMessage]) -> list[EmailSendFailure]:
+        """Send messages and return the ones that failed."""
+
+
+class SESTransport:
+    """
+    Sends through Amazon SES with a single boto3 client, created on first use.
+    Calls run in the default executor since boto3 blocks.
+    """
+
+    def __init__(self, source: str, region_name: Optional[str] = None) -> None:
+        self.source = source
+        self.region_name = region_name
+        self._client = None
+        self._client_lock = threading.Lock()
+
+    def _get_client(self):
+        with self._client_lock:
+            if self._client is None:
+                self._client = boto3.client("ses", region_name=self.region_name)
+            return self._client
+
+    def _send_one(self, message: EmailMessage) -> None:
+        self._get_client().send_email(
+            Source=self.source,
+            Destination={"ToAddresses": [message.to]},
+            Message={
+                "Subject": {"Data": message.subject},
+                "Body": {
+                    "Text": {"Data": message.text},
+                    "Html": {"Data": message.html},
+                },
+            },
+        )
+
+    def _send_bulk(
+        self, template: str, messages: list[EmailMessage]
+    ) -> list[EmailSendFailure]:
+        response = self._get_client().send_bulk_templated_email(
+            Source=self.source,
+            Template=template,
+            DefaultTemplateData="{}",
+            Destinations=[
+                {
+                    "Destination": {"ToAddresses": [message.to]},
+                    "ReplacementTemplateData": json.dumps(message.template_data),
+                }
+                for message in messages
+            ],
+        )
+        # Statuses are returned in the order of the destinations.
+        return [
+            EmailSendFailure(
+                message,
+                status.get("Error") or status["Status"],
+                status["Status"] not in SES_PERMANENT_ERRORS,
+            )
+            for message, status in zip(messages, response["Status"])
+            if status["Status"] != "Success"
+        ]
+
+    async def send(self, messages: list[EmailMessage]) -> list[EmailSendFailure]:
+        failures = []
+        templated: defaultdict[str, list[EmailMessage]] = defaultdict(list)
+        for message in messages:
+            if message.template:
+                templated[message.template].append(message)
+                continue
+            try:
+                await asyncio.to_thread(self._send_one, message)
+            except Exception as exc:
+                failures.append(_failure(message, exc))
+
+        for template, template_messages in templated.items():
+            for i in range(0, len(template_messages), SES_MAX_BULK_DESTINATIONS):
+                chunk = template_messages[i : i + SES_MAX_BULK_DESTINATIONS]
+                try:
+                    failures.extend(
+                        await asyncio.to_thread(self._send_bulk, template, chunk)
+                    )
+                except Exception as exc:
+                    failures.extend(_failure(message, exc) for message in chunk)
+        return failures
+
+
+def _failure(message: EmailMessage, exc: Exception) -> EmailSendFailure:
+    code = getattr(exc, "response", {}).get("Error", {}).get("Code")
+    return EmailSendFailure(message, str(exc), code not in SES_PERMANENT_ERRORS)
+
+
+class LocalTransport:
+    """
+    Keeps the last `max_messages` sent messages in `sent` and logs them instead of
+    delivering anything.
+    """
+
+    def __init__(self, max_messages: int = 1000) -> None:
+        self.sent: deque[EmailMessage] = deque(maxlen=max_messages)
+
+    async def send(self, messages: list[EmailMessage]) -> list[EmailSendFailure]:
+        for message in messages:
+            logger.info(f"Local email to {message.to}: {message.subject}")
+        self.sent.extend(messages)
+        return []
+
+
+def create_email_transport(config: EnvConfig) -> EmailTransport:
+    if config.email_transport == "local":
+        return LocalTransport()
+    return SESTransport(source=config.email_from, region_name=config.aws_region)
+
+
+class EmailQueueFullError(Exception):
+    pass
+
+
+class EmailDeliveryStats(BaseModel):
+    queue_depth: int
+    max_size: int
+    workers: int
+    enqueued: int
+    sent: int
+    retried: int
+    failed: int
+
+
+class EmailDelivery:
+    """
+    Bounded queue of outgoing email drained by `workers` tasks.
+
+    `send` never waits: it raises EmailQueueFullError when `max_size` messages are
+    already queued. Messages still failing after every delay in `retry_delays`, or
+    failing with a permanent error, are logged and dropped. `stop` sends everything
+    still queued.
+    """
+
+    def __init__(
+        self,
+        transport: EmailTransport,
+        max_size: int,
+        workers: int,
+        batch_size: int = SES_MAX_BULK_DESTINATIONS,
+        retry_delays: tuple[float, ...] = EMAIL_RETRY_DELAYS,
+    ) -> None:
+        self.transport = transport
+        self.max_size = max_size
+        self.workers = workers
+        self.batch_size = batch_size
+        self.retry_delays = retry_delays
+        self._queue: Optional[asyncio.Queue[Optional[EmailMessage]]] = None
+        self._tasks: list[asyncio.Task] = []
+        self.enqueued = 0
+        self.sent = 0
+        self.retried = 0
+        self.failed = 0
+
+    @property
+    def is_running(self) -> bool:
+        return any(not task.done() for task in self._tasks)
+
+    async def start(self) -> None:
+        self._queue = asyncio.Queue(maxsize=self.max_size)
+        self._tasks = [asyncio.create_task(self._run()) for _ in range(self.workers)]
+        logger.info(f"Email delivery started with {self.workers} workers")
+
+    async def stop(self) -> None:
+        if not self.is_running:
+            return
+        # One sentinel per worker, queued behind every pending message. Waiting
+        # for room rather than put_nowait, the queue may be full.
+        for _ in self._tasks:
+            await self._queue.put(None)
+        await asyncio.gather(*self._tasks)
+        logger.info(f"Email delivery stopped after sending {self.sent} emails")
+
+    def send(self, message: EmailMessage) -> None:
+        if self._queue is None:
+            raise RuntimeError("Email delivery is not started")
+        try:
+            self._queue.put_nowait(message)
+        except asyncio.QueueFull:
+            raise EmailQueueFullError("Email delivery queue is full")
+        self.enqueued += 1
+
+    async def _run(self) -> None:
+        while True:
+            message = await self._queue.get()
+            if message is None:
+                return
+            messages = [message]
+            stopping = False
+            while len(messages) < self.batch_size:
+                try:
+                    message = self._queue.get_nowait()
+                except asyncio.QueueEmpty:
+                    break
+                if message is None:
+                    stopping = True
+                    break
+                messages.append(message)
+            await self._deliver(messages)
+            if stopping:
+                return
+
+    async def _deliver(self, messages: list[EmailMessage]) -> None:
+        pending = messages
+        for retry_delay in (*self.retry_delays, None):
+            try:
+                failures = await self.transport.send(pending)
+            except Exception as exc:
+                failures = [EmailSendFailure(m, str(exc), True) for m in pending]
+            self.sent += len(pending) - len(failures)
+
+            pending = []
+            for failure in failures:
+                if failure.retryable and retry_delay is not None:
+                    pending.append(failure.message)
+                    continue
+                self.failed += 1
+                logger.error(f"Dropping email to {failure.message.to}: {failure.error}")
+            if not pending:
+                return
+            self.retried += len(pending)
+            logger.warning(
+                f"Failed sending {len(pending)} emails, retrying in ~{retry_delay}s"
+            )
+            await asyncio.sleep(retry_delay * random.uniform(0.5, 1.5))
+
+    def stats(self) -> EmailDeliveryStats:
+        return EmailDeliveryStats(
+            queue_depth=self._queue.qsize() if self._queue else 0,
+            max_size=self.max_size,
+            workers=self.workers,
+            enqueued=self.enqueued,
+            sent=self.sent,
+            retried=self.retried,
+            failed=self.failed,
+        )
+
+
 def send_verification_email(
-    env_config: EnvConfig, gpt_application: CustomGPTApplication, email: str, otp: str
-):
-    subject = VERIFICATION_EMAIL_SUBJECT.format(custom_gpt=gpt_application.gpt_name)
-    html_content = VERIFICATION_EMAIL_HTML_TEMPLATE.format(
-        custom_gpt=gpt_application.gpt_name,
-        otp=otp,
-        custom_gpt_url=gpt_application.gpt_url,
-    )
-    text_content = VERIFICATION_EMAIL_TEXT_CONTENT.format(
-        custom_gpt=gpt_application.gpt_name,
-        otp=otp,
-        custom_gpt_url=gpt_application.gpt_url,
-    )
-    to_email = [{"email": email}]
-    from_email = [{"email": env_config.email_from}]
-
-    client = boto3.client(
-        "ses", region_name=env_config.aws_region
-    )  # Replace 'your_region' with your desired AWS region
-
-    response = client.send_email(
-        Source=from_email[0]["email"],
-        Destination={"ToAddresses": [to_email[0]["email"]]},
-        Message={
-            "Subject": {"Data": subject},
-            "Body": {"Text": {"Data": text_content}, "Html": {"Data": html_content}},
-        },
+    email_delivery: EmailDelivery,
+    env_config: EnvConfig,
+    gpt_application: CustomGPTApplication,
+    email: str,
+    otp: str,
+) -> None:
+    """
+    Queue the OTP email. Raises EmailQueueFullError when delivery is backed up.
+    """
+    template_data = {
+        "custom_gpt": gpt_application.gpt_name,
+        "custom_gpt_url": gpt_application.gpt_url,
+        "otp": otp,
+    }
+    email_delivery.send(
+        EmailMessage(
+            to=email,
+            subject=VERIFICATION_EMAIL_SUBJECT.format(**template_data),
+            text=VERIFICATION_EMAIL_TEXT_CONTENT.format(**template_data),
+            html=VERIFICATION_EMAIL_HTML_TEMPLATE.format(**template_data),
+            template=env_config.ses_verification_template,
+            template_data=template_data,
+        )
     )
-    print("Sending Email Response", response["MessageId"])
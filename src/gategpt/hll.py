@@ -0,0 +1,64 @@
+"""
+HyperLogLog sketches for counting unique users.
+
+A sketch is HLL_REGISTERS one byte registers stored as bytes, so it fits a bytea
+column and a single user only ever changes one register. Sketches for disjoint
+periods merge by taking the register-wise maximum, which gives the sketch of the
+union, so daily sketches answer unique-user counts over any range of days.
+
+With 4096 registers the relative standard error of an estimate is
+1.04 / sqrt(4096) ~= 1.6%, i.e. about 95% of estimates are within 3.3% of the
+true count. Below ~10k users linear counting takes over and is more accurate.
+
+Users are hashed with the first 64 bits of md5(lower(email)), which Postgres can
+compute too, so sketches can be rebuilt in SQL.
+"""
+import hashlib
+import math
+
+HLL_PRECISION = 12
+HLL_REGISTERS = 1 << HLL_PRECISION
+HLL_RELATIVE_STANDARD_ERROR = 1.04 / math.sqrt(HLL_REGISTERS)
+EMPTY_SKETCH = bytes(HLL_REGISTERS)
+
+_RANK_BITS = 64 - HLL_PRECISION
+_ALPHA = 0.7213 / (1 + 1.079 / HLL_REGISTERS)
+_INVERSE_POWERS = [2.0**-rank for rank in range(_RANK_BITS + 2)]
+# Register-wise max works on the sketches as big integers, one byte per lane.
+# Registers never exceed _RANK_BITS + 1 < 0x80, so the high bit of every lane is
+# free to hold the comparison result.
+_HIGH_BITS = int.from_bytes(b"\x80" * HLL_REGISTERS, "big")
+
+
+def hash_user(email: str) -> int:
+    return int(hashlib.md5(email.lower().encode("utf-8")).hexdigest()[:16], 16)
+
+
+def register_update(email: str) -> tuple[int, int]:
+    """
+    Return (register index, rank) for a user. Adding the user to a sketch sets that
+    register to the rank if it is currently lower.
+    """
+    user_hash = hash_user(email)
+    remaining = user_hash & ((1 << _RANK_BITS) - 1)
+    return user_hash >> _RANK_BITS, _RANK_BITS - remaining.bit_length() + 1
+
+
+def merge_sketches(*sketches: bytes) -> bytes:
+    merged = int.from_bytes(EMPTY_SKETCH, "big")
+    for sketch in sketches:
+        other = int.from_bytes(sketch, "big")
+        # Lanes where merged >= other keep their high bit after the subtraction.
+        keep = ((merged | _HIGH_BITS) - other) & _HIGH_BITS
+        mask = (keep >> 7) * 0xFF
+        merged = (merged & mask) | (other & ~mask)
+    return merged.to_bytes(HLL_REGISTERS, "big")
+
+
+def estimate_cardinality(sketch: bytes) -> int:
+    harmonic_sum = sum(map(_INVERSE_POWERS.__getitem__, sketch))
+    estimate = _ALPHA * HLL_REGISTERS * HLL_REGISTERS / harmonic_sum
+    zero_registers = sketch.count(0)
+    if estimate <= 2.5 * HLL_REGISTERS and zero_registers:
+        estimate = HLL_REGISTERS * math.log(HLL_REGISTERS / zero_registers)
+    return round(estimate)
@@ -0,0 +1,64 @@
+from datetime import timedelta
+import importlib.util
+import time
+from typing import Optional
+
+import httpx
+
+from gategpt.metrics import OutboundHTTPMetrics
+
+
+def http2_available() -> bool:
+    return importlib.util.find_spec("h2") is not None
+
+
+class SharedAsyncTransport(httpx.AsyncBaseTransport):
+    """
+    Connection pool shared by many short-lived httpx clients.
+
+    authlib builds a new AsyncOAuth2Client for every call and closes it when done,
+    which would also close a transport handed to it. Closing is therefore a no-op
+    here and the pool is only released by `close` at application shutdown.
+
+    Every request's latency and status are recorded in `metrics`.
+    """
+
+    def __init__(self, transport: httpx.AsyncHTTPTransport) -> None:
+        self._transport = transport
+        self.metrics = OutboundHTTPMetrics()
+
+    async def handle_async_request(self, request: httpx.Request) -> httpx.Response:
+        started_at = time.perf_counter()
+        status: Optional[int] = None
+        try:
+            response = await self._transport.handle_async_request(request)
+            status = response.status_code
+            return response
+        finally:
+            self.metrics.observe(
+                request.url.host, status, time.perf_counter() - started_at
+            )
+
+    async def aclose(self) -> None:
+        pass
+
+    async def close(self) -> None:
+        await self._transport.aclose()
+
+
+def create_shared_transport(
+    max_connections: int,
+    max_keepalive_connections: int,
+    keepalive_expiry: timedelta,
+    http2: bool,
+) -> SharedAsyncTransport:
+    return SharedAsyncTransport(
+        httpx.AsyncHTTPTransport(
+            http2=http2 and http2_available(),
+            limits=httpx.Limits(
+                max_connections=max_connections,
+                max_keepalive_connections=max_keepalive_connections,
+                keepalive_expiry=keepalive_expiry.total_seconds(),
+            ),
+        )
+    )
@@ -1,3 +1,4 @@
+from contextlib import asynccontextmanager
 import logging
 import sentry_sdk
 from fastapi import FastAPI, HTTPException, staticfiles
@@ -8,8 +9,20 @@ from gategpt.config import (
     create_config,
     templates,
 )
+from gategpt.dependencies import (
+    email_delivery,
+    gpt_app_session_buffer,
+    google_oidc_metadata,
+    http_metrics,
+    partition_maintenance,
+)
+from gategpt.metrics import HTTPMetricsMiddleware
+from gategpt.sql_stats import SQLStatsMiddleware
 from gategpt.routers.root import root_router
-from gategpt.routers.openapi_schema import openapi_schema_router
+from gategpt.routers.openapi_schema import (
+    get_filtered_openapi_schema,
+    openapi_schema_router,
+)
 from gategpt.routers.gpt_application import gpt_application_router
 from gategpt.routers.oauth2_server import oauth2_router
 from gategpt.routers.gpt_app_session import gpt_app_session_router
@@ -27,6 +40,30 @@ def perform_setup(config: EnvConfig):
     confugure_logging(config)
 
 
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    if gpt_app_session_buffer is not None:
+        await gpt_app_session_buffer.start()
+    if google_oidc_metadata is not None:
+        await google_oidc_metadata.start()
+    if partition_maintenance is not None:
+        await partition_maintenance.start()
+    await email_delivery.start()
+    # Every custom GPT fetches its action schema with this tag set.
+    get_filtered_openapi_schema(app, [OpenAPISchemaTags.GPTAppSession])
+    yield
+    await email_delivery.stop()
+    if partition_maintenance is not None:
+        await partition_maintenance.stop()
+    if google_oidc_metadata is not None:
+        await google_oidc_metadata.stop()
+    if gpt_app_session_buffer is not None:
+        await gpt_app_session_buffer.stop()
+    config = create_config()
+    await config.google_http_client.aclose()
+    await config.google_http_transport.close()
+
+
 def create_app() -> FastAPI:
     config = create_config()
     if config.enable_sentry:
@@ -38,6 +75,7 @@ def create_app() -> FastAPI:
         logging.info("Sentry initialized")
 
     app = FastAPI(
+        lifespan=lifespan,
         servers=[
             {
                 "url": config.domain_url,
@@ -57,6 +95,15 @@ def create_app() -> FastAPI:
     app.mount("/static", staticfiles.StaticFiles(directory="static"), name="static")
     perform_setup(config)
     app.add_middleware(SessionMiddleware, secret_key=config.secret_key)
+    if config.sql_stats:
+        app.add_middleware(
+            SQLStatsMiddleware,
+            metrics=http_metrics,
+            n_plus_one_threshold=config.sql_n_plus_one_threshold,
+            debug_headers=config.debug,
+        )
+    # Added last so it is outermost and times the whole middleware stack.
+    app.add_middleware(HTTPMetricsMiddleware, metrics=http_metrics)
     app.include_router(root_router)
     app.include_router(
         openapi_schema_router,
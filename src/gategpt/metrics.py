@@ -0,0 +1,447 @@
+"""
+Prometheus metrics, rendered in the text exposition format by the /metrics
+endpoint.
+
+Recording is meant to stay on under full load, so it is plain attribute and dict
+updates without locks: a request costs two perf_counter calls, a couple of dict
+lookups and a bisect. That is safe because everything recorded here happens on
+the event loop thread (the HTTP middleware, the Google transport and the asyncpg
+pool). The one exception, the sync engine's pool which is checked out from worker
+threads, takes its own lock.
+
+Label values are bounded: routes are the path templates of the app's routes,
+Google requests are labelled by host, and pools by engine name.
+
+The session write-behind buffer records its own counters and flush latency
+Histogram, also from the event loop thread, and they are rendered here.
+"""
+from bisect import bisect_left
+from collections import defaultdict
+from contextlib import nullcontext
+import threading
+import time
+from typing import (
+    TYPE_CHECKING,
+    Any,
+    Callable,
+    ContextManager,
+    Iterable,
+    Iterator,
+    Optional,
+)
+
+from sqlalchemy import exc
+from sqlalchemy.pool import AsyncAdaptedQueuePool, Pool, QueuePool
+from starlette.routing import Mount
+from starlette.types import ASGIApp, Message, Receive, Scope, Send
+
+if TYPE_CHECKING:
+    # session_buffer imports Histogram from here.
+    from gategpt.session_buffer import GPTAppSessionBuffer
+
+# Starlette appends the charset.
+METRICS_CONTENT_TYPE = "text/plain; version=0.0.4"
+METRIC_PREFIX = "gategpt"
+# Seconds. Request latencies are mostly single digit milliseconds, Google calls
+# tens to hundreds.
+LATENCY_BUCKETS = (
+    0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0
+)  # fmt: skip
+POOL_WAIT_BUCKETS = (
+    0.0001, 0.0005, 0.001, 0.005, 0.01, 0.05, 0.1, 0.5, 1.0, 5.0, 30.0
+)  # fmt: skip
+UNMATCHED_ROUTE = "unmatched"
+
+
+class Histogram:
+    def __init__(self, buckets: tuple[float, ...] = LATENCY_BUCKETS) -> None:
+        self.buckets = buckets
+        # One count per bucket plus +Inf, not cumulative until rendered.
+        self.counts = [0] * (len(buckets) + 1)
+        self.sum = 0.0
+
+    def observe(self, value: float) -> None:
+        self.counts[bisect_left(self.buckets, value)] += 1
+        self.sum += value
+
+    @property
+    def count(self) -> int:
+        return sum(self.counts)
+
+    def cumulative(self) -> Iterator[tuple[str, int]]:
+        total = 0
+        for bound, count in zip(self.buckets, self.counts):
+            total += count
+            yield _format_value(bound), total
+        yield "+Inf", total + self.counts[-1]
+
+
+class HTTPMetrics:
+    def __init__(self) -> None:
+        self.in_flight = 0
+        # (method, route) -> latency, (method, route, status) -> count
+        self.durations: defaultdict[tuple[str, str], Histogram] = defaultdict(Histogram)
+        self.responses: defaultdict[tuple[str, str, str], int] = defaultdict(int)
+        # (method, route) -> totals over all requests, filled in by
+        # SQLStatsMiddleware when it is enabled.
+        self.db_queries: defaultdict[tuple[str, str], int] = defaultdict(int)
+        self.db_seconds: defaultdict[tuple[str, str], float] = defaultdict(float)
+
+    def observe(self, method: str, route: str, status: int, duration: float) -> None:
+        self.durations[method, route].observe(duration)
+        self.responses[method, route, str(status)] += 1
+
+    def observe_db(
+        self, method: str, route: str, queries: int, duration: float
+    ) -> None:
+        self.db_queries[method, route] += queries
+        self.db_seconds[method, route] += duration
+
+
+class RouteTemplates:
+    """
+    Path template of the route that handled a request, looked up by the endpoint
+    the router put in the scope, or UNMATCHED_ROUTE. Starlette 0.27 doesn't put
+    the route itself in the scope.
+    """
+
+    def __init__(self) -> None:
+        self._routes: Optional[dict[Any, str]] = None
+
+    def __call__(self, scope: Scope) -> str:
+        if self._routes is None:
+            # Routes are all registered by the time the first request comes in.
+            self._routes = {}
+            for route in scope["app"].routes:
+                endpoint = route.app if isinstance(route, Mount) else route.endpoint
+                self._routes.setdefault(endpoint, route.path)
+        return self._routes.get(scope.get("endpoint"), UNMATCHED_ROUTE)
+
+
+class HTTPMetricsMiddleware:
+    """
+    Pure ASGI middleware, so streaming responses pass straight through. The latency
+    is measured until the response body has been sent.
+    """
+
+    def __init__(self, app: ASGIApp, metrics: HTTPMetrics) -> None:
+        self.app = app
+        self.metrics = metrics
+        self._route = RouteTemplates()
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send) -> None:
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        status = 500
+
+        async def send_with_status(message: Message) -> None:
+            nonlocal status
+            if message["type"] == "http.response.start":
+                status = message["status"]
+            await send(message)
+
+        self.metrics.in_flight += 1
+        started_at = time.perf_counter()
+        try:
+            await self.app(scope, receive, send_with_status)
+        finally:
+            self.metrics.in_flight -= 1
+            self.metrics.observe(
+                scope["method"],
+                self._route(scope),
+                status,
+                time.perf_counter() - started_at,
+            )
+
+
+class OutboundHTTPMetrics:
+    """
+    Latency of outbound requests by host, until the response headers arrive, and
+    response counts by host and status code, or "error" if no response came back.
+    """
+
+    def __init__(self) -> None:
+        self.durations: defaultdict[str, Histogram] = defaultdict(Histogram)
+        self.responses: defaultdict[tuple[str, str], int] = defaultdict(int)
+
+    def observe(self, host: str, status: Optional[int], duration: float) -> None:
+        self.durations[host].observe(duration)
+        self.responses[host, str(status) if status else "error"] += 1
+
+
+class PoolMetrics:
+    def __init__(self) -> None:
+        self.checkouts = 0
+        self.timeouts = 0
+        self.connections_created = 0
+        self.checkout_wait = Histogram(POOL_WAIT_BUCKETS)
+
+
+class _InstrumentedPoolMixin:
+    """
+    Times every connection checkout, including waiting for a connection to be
+    returned and opening a new one, and counts checkouts that time out.
+    """
+
+    _lock_factory: Callable[[], ContextManager] = nullcontext
+
+    def __init__(self, *args, **kwargs) -> None:
+        super().__init__(*args, **kwargs)
+        self.metrics = PoolMetrics()
+        self._metrics_lock = self._lock_factory()
+
+    def connect(self):
+        started_at = time.perf_counter()
+        timed_out = False
+        try:
+            return super().connect()
+        except exc.TimeoutError:
+            timed_out = True
+            raise
+        finally:
+            wait = time.perf_counter() - started_at
+            with self._metrics_lock:
+                self.metrics.checkouts += 1
+                self.metrics.timeouts += timed_out
+                self.metrics.checkout_wait.observe(wait)
+
+    def _create_connection(self):
+        with self._metrics_lock:
+            self.metrics.connections_created += 1
+        return super()._create_connection()
+
+
+class InstrumentedQueuePool(_InstrumentedPoolMixin, QueuePool):
+    # Checked out from worker threads.
+    _lock_factory = threading.Lock
+
+
+class InstrumentedAsyncQueuePool(_InstrumentedPoolMixin, AsyncAdaptedQueuePool):
+    pass
+
+
+def _format_value(value: float) -> str:
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+def _escape(value: str) -> str:
+    return value.replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _labels(labels: dict[str, str]) -> str:
+    if not labels:
+        return ""
+    pairs = ",".join(f'{name}="{_escape(value)}"' for name, value in labels.items())
+    return "{" + pairs + "}"
+
+
+class _Exposition:
+    def __init__(self) -> None:
+        self.lines: list[str] = []
+
+    def metric(
+        self,
+        name: str,
+        metric_type: str,
+        help_text: str,
+        samples: Iterable[tuple[dict[str, str], float]],
+    ) -> None:
+        name = f"{METRIC_PREFIX}_{name}"
+        self.lines.append(f"# HELP {name} {help_text}")
+        self.lines.append(f"# TYPE {name} {metric_type}")
+        for labels, value in samples:
+            self.lines.append(f"{name}{_labels(labels)} {_format_value(value)}")
+
+    def histogram(
+        self,
+        name: str,
+        help_text: str,
+        histograms: Iterable[tuple[dict[str, str], Histogram]],
+    ) -> None:
+        name = f"{METRIC_PREFIX}_{name}"
+        self.lines.append(f"# HELP {name} {help_text}")
+        self.lines.append(f"# TYPE {name} histogram")
+        for labels, histogram in histograms:
+            for bound, count in histogram.cumulative():
+                bucket_labels = _labels({**labels, "le": bound})
+                self.lines.append(f"{name}_bucket{bucket_labels} {count}")
+            self.lines.append(f"{name}_sum{_labels(labels)} {histogram.sum!r}")
+            self.lines.append(f"{name}_count{_labels(labels)} {histogram.count}")
+
+    def render(self) -> str:
+        return "\n".join(self.lines) + "\n"
+
+
+def render_metrics(
+    http_metrics: HTTPMetrics,
+    google_metrics: OutboundHTTPMetrics,
+    pools: dict[str, Pool],
+    session_buffer: Optional["GPTAppSessionBuffer"] = None,
+) -> str:
+    """
+    Render everything in the Prometheus text format. Call it from the event loop
+    thread, like the recording. `pools` maps an engine name to
+    its pool. Checkout counts and waits are only reported for the instrumented pool
+    classes, the rest for any QueuePool. The session buffer metrics have no samples
+    when the write-behind buffer is off.
+    """
+    out = _Exposition()
+    out.metric(
+        "http_requests_in_flight",
+        "gauge",
+        "HTTP requests being handled.",
+        [({}, http_metrics.in_flight)],
+    )
+    out.histogram(
+        "http_request_duration_seconds",
+        "HTTP request latency by route, until the response is sent.",
+        (
+            ({"method": method, "route": route}, h)
+            for (method, route), h in http_metrics.durations.items()
+        ),
+    )
+    out.metric(
+        "http_responses_total",
+        "counter",
+        "HTTP responses by route and status code.",
+        (
+            ({"method": method, "route": route, "status": status}, count)
+            for (method, route, status), count in http_metrics.responses.items()
+        ),
+    )
+    out.metric(
+        "http_db_queries_total",
+        "counter",
+        "SQL statements executed while handling requests, by route.",
+        (
+            ({"method": method, "route": route}, count)
+            for (method, route), count in http_metrics.db_queries.items()
+        ),
+    )
+    out.metric(
+        "http_db_seconds_total",
+        "counter",
+        "Time spent executing SQL statements while handling requests, by route.",
+        (
+            ({"method": method, "route": route}, seconds)
+            for (method, route), seconds in http_metrics.db_seconds.items()
+        ),
+    )
+    out.histogram(
+        "google_request_duration_seconds",
+        "Latency of requests to Google, until the response headers arrive.",
+        (({"host": host}, h) for host, h in google_metrics.durations.items()),
+    )
+    out.metric(
+        "google_responses_total",
+        "counter",
+        'Responses from Google by host and status code, "error" if none came back.',
+        (
+            ({"host": host, "status": status}, count)
+            for (host, status), count in google_metrics.responses.items()
+        ),
+    )
+
+    queue_pools = [
+        (engine, pool) for engine, pool in pools.items() if isinstance(pool, QueuePool)
+    ]
+    for name, help_text, read in [
+        ("db_pool_size", "Connections kept open by the pool.", QueuePool.size),
+        ("db_pool_checked_in", "Idle connections in the pool.", QueuePool.checkedin),
+        (
+            "db_pool_checked_out",
+            "Connections currently checked out.",
+            QueuePool.checkedout,
+        ),
+        (
+            # Counts up from -size while the pool fills.
+            "db_pool_overflow",
+            "Connections open beyond the pool size.",
+            lambda pool: max(pool.overflow(), 0),
+        ),
+    ]:
+        out.metric(
+            name,
+            "gauge",
+            help_text,
+            (({"engine": engine}, read(pool)) for engine, pool in queue_pools),
+        )
+
+    instrumented = [
+        (engine, pool.metrics)
+        for engine, pool in queue_pools
+        if isinstance(pool, _InstrumentedPoolMixin)
+    ]
+    for name, help_text, attribute in [
+        ("db_pool_checkouts_total", "Connection checkouts.", "checkouts"),
+        (
+            "db_pool_checkout_timeouts_total",
+            "Checkouts that timed out waiting for a connection.",
+            "timeouts",
+        ),
+        (
+            "db_pool_connections_created_total",
+            "Connections opened by the pool.",
+            "connections_created",
+        ),
+    ]:
+        out.metric(
+            name,
+            "counter",
+            help_text,
+            (({"engine": engine}, getattr(m, attribute)) for engine, m in instrumented),
+        )
+    out.histogram(
+        "db_pool_checkout_wait_seconds",
+        "Time to check out a connection, including waiting for one and connecting.",
+        (({"engine": engine}, m.checkout_wait) for engine, m in instrumented),
+    )
+
+    buffers = [session_buffer] if session_buffer is not None else []
+    out.metric(
+        "session_buffer_queue_depth",
+        "gauge",
+        "GPT app sessions waiting in the write-behind buffer.",
+        (({}, buffer.stats().queue_depth) for buffer in buffers),
+    )
+    for name, help_text, attribute in [
+        (
+            "session_buffer_enqueued_rows_total",
+            "GPT app sessions queued in the write-behind buffer.",
+            "enqueued_rows",
+        ),
+        (
+            "session_buffer_flushed_rows_total",
+            "GPT app sessions written by the write-behind buffer.",
+            "flushed_rows",
+        ),
+        (
+            "session_buffer_flush_retries_total",
+            "Failed batch writes that were retried.",
+            "retried_flushes",
+        ),
+        (
+            "session_buffer_failed_batches_total",
+            "Batches dropped after their last retry failed.",
+            "failed_batches",
+        ),
+        (
+            "session_buffer_dropped_rows_total",
+            "GPT app sessions dropped with a failed batch.",
+            "dropped_rows",
+        ),
+    ]:
+        out.metric(
+            name,
+            "counter",
+            help_text,
+            (({}, getattr(buffer, attribute)) for buffer in buffers),
+        )
+    out.histogram(
+        "session_buffer_flush_duration_seconds",
+        "Time to write a batch of GPT app sessions, retries included.",
+        (({}, buffer.flush_duration) for buffer in buffers),
+    )
+    return out.render()
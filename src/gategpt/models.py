@@ -1,6 +1,9 @@
 # Create a model to for user account in sqlalchmey
 from sqlalchemy import (
     UUID as UUIDColumn,
+    BigInteger,
+    Date,
+    LargeBinary,
     String,
     Boolean,
     Interval,
@@ -8,12 +11,14 @@ from sqlalchemy import (
     Enum as EnumColumn,
     Text,
     ForeignKey,
+    Index,
+    PrimaryKeyConstraint,
 )
 from sqlalchemy.orm import DeclarativeBase, declared_attr, relationship
 from sqlalchemy.orm import Mapped
 from sqlalchemy import DateTime
 from sqlalchemy.orm import mapped_column
-from datetime import datetime, timedelta
+from datetime import date, datetime, timedelta
 from enum import Enum
 import shortuuid
 from uuid import uuid4, UUID
@@ -53,7 +58,9 @@ class User(Base):
 class CustomGPTApplication(Base):
     __tablename__ = "custom_gpt_application"
     id: Mapped[int] = mapped_column(primary_key=True)
-    uuid: Mapped[str] = mapped_column(String(22), default=shortuuid.uuid)
+    uuid: Mapped[str] = mapped_column(
+        String(22), default=shortuuid.uuid, unique=True, index=True
+    )
     user_id: Mapped[int] = mapped_column(ForeignKey("user.id"))
     user: Mapped[User] = relationship("User", backref="custom_gpt_applications")
     gpt_name: Mapped[str] = mapped_column(String(30))
@@ -73,7 +80,9 @@ class CustomGPTApplication(Base):
     updated_at: Mapped[datetime] = mapped_column(
         DateTime(timezone=True), default=datetime.utcnow, onupdate=datetime.utcnow
     )
-    client_id: Mapped[UUID] = mapped_column(UUIDColumn(as_uuid=True), default=uuid4)
+    client_id: Mapped[UUID] = mapped_column(
+        UUIDColumn(as_uuid=True), default=uuid4, unique=True, index=True
+    )
     # TODO: Convert to a hashed value
     client_secret: Mapped[UUID] = mapped_column(UUIDColumn(as_uuid=True), default=uuid4)
 
@@ -124,7 +133,19 @@ class OAuthVerificationRequestStatus(Enum):
 
 class OAuthVerificationRequest(BaseVerificationRequest):
     __tablename__ = "oauth_verification_request"
-    uuid: Mapped[str] = mapped_column(String(22), default=shortuuid.uuid)
+    # Daily range partitions on created_at, created and dropped by
+    # gategpt.partitions.PartitionMaintenance. Postgres requires the partition key
+    # in the primary key, and uuid can no longer be declared unique on its own.
+    __table_args__ = (
+        PrimaryKeyConstraint("id", "created_at"),
+        {"postgresql_partition_by": "RANGE (created_at)"},
+    )
+    # SQLAlchemy only infers autoincrement for a single column primary key.
+    id: Mapped[int] = mapped_column(primary_key=True, autoincrement=True)
+    created_at: Mapped[datetime] = mapped_column(
+        DateTime(timezone=True), default=utcnow, primary_key=True
+    )
+    uuid: Mapped[str] = mapped_column(String(22), default=shortuuid.uuid, index=True)
     provider: Mapped[str] = mapped_column(String(30))
     email: Mapped[str] = mapped_column(String(255), nullable=True)
     state: Mapped[str] = mapped_column(String(255))
@@ -164,13 +185,127 @@ class OAuthToken(Base):
 
 class GPTAppSession(Base):
     __tablename__ = "gpt_session"
+    # Monthly range partitions on created_at, created ahead of time by
+    # gategpt.partitions.PartitionMaintenance. Indexes declared here are created on
+    # every partition.
+    __table_args__ = (
+        PrimaryKeyConstraint("id", "created_at"),
+        Index(
+            "ix_gpt_session_gpt_application_id_created_at",
+            "gpt_application_id",
+            "created_at",
+        ),
+        # Serve the dashboard's LIKE / ILIKE '%...%' searches, needs pg_trgm.
+        Index(
+            "ix_gpt_session_email_trgm",
+            "email",
+            postgresql_using="gin",
+            postgresql_ops={"email": "gin_trgm_ops"},
+        ),
+        Index(
+            "ix_gpt_session_name_trgm",
+            "name",
+            postgresql_using="gin",
+            postgresql_ops={"name": "gin_trgm_ops"},
+        ),
+        {"postgresql_partition_by": "RANGE (created_at)"},
+    )
 
-    id: Mapped[int] = mapped_column(primary_key=True)
+    # SQLAlchemy only infers autoincrement for a single column primary key.
+    id: Mapped[int] = mapped_column(primary_key=True, autoincrement=True)
     gpt_application_id: Mapped[int] = mapped_column(
         ForeignKey("custom_gpt_application.id")
     )
     email: Mapped[str] = mapped_column(String(255), index=True)
     name: Mapped[str] = mapped_column(Text(), nullable=True)
     created_at: Mapped[datetime] = mapped_column(
-        DateTime(timezone=True), default=datetime.utcnow
+        DateTime(timezone=True), default=utcnow, primary_key=True
+    )
+
+
+class GPTAppSessionCounter(Base):
+    __tablename__ = "gpt_session_counter"
+
+    gpt_application_id: Mapped[int] = mapped_column(
+        ForeignKey("custom_gpt_application.id"), primary_key=True
+    )
+    session_count: Mapped[int] = mapped_column(BigInteger, default=0)
+    updated_at: Mapped[datetime] = mapped_column(
+        DateTime(timezone=True), default=utcnow, onupdate=utcnow
     )
+
+
+class SessionRollupGranularity(Enum):
+    HOUR = "hour"
+    DAY = "day"
+    WEEK = "week"
+
+
+class GPTAppSessionRollup(Base):
+    """
+    Sessions and unique users per application per UTC hour, day and ISO week,
+    kept up to date by gategpt.analytics.update_session_rollups.
+    """
+
+    __tablename__ = "gpt_session_rollup"
+
+    gpt_application_id: Mapped[int] = mapped_column(
+        ForeignKey("custom_gpt_application.id"), primary_key=True
+    )
+    granularity: Mapped[SessionRollupGranularity] = mapped_column(
+        EnumColumn(SessionRollupGranularity, native_enum=False), primary_key=True
+    )
+    bucket_start: Mapped[datetime] = mapped_column(
+        DateTime(timezone=True), primary_key=True
+    )
+    session_count: Mapped[int] = mapped_column(BigInteger, default=0)
+    unique_users: Mapped[int] = mapped_column(BigInteger, default=0)
+
+
+class GPTAppSessionRollupUser(Base):
+    """
+    Users already counted in a rollup bucket that is still open. Partitioned by day
+    on bucket_start so rows for closed buckets are dropped with their partition.
+    """
+
+    __tablename__ = "gpt_session_rollup_user"
+    __table_args__ = {"postgresql_partition_by": "RANGE (bucket_start)"}
+
+    gpt_application_id: Mapped[int] = mapped_column(primary_key=True)
+    granularity: Mapped[SessionRollupGranularity] = mapped_column(
+        EnumColumn(SessionRollupGranularity, native_enum=False), primary_key=True
+    )
+    bucket_start: Mapped[datetime] = mapped_column(
+        DateTime(timezone=True), primary_key=True
+    )
+    user_hash: Mapped[int] = mapped_column(BigInteger, primary_key=True)
+
+
+class GPTAppSessionUserSketch(Base):
+    """
+    HyperLogLog sketch of the users seen per application per UTC day, see
+    gategpt.hll. Kept up to date by gategpt.analytics.update_session_rollups.
+    """
+
+    __tablename__ = "gpt_session_user_sketch"
+
+    gpt_application_id: Mapped[int] = mapped_column(
+        ForeignKey("custom_gpt_application.id"), primary_key=True
+    )
+    day: Mapped[date] = mapped_column(Date, primary_key=True)
+    registers: Mapped[bytes] = mapped_column(LargeBinary)
+
+
+class RateLimitCounter(Base):
+    """
+    Hits per key per fixed window for gategpt.rate_limit.PostgresRateLimitStorage.
+    Times are epoch seconds.
+    """
+
+    __tablename__ = "rate_limit_counter"
+    __table_args__ = {"prefixes": ["UNLOGGED"]}
+
+    key: Mapped[str] = mapped_column(Text(), primary_key=True)
+    window_start: Mapped[int] = mapped_column(BigInteger, primary_key=True)
+    hits: Mapped[int] = mapped_column(default=0)
+    expires_at: Mapped[int] = mapped_column(BigInteger, index=True)
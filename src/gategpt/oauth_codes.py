@@ -0,0 +1,180 @@
+import base64
+from datetime import datetime, timedelta
+import heapq
+import threading
+from typing import Literal, Optional, TypeVar
+
+from cryptography.fernet import Fernet, InvalidToken
+from cryptography.hazmat.primitives import hashes
+from cryptography.hazmat.primitives.kdf.hkdf import HKDF
+from pydantic import BaseModel, ValidationError
+import shortuuid
+
+from gategpt.utils import utcnow
+
+OAUTH_CODE_KEY_INFO = b"gategpt oauth2 stateless authorization code"
+
+
+class InvalidOAuthCodeError(Exception):
+    pass
+
+
+class StatelessOAuthFlow(BaseModel):
+    """
+    Everything the callback needs about an authorization request. Sent to Google as
+    the `state` parameter instead of being stored in oauth_verification_request.
+    """
+
+    typ: Literal["flow"] = "flow"
+    jti: str
+    gpt_application_id: int
+    redirect_uri: str
+    state: str
+    nonce: str
+    iat: datetime
+    exp: datetime
+
+
+class StatelessAuthorizationCode(BaseModel):
+    """
+    Authorization code handed to the custom GPT after the Google callback, carrying
+    the Google code it is exchanged for at /token.
+    """
+
+    typ: Literal["code"] = "code"
+    jti: str
+    gpt_application_id: int
+    redirect_uri: str
+    state: str
+    nonce: str
+    iat: datetime
+    exp: datetime
+    google_code: str
+    callback_completed_at: datetime
+
+
+OAuthCodePayload = TypeVar(
+    "OAuthCodePayload", StatelessOAuthFlow, StatelessAuthorizationCode
+)
+
+
+class ExpiringSet:
+    """
+    Set of keys that are forgotten once their expiry passes. Expired keys are pruned
+    from a min-heap on every insert, so memory is bounded by the keys that are still
+    live.
+    """
+
+    def __init__(self) -> None:
+        self._expiries: dict[str, datetime] = {}
+        self._heap: list[tuple[datetime, str]] = []
+        self._lock = threading.Lock()
+
+    def __len__(self) -> int:
+        return len(self._expiries)
+
+    def _prune(self, now: datetime) -> None:
+        while self._heap and self._heap[0][0] <= now:
+            expires_at, key = heapq.heappop(self._heap)
+            if self._expiries.get(key) == expires_at:
+                del self._expiries[key]
+
+    def add(self, key: str, expires_at: datetime) -> bool:
+        """
+        Add `key` unless a live copy is already present. Returns whether it was added.
+        """
+        with self._lock:
+            now = utcnow()
+            self._prune(now)
+            if key in self._expiries:
+                return False
+            self._expiries[key] = expires_at
+            heapq.heappush(self._heap, (expires_at, key))
+            return True
+
+
+class StatelessOAuthCodes:
+    """
+    Issues and redeems the encrypted flow states and authorization codes used when
+    OAuth verification requests aren't stored in the database.
+
+    Payloads are encrypted and authenticated with Fernet under a key derived from
+    the app secret. Codes are single use within this process; across workers the
+    Google code inside is itself single use, so a replayed code fails at Google.
+    """
+
+    def __init__(self, secret_key: str) -> None:
+        key = HKDF(
+            algorithm=hashes.SHA256(),
+            length=32,
+            salt=None,
+            info=OAUTH_CODE_KEY_INFO,
+        ).derive(secret_key.encode("utf-8"))
+        self._fernet = Fernet(base64.urlsafe_b64encode(key))
+        self.redeemed_codes = ExpiringSet()
+
+    def _encode(self, payload: BaseModel) -> str:
+        return self._fernet.encrypt(payload.model_dump_json().encode()).decode()
+
+    def _decode(
+        self, token: Optional[str], payload_cls: type[OAuthCodePayload]
+    ) -> OAuthCodePayload:
+        if not token:
+            raise InvalidOAuthCodeError("Missing token")
+        try:
+            return payload_cls.model_validate_json(self._fernet.decrypt(token))
+        except (InvalidToken, ValidationError) as exc:
+            raise InvalidOAuthCodeError("Invalid token") from exc
+
+    def issue_flow(
+        self,
+        gpt_application_id: int,
+        redirect_uri: str,
+        state: str,
+        nonce: str,
+        expires_in: timedelta,
+    ) -> str:
+        now = utcnow()
+        return self._encode(
+            StatelessOAuthFlow(
+                jti=shortuuid.uuid(),
+                gpt_application_id=gpt_application_id,
+                redirect_uri=redirect_uri,
+                state=state,
+                nonce=nonce,
+                iat=now,
+                exp=now + expires_in,
+            )
+        )
+
+    def read_flow(self, token: Optional[str]) -> StatelessOAuthFlow:
+        return self._decode(token, StatelessOAuthFlow)
+
+    def issue_code(self, flow: StatelessOAuthFlow, google_code: str) -> str:
+        return self._encode(
+            StatelessAuthorizationCode(
+                **flow.model_dump(exclude={"typ"}),
+                google_code=google_code,
+                callback_completed_at=utcnow(),
+            )
+        )
+
+    def redeem_code(
+        self, token: str, gpt_application_id: int, redirect_uri: str
+    ) -> StatelessAuthorizationCode:
+        """
+        Decode an authorization code and mark it used. Raises InvalidOAuthCodeError
+        when it is malformed, issued to another application or redirect_uri,
+        expired, or already redeemed.
+        """
+        code = self._decode(token, StatelessAuthorizationCode)
+        if (
+            code.gpt_application_id != gpt_application_id
+            or code.redirect_uri != redirect_uri
+        ):
+            raise InvalidOAuthCodeError("Code was issued to another client")
+        if code.exp < utcnow():
+            raise InvalidOAuthCodeError("Code expired")
+        if not self.redeemed_codes.add(code.jti, code.exp):
+            raise InvalidOAuthCodeError("Code already redeemed")
+        return code
@@ -0,0 +1,123 @@
+import asyncio
+from datetime import datetime, timedelta
+import json
+import logging
+from pathlib import Path
+import time
+from typing import Any, Optional
+
+from authlib.integrations.starlette_client.apps import StarletteOAuth2App
+import httpx
+
+from gategpt.utils import utcnow
+
+logger = logging.getLogger(__name__)
+
+
+class OIDCMetadataCache:
+    """
+    Keeps an OAuth client's OIDC discovery document and JWKS loaded in memory.
+
+    authlib fetches both lazily on first use and then keeps whatever is in
+    `server_metadata` forever. This loads them up front, stores them where authlib
+    looks for them and refreshes them in the background `refresh_ahead` before the
+    TTL runs out. If a refresh fails the current values stay in use and the refresh
+    is retried every `retry_interval`.
+
+    `metadata_url` and the document's `jwks_uri` may be http(s) URLs, e.g. of a stub
+    provider, or local file paths, so the cache can be loaded offline.
+    """
+
+    def __init__(
+        self,
+        oauth_client: StarletteOAuth2App,
+        metadata_url: str,
+        http_client: httpx.AsyncClient,
+        ttl: timedelta,
+        refresh_ahead: timedelta,
+        retry_interval: timedelta,
+    ) -> None:
+        self.oauth_client = oauth_client
+        self.metadata_url = metadata_url
+        self.http_client = http_client
+        self.ttl = ttl
+        self.refresh_ahead = refresh_ahead
+        self.retry_interval = retry_interval
+        self.loaded_at: Optional[datetime] = None
+        self.refresh_failures = 0
+        self.last_error: Optional[str] = None
+        self._task: Optional[asyncio.Task] = None
+
+    @property
+    def expires_at(self) -> Optional[datetime]:
+        return self.loaded_at + self.ttl if self.loaded_at else None
+
+    @property
+    def is_stale(self) -> bool:
+        return self.loaded_at is None or self.expires_at <= utcnow()
+
+    async def _fetch_json(self, location: str) -> dict[str, Any]:
+        if location.startswith(("http://", "https://")):
+            response = await self.http_client.get(location)
+            response.raise_for_status()
+            return response.json()
+        path = Path(location.removeprefix("file://"))
+        return json.loads(await asyncio.to_thread(path.read_text))
+
+    async def load(self) -> None:
+        metadata = await self._fetch_json(self.metadata_url)
+        jwks_uri = metadata.get("jwks_uri")
+        if not jwks_uri:
+            raise ValueError(f'Missing "jwks_uri" in {self.metadata_url}')
+        metadata["jwks"] = await self._fetch_json(jwks_uri)
+        # authlib skips its own discovery request once `_loaded_at` is set.
+        metadata["_loaded_at"] = time.time()
+        self.oauth_client.server_metadata.update(metadata)
+        self.loaded_at = utcnow()
+        logger.info(
+            f"Loaded OIDC metadata and {len(metadata['jwks'].get('keys', []))} signing keys from {self.metadata_url}"
+        )
+
+    async def _refresh(self) -> bool:
+        try:
+            await self.load()
+        except Exception as exc:
+            self.refresh_failures += 1
+            self.last_error = str(exc)
+            logger.error(
+                f"Failed loading OIDC metadata from {self.metadata_url}, keeping {'stale' if self.is_stale else 'current'} copy: {exc}",
+                exc_info=True,
+            )
+            return False
+        self.last_error = None
+        return True
+
+    async def _refresh_loop(self) -> None:
+        while True:
+            if self.loaded_at is None:
+                delay = self.retry_interval
+            else:
+                delay = max(
+                    self.expires_at - self.refresh_ahead - utcnow(),
+                    self.retry_interval,
+                )
+            await asyncio.sleep(delay.total_seconds())
+            await self._refresh()
+
+    async def start(self) -> None:
+        """
+        Load once before serving traffic, then keep refreshing in the background.
+        A failed initial load is not fatal; authlib falls back to fetching lazily.
+        """
+        await self._refresh()
+        self._task = asyncio.create_task(self._refresh_loop())
+
+    async def stop(self) -> None:
+        if self._task is None:
+            return
+        self._task.cancel()
+        try:
+            await self._task
+        except asyncio.CancelledError:
+            pass
+        self._task = None
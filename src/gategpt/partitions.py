@@ -0,0 +1,274 @@
+import asyncio
+from datetime import UTC, datetime, timedelta
+from enum import Enum
+import logging
+import re
+from typing import Optional
+
+from sqlalchemy import text
+from sqlalchemy.ext.asyncio import AsyncConnection, AsyncEngine
+
+from gategpt.utils import utcnow
+
+logger = logging.getLogger(__name__)
+
+# Partition DDL gives up after this instead of queueing every insert into the
+# table behind its lock.
+PARTITION_DDL_LOCK_TIMEOUT = "5s"
+PARTITION_UPPER_BOUND_RE = re.compile(r"TO \('([^']+)'\)")
+
+
+class PartitionInterval(Enum):
+    DAY = "day"
+    MONTH = "month"
+
+
+class RangePartitionedTable:
+    """
+    A table range partitioned on the timestamp `column` into daily or monthly
+    partitions named `<table>_pYYYYMMDD` or `<table>_pYYYYMM`, with bounds at UTC
+    midnight.
+
+    `premake` partitions are kept created ahead of the current one. Partitions whose
+    upper bound is older than `retention` are dropped; without a retention they are
+    kept forever.
+
+    Rows with no partition of their own land in the `<table>_default` partition, so
+    writes keep working when maintenance falls behind. Its rows are moved into each
+    partition as it is created, and the ones past the retention are deleted.
+    """
+
+    def __init__(
+        self,
+        table_name: str,
+        interval: PartitionInterval,
+        premake: int,
+        retention: Optional[timedelta] = None,
+        column: str = "created_at",
+    ) -> None:
+        self.table_name = table_name
+        self.interval = interval
+        self.premake = premake
+        self.retention = retention
+        self.column = column
+
+    @property
+    def default_partition(self) -> str:
+        return f"{self.table_name}_default"
+
+    def partition_start(self, moment: datetime) -> datetime:
+        moment = moment.astimezone(UTC)
+        if self.interval == PartitionInterval.MONTH:
+            return datetime(moment.year, moment.month, 1, tzinfo=UTC)
+        return datetime(moment.year, moment.month, moment.day, tzinfo=UTC)
+
+    def next_partition_start(self, start: datetime) -> datetime:
+        if self.interval == PartitionInterval.MONTH:
+            return (start + timedelta(days=32)).replace(day=1)
+        return start + timedelta(days=1)
+
+    def partition_name(self, start: datetime) -> str:
+        suffix = "%Y%m" if self.interval == PartitionInterval.MONTH else "%Y%m%d"
+        return f"{self.table_name}_p{start.strftime(suffix)}"
+
+    async def create_partitions(
+        self, connection: AsyncConnection, now: datetime
+    ) -> list[str]:
+        """
+        Create the current partition and the next `premake` ones if missing.
+        Indexes defined on the parent table are created on each new partition.
+        """
+        existing = {name for name, _ in await self.list_partitions(connection)}
+        created = []
+        start = self.partition_start(now)
+        for _ in range(self.premake + 1):
+            end = self.next_partition_start(start)
+            name = self.partition_name(start)
+            if name not in existing:
+                bounds = (
+                    f"FOR VALUES FROM ('{start.isoformat()}') TO ('{end.isoformat()}')"
+                )
+                if self.default_partition in existing:
+                    await self._create_partition_from_default(
+                        connection, name, bounds, start, end
+                    )
+                else:
+                    await connection.execute(
+                        text(
+                            f"CREATE TABLE IF NOT EXISTS {name} "
+                            f"PARTITION OF {self.table_name} {bounds}"
+                        )
+                    )
+                created.append(name)
+            start = end
+        return created
+
+    async def _create_partition_from_default(
+        self,
+        connection: AsyncConnection,
+        name: str,
+        bounds: str,
+        start: datetime,
+        end: datetime,
+    ) -> None:
+        """
+        Postgres refuses to create a partition while the default partition holds
+        rows in its range, so build it as a plain table from those rows and attach
+        it. Attaching adds the parent's indexes and constraints.
+        """
+        await connection.execute(
+            text(
+                f"CREATE TABLE {name} (LIKE {self.table_name} "
+                "INCLUDING DEFAULTS INCLUDING CONSTRAINTS)"
+            )
+        )
+        moved = await connection.execute(
+            text(
+                f"WITH moved AS (DELETE FROM {self.default_partition} "
+                f"WHERE {self.column} >= :start AND {self.column} < :end "
+                f"RETURNING *) INSERT INTO {name} SELECT * FROM moved"
+            ),
+            {"start": start, "end": end},
+        )
+        await connection.execute(
+            text(f"ALTER TABLE {self.table_name} ATTACH PARTITION {name} {bounds}")
+        )
+        if moved.rowcount:
+            logger.warning(
+                f"Moved {moved.rowcount} rows of {self.table_name} from "
+                f"{self.default_partition} into {name}"
+            )
+
+    async def list_partitions(
+        self, connection: AsyncConnection
+    ) -> list[tuple[str, Optional[datetime]]]:
+        """
+        Return (name, upper bound) for every partition, with None for MAXVALUE.
+        """
+        result = await connection.execute(
+            text(
+                "SELECT c.relname, pg_get_expr(c.relpartbound, c.oid) "
+                "FROM pg_inherits i JOIN pg_class c ON c.oid = i.inhrelid "
+                "WHERE i.inhparent = CAST(:table_name AS regclass) "
+                "ORDER BY c.relname"
+            ),
+            {"table_name": self.table_name},
+        )
+        partitions = []
+        for name, bound in result:
+            match = PARTITION_UPPER_BOUND_RE.search(bound)
+            upper = datetime.fromisoformat(match.group(1)) if match else None
+            partitions.append((name, upper))
+        return partitions
+
+    async def drop_expired_partitions(
+        self, connection: AsyncConnection, now: datetime, detach_only: bool = False
+    ) -> list[str]:
+        """
+        Detach every partition that only holds rows older than the retention and,
+        unless `detach_only`, drop it. Detached partitions are left as plain tables
+        for archiving.
+        """
+        if self.retention is None:
+            return []
+        cutoff = now - self.retention
+        removed = []
+        for name, upper in await self.list_partitions(connection):
+            if name == self.default_partition:
+                await self._delete_expired_default_rows(connection, cutoff)
+                continue
+            if upper is None or upper > cutoff:
+                continue
+            await connection.execute(
+                text(f"ALTER TABLE {self.table_name} DETACH PARTITION {name}")
+            )
+            if not detach_only:
+                await connection.execute(text(f"DROP TABLE {name}"))
+            removed.append(name)
+        return removed
+
+    async def _delete_expired_default_rows(
+        self, connection: AsyncConnection, cutoff: datetime
+    ) -> None:
+        deleted = await connection.execute(
+            text(f"DELETE FROM {self.default_partition} WHERE {self.column} < :cutoff"),
+            {"cutoff": cutoff},
+        )
+        if deleted.rowcount:
+            logger.info(
+                f"Deleted {deleted.rowcount} expired rows from {self.default_partition}"
+            )
+
+
+class PartitionMaintenance:
+    """
+    Periodically creates upcoming partitions and reaps expired ones for the given
+    tables. Every instance runs this; a transaction scoped advisory lock per table
+    makes all but one of them skip each round.
+    """
+
+    def __init__(
+        self,
+        engine: AsyncEngine,
+        tables: list[RangePartitionedTable],
+        interval: timedelta,
+        detach_only: bool = False,
+    ) -> None:
+        self.engine = engine
+        self.tables = tables
+        self.interval = interval
+        self.detach_only = detach_only
+        self._task: Optional[asyncio.Task] = None
+
+    async def maintain(self, table: RangePartitionedTable) -> None:
+        now = utcnow()
+        async with self.engine.begin() as connection:
+            locked = await connection.scalar(
+                text("SELECT pg_try_advisory_xact_lock(hashtext(:table_name))"),
+                {"table_name": table.table_name},
+            )
+            if not locked:
+                logger.debug(
+                    f"Skipping partition maintenance of {table.table_name}, another instance is running it"
+                )
+                return
+            await connection.execute(
+                text(f"SET LOCAL lock_timeout = '{PARTITION_DDL_LOCK_TIMEOUT}'")
+            )
+            created = await table.create_partitions(connection, now)
+            removed = await table.drop_expired_partitions(
+                connection, now, self.detach_only
+            )
+        if created or removed:
+            logger.info(
+                f"Partition maintenance of {table.table_name}: created {created}, "
+                f"{'detached' if self.detach_only else 'dropped'} {removed}"
+            )
+
+    async def run_once(self) -> None:
+        for table in self.tables:
+            try:
+                await self.maintain(table)
+            except Exception as exc:
+                logger.error(
+                    f"Partition maintenance of {table.table_name} failed: {exc}",
+                    exc_info=True,
+                )
+
+    async def _run(self) -> None:
+        while True:
+            await self.run_once()
+            await asyncio.sleep(self.interval.total_seconds())
+
+    async def start(self) -> None:
+        self._task = asyncio.create_task(self._run())
+
+    async def stop(self) -> None:
+        if self._task is None:
+            return
+        self._task.cancel()
+        try:
+            await self._task
+        except asyncio.CancelledError:
+            pass
+        self._task = None
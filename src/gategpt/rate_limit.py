@@ -0,0 +1,227 @@
+"""
+Sliding-window rate limiting.
+
+Each key keeps two counters, the hits in the current fixed window and in the one
+before it. The request rate is estimated as the current count plus the previous
+count weighted by how much of the previous window still overlaps the sliding
+window, which is O(1) in time and memory per key and within a few percent of an
+exact sliding log. Every hit is counted, including rejected ones, so a client
+has to actually slow down to get through again.
+
+Counters live in a RateLimitStorage: MemoryRateLimitStorage is per process,
+PostgresRateLimitStorage shares them between workers and instances.
+"""
+from collections import OrderedDict
+from datetime import timedelta
+import logging
+import math
+import time
+from typing import Callable, NamedTuple, Optional, Protocol
+
+from fastapi import HTTPException
+from sqlalchemy import text
+from sqlalchemy.ext.asyncio import AsyncEngine
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_MAX_KEYS = 100_000
+POSTGRES_CLEANUP_INTERVAL = 60.0
+
+
+class RateLimit(NamedTuple):
+    limit: int
+    window: timedelta
+
+
+class RateLimitCheck(NamedTuple):
+    scope: str
+    key: str
+    rate_limit: RateLimit
+
+
+class RateLimitResult(NamedTuple):
+    allowed: bool
+    remaining: int
+    retry_after: int
+
+
+class RateLimitExceededError(Exception):
+    def __init__(self, scope: str, retry_after: int) -> None:
+        super().__init__(f"Rate limit exceeded for {scope}")
+        self.scope = scope
+        self.retry_after = retry_after
+
+
+class RateLimitStorage(Protocol):
+    async def hit(self, key: str, window_start: int, window: int) -> tuple[int, int]:
+        """
+        Count a hit for `key` in the window starting at `window_start` (epoch
+        seconds) and return the hits in that window and in the one before it.
+        """
+
+
+class MemoryRateLimitStorage:
+    """
+    Counters in a dict bounded to `max_keys`, evicting the least recently hit key.
+    `hit` never awaits, so it is atomic within the event loop.
+    """
+
+    def __init__(self, max_keys: int = DEFAULT_MAX_KEYS) -> None:
+        self.max_keys = max_keys
+        # key -> (window_start, hits in that window, hits in the window before)
+        self._counters: OrderedDict[str, tuple[int, int, int]] = OrderedDict()
+
+    async def hit(self, key: str, window_start: int, window: int) -> tuple[int, int]:
+        counter_start, current, previous = self._counters.get(key, (window_start, 0, 0))
+        if counter_start != window_start:
+            # Roll over. Counts older than the previous window no longer matter.
+            previous = current if counter_start == window_start - window else 0
+            current = 0
+        current += 1
+        self._counters[key] = (window_start, current, previous)
+        self._counters.move_to_end(key)
+        while len(self._counters) > self.max_keys:
+            self._counters.popitem(last=False)
+        return current, previous
+
+    def clear(self) -> None:
+        self._counters.clear()
+
+
+class PostgresRateLimitStorage:
+    """
+    Counters in the unlogged rate_limit_counter table, one row per key and window.
+    Rows are deleted once they can no longer be a previous window, by whichever
+    hit comes first after POSTGRES_CLEANUP_INTERVAL.
+    """
+
+    HIT_SQL = text(
+        """
+        INSERT INTO rate_limit_counter AS c (key, window_start, hits, expires_at)
+        VALUES (:key, :window_start, 1, :expires_at)
+        ON CONFLICT (key, window_start) DO UPDATE SET hits = c.hits + 1
+        RETURNING
+            hits,
+            (
+                SELECT p.hits FROM rate_limit_counter AS p
+                WHERE p.key = :key AND p.window_start = :previous_window_start
+            ) AS previous_hits
+        """
+    )
+    CLEANUP_SQL = text("DELETE FROM rate_limit_counter WHERE expires_at < :now")
+
+    def __init__(
+        self, engine: AsyncEngine, timer: Callable[[], float] = time.time
+    ) -> None:
+        self._engine = engine
+        self._timer = timer
+        self._next_cleanup = 0.0
+
+    async def hit(self, key: str, window_start: int, window: int) -> tuple[int, int]:
+        now = self._timer()
+        async with self._engine.begin() as connection:
+            current, previous = (
+                await connection.execute(
+                    self.HIT_SQL,
+                    {
+                        "key": key,
+                        "window_start": window_start,
+                        "previous_window_start": window_start - window,
+                        "expires_at": window_start + 2 * window,
+                    },
+                )
+            ).one()
+            if now >= self._next_cleanup:
+                self._next_cleanup = now + POSTGRES_CLEANUP_INTERVAL
+                await connection.execute(self.CLEANUP_SQL, {"now": int(now)})
+        return current, previous or 0
+
+
+class RateLimiter:
+    """
+    :param storage: Where the counters live.
+    :param timer: Wall clock in epoch seconds, overridable for tests. Windows are
+        aligned to it so instances sharing a storage agree on them.
+    """
+
+    def __init__(
+        self, storage: RateLimitStorage, timer: Callable[[], float] = time.time
+    ) -> None:
+        self.storage = storage
+        self._timer = timer
+        self.allowed = 0
+        self.limited = 0
+
+    async def hit(self, scope: str, key: str, rate_limit: RateLimit) -> RateLimitResult:
+        window = max(1, int(rate_limit.window.total_seconds()))
+        now = self._timer()
+        window_start = int(now) // window * window
+        current, previous = await self.storage.hit(
+            f"{scope}:{window}:{key}", window_start, window
+        )
+
+        elapsed = now - window_start
+        estimate = previous * (window - elapsed) / window + current
+        if estimate <= rate_limit.limit:
+            self.allowed += 1
+            return RateLimitResult(True, int(rate_limit.limit - estimate), 0)
+
+        self.limited += 1
+        return RateLimitResult(
+            False,
+            0,
+            _retry_after(rate_limit.limit, window, elapsed, current, previous),
+        )
+
+    async def enforce(self, checks: list[RateLimitCheck]) -> None:
+        """
+        Count a hit against every check, then raise RateLimitExceededError for the
+        one that frees up last if any of them is over its limit.
+        """
+        exceeded: Optional[RateLimitExceededError] = None
+        for check in checks:
+            result = await self.hit(check.scope, check.key, check.rate_limit)
+            if not result.allowed and (
+                exceeded is None or result.retry_after > exceeded.retry_after
+            ):
+                exceeded = RateLimitExceededError(check.scope, result.retry_after)
+        if exceeded:
+            logger.warning(f"{exceeded}, retry after {exceeded.retry_after}s")
+            raise exceeded
+
+
+def _retry_after(
+    limit: int, window: int, elapsed: float, current: int, previous: int
+) -> int:
+    """
+    Seconds until the estimate drops far enough for one more hit to be allowed if
+    no other hits arrive.
+    """
+    room = limit - 1
+    if current <= room and previous:
+        # The previous window's share decays below the remaining headroom within
+        # this window.
+        wait = (window - elapsed) - (room - current) * window / previous
+    else:
+        # Only once this window becomes the previous one and decays far enough.
+        wait = (window - elapsed) + window * (1 - max(room, 0) / current)
+    return max(1, math.ceil(wait))
+
+
+async def enforce_rate_limits(
+    rate_limiter: Optional[RateLimiter], checks: list[RateLimitCheck]
+) -> None:
+    """
+    RateLimiter.enforce for request handlers, answering 429 with Retry-After when a
+    check is over its limit. Does nothing when rate limiting is turned off.
+    """
+    if rate_limiter is None:
+        return
+    try:
+        await rate_limiter.enforce(checks)
+    except RateLimitExceededError as exc:
+        raise HTTPException(
+            status_code=429,
+            detail="Too many requests. Please retry later",
+            headers={"Retry-After": str(exc.retry_after)},
+        )
@@ -9,7 +9,8 @@ from gategpt.dependencies import (
     ConfigDep,
     DbSession,
     LoggerDep,
-    get_current_user,
+    UserCacheDep,
+    get_current_user_row,
 )
 from gategpt.models import User
 from gategpt.utils import url_for
@@ -56,13 +57,17 @@ async def oauth_login(config: ConfigDep, request: Request):
 
 
 @auth_router.get("/api/v1/user/profile", response_model=UserResponseModel)
-async def user_profile(current_user: dict = Depends(get_current_user)):
+async def user_profile(current_user: User = Depends(get_current_user_row)):
     return current_user
 
 
 @auth_router.get("/auth/oauth-callback/google", name="oauth_callback_google")
 async def oauth_callback_google(
-    config: ConfigDep, request: Request, session: DbSession, logger: LoggerDep
+    config: ConfigDep,
+    request: Request,
+    session: DbSession,
+    logger: LoggerDep,
+    user_cache: UserCacheDep,
 ):
     try:
         token = await config.google_oauth_client.authorize_access_token(request)
@@ -79,22 +84,26 @@ async def oauth_callback_google(
 
     email = user_info["email"]
     name = user_info["name"]
-    stmt = (
-        pg_insert(User)
-        .values(
-            {
-                "email": email,
-                "name": name,
-            }
-        )
-        .on_conflict_do_nothing(index_elements=["email"])
+    stmt = pg_insert(User).values(
+        {
+            "email": email,
+            "name": name,
+        }
     )
-    session.execute(stmt)
-    session.commit()
-
+    # A no-op update rather than DO NOTHING, so existing users are returned too.
+    stmt = stmt.on_conflict_do_update(
+        index_elements=["email"], set_={"email": stmt.excluded.email}
+    ).returning(User.id, User.uuid)
+    user_id, user_uuid = (await session.execute(stmt)).one()
+    await session.commit()
+    user_cache.invalidate(user_id, email)
+
+    # Carry the user's id and uuid so requests don't have to load the user.
     jwt_token = create_jwt_token(
         config,
         email,
+        user_id=user_id,
+        user_uuid=user_uuid,
     )
     response = RedirectResponse(
         url=url_for(request, "root", scheme=config.url_scheme),
@@ -4,14 +4,23 @@ from typing import Annotated
 from fastapi import APIRouter, Depends, HTTPException
 from fastapi.security import HTTPAuthorizationCredentials, HTTPBearer
 from pydantic import BaseModel
+from gategpt.analytics import increment_session_count, update_session_rollups
+from gategpt.cache import VerifiedJWTCache
 from gategpt.config import EnvConfig, parse_jwt_token
 from gategpt.dependencies import (
     ConfigDep,
     DbSession,
+    GPTApplicationCacheDep,
+    GPTAppSessionBufferDep,
     LoggerDep,
     JWTTokenPayload,
+    RateLimiterDep,
+    VerifiedJWTCacheDep,
 )
-from gategpt.models import CustomGPTApplication, GPTAppSession
+from gategpt.models import GPTAppSession
+from gategpt.rate_limit import RateLimit, RateLimitCheck, enforce_rate_limits
+from gategpt.session_buffer import SessionBufferFullError
+from gategpt.utils import utcnow
 
 
 gpt_app_session_router = APIRouter()
@@ -35,6 +44,7 @@ def parse_create_session_jwt_token(
     token: str | None,
     config: EnvConfig,
     logger: Logger,
+    jwt_cache: VerifiedJWTCache,
 ) -> CreateSessionJWTTokenPayload:
     if not token:
         raise HTTPException(
@@ -43,8 +53,11 @@ def parse_create_session_jwt_token(
         )
 
     try:
-        token_payload_dict = parse_jwt_token(config, token)
-        return CreateSessionJWTTokenPayload(**token_payload_dict)
+        return jwt_cache.parse(
+            token,
+            CreateSessionJWTTokenPayload,
+            lambda token: parse_jwt_token(config, token),
+        )
     except Exception as exc:
         logger.warn("Error while parsing session JWT token", exc_info=exc)
         raise HTTPException(
@@ -61,40 +74,90 @@ class GPTAppSessionResponse(BaseModel):
 
 
 @gpt_app_session_router.post("/session", response_model=CreateSessionResponse)
-def create_session(
+async def create_session(
     config: ConfigDep,
     session: DbSession,
     credentials: Annotated[
         HTTPAuthorizationCredentials, Depends(bearer_token_security)
     ],
     logger: LoggerDep,
+    gpt_application_cache: GPTApplicationCacheDep,
+    gpt_app_session_buffer: GPTAppSessionBufferDep,
+    jwt_cache: VerifiedJWTCacheDep,
+    rate_limiter: RateLimiterDep,
 ):
     create_session_request = parse_create_session_jwt_token(
-        credentials.credentials, config, logger
+        credentials.credentials, config, logger, jwt_cache
     )
 
-    gpt_application = (
-        session.query(CustomGPTApplication)
-        .filter(CustomGPTApplication.id == create_session_request.gpt_application_id)
-        .first()
+    gpt_application = await gpt_application_cache.get_by_id(
+        session, create_session_request.gpt_application_id
     )
     if not gpt_application:
         raise HTTPException(status_code=404, detail="GPT Application not found")
 
+    # Checked here rather than in the token endpoint, where a 429 would waste
+    # authorization codes that can't be used again. The access token stays valid,
+    # so a limited request can be retried after Retry-After.
+    await enforce_rate_limits(
+        rate_limiter,
+        [
+            RateLimitCheck(
+                "session:email",
+                f"{gpt_application.id}:{create_session_request.email.lower()}",
+                RateLimit(1, config.min_delay_between_verification),
+            )
+        ],
+    )
+
     logger.info(
         f"New Session Request for: {gpt_application.uuid} with user info: {create_session_request}"
     )
 
+    response = CreateSessionResponse(
+        gpt_application_id=gpt_application.uuid,
+        email=create_session_request.email,
+        name=create_session_request.name,
+    )
+
+    if gpt_app_session_buffer is not None:
+        try:
+            await gpt_app_session_buffer.put(
+                gpt_application_id=gpt_application.id,
+                email=create_session_request.email,
+                name=create_session_request.name,
+                created_at=utcnow(),
+            )
+        except SessionBufferFullError:
+            logger.warning(
+                f"Session buffer full, rejecting session for: {gpt_application.uuid}"
+            )
+            raise HTTPException(
+                status_code=503,
+                detail="Too many sessions being created. Please retry",
+                headers={"Retry-After": "1"},
+            )
+        logger.info(f"New Session Queued: {response}")
+        return response
+
     gpt_session = GPTAppSession(
         gpt_application_id=gpt_application.id,
         email=create_session_request.email,
         name=create_session_request.name,
+        created_at=utcnow(),
     )
     session.add(gpt_session)
-    session.commit()
-    logger.info(f"New Session Created: {gpt_session}")
-    return CreateSessionResponse(
-        gpt_application_id=gpt_application.uuid,
-        email=gpt_session.email,
-        name=gpt_session.name,
+    await increment_session_count(session, gpt_application.id)
+    await update_session_rollups(
+        session,
+        [
+            {
+                "gpt_application_id": gpt_session.gpt_application_id,
+                "email": gpt_session.email,
+                "created_at": gpt_session.created_at,
+            }
+        ],
     )
+    await session.commit()
+    logger.info(f"New Session Created: {gpt_session}")
+    return response
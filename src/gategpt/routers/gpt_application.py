@@ -1,4 +1,5 @@
-from datetime import timedelta
+import base64
+from datetime import UTC, date, timedelta
 from datetime import datetime
 from logging import Logger
 from typing import Annotated, Literal, Optional
@@ -10,13 +11,24 @@ from pydantic import (
     HttpUrl,
     StringConstraints,
     UrlConstraints,
+    ValidationError,
     validator,
 )
 from pydantic_core import Url
-from sqlalchemy import desc, func, or_
+from sqlalchemy import Select, asc, desc, func, or_, select, tuple_
 import shortuuid
 from sqlalchemy.exc import IntegrityError
-from sqlalchemy.orm import Session
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.orm import InstrumentedAttribute
+from sqlalchemy.sql import ColumnElement
+from gategpt.analytics import (
+    bucket_start,
+    bucket_width,
+    estimate_unique_users,
+    get_session_count,
+    get_session_rollups,
+)
+from gategpt.cache import GPTApplicationCache
 from gategpt.config import (
     DEFAULT_VERIFICATION_EXPIRY,
     EnvConfig,
@@ -25,19 +37,22 @@ from gategpt.config import (
 from gategpt.dependencies import (
     ConfigDep,
     DbSession,
+    GPTApplicationCacheDep,
     LoggerDep,
     login_required,
 )
 from uuid import UUID, uuid4
 from gategpt.models import (
     CustomGPTApplication,
-    User,
     VerificationMedium,
     GPTAppSession,
+    SessionRollupGranularity,
 )
-from gategpt.utils import url_for
-from gategpt.dependencies import get_current_user
-from fastapi.responses import HTMLResponse
+from gategpt.utils import url_for, utcnow
+from gategpt.dependencies import UserPrincipal, get_current_user
+from gategpt.hll import HLL_RELATIVE_STANDARD_ERROR
+from gategpt.session_export import SessionExportFormat, stream_sessions
+from fastapi.responses import HTMLResponse, StreamingResponse
 from gategpt.config import templates
 
 
@@ -97,18 +112,101 @@ class GPTAPPSessionsResponseModel(BaseModel):
 class GPTAPPSesssionPaginatedModel(BaseModel):
     items: list[GPTAPPSessionsResponseModel]
     total_count: int
+    next_cursor: str | None = None
+    prev_cursor: str | None = None
+
+
+class GPTAppSessionCursor(BaseModel):
+    """
+    Position of a gpt_session row in the (created_at DESC, id DESC) ordering of the
+    sessions list, and the direction to page in from it.
+    """
+
+    created_at: datetime
+    id: int
+    direction: Literal["next", "prev"]
+
+    def encode(self) -> str:
+        return base64.urlsafe_b64encode(self.model_dump_json().encode()).decode()
+
+    @classmethod
+    def decode(cls, cursor: str) -> "GPTAppSessionCursor":
+        try:
+            return cls.model_validate_json(base64.urlsafe_b64decode(cursor))
+        except (ValueError, ValidationError):
+            raise HTTPException(status_code=400, detail="Invalid cursor")
+
+
+MAX_SESSION_ANALYTICS_BUCKETS = 2000
+DEFAULT_SESSION_ANALYTICS_BUCKETS = {
+    SessionRollupGranularity.HOUR: 48,
+    SessionRollupGranularity.DAY: 30,
+    SessionRollupGranularity.WEEK: 26,
+}
+
+
+class SessionAnalyticsQueryModel(BaseModel):
+    granularity: SessionRollupGranularity = SessionRollupGranularity.DAY
+    start_datetime: datetime | None = None
+    end_datetime: datetime | None = None
+
+
+class SessionAnalyticsBucket(BaseModel):
+    model_config = ConfigDict(from_attributes=True)
+
+    bucket_start: datetime
+    session_count: int
+    unique_users: int
 
 
-class UserSessionQueryModel(BaseModel):
+class SessionAnalyticsResponse(BaseModel):
+    granularity: SessionRollupGranularity
+    start_datetime: datetime
+    end_datetime: datetime
+    total_sessions: int
+    items: list[SessionAnalyticsBucket]
+
+
+DEFAULT_UNIQUE_USERS_DAYS = 30
+
+
+class UniqueUsersQueryModel(BaseModel):
+    start_date: date | None = None
+    end_date: date | None = None
+
+
+class UniqueUsersResponse(BaseModel):
+    start_date: date
+    end_date: date
+    unique_users: int
+    relative_standard_error: float
+
+
+class SessionFilterModel(BaseModel):
     email: str | None = None
     name: str | None = None
     start_datetime: datetime | None = None
     end_datetime: datetime | None = None
+    # Match email and name regardless of case.
+    case_insensitive: bool = False
 
+    @property
+    def is_filtered(self) -> bool:
+        return any((self.email, self.name, self.start_datetime, self.end_datetime))
+
+
+class SessionExportQueryModel(SessionFilterModel):
+    format: SessionExportFormat = SessionExportFormat.CSV
+    gzip: bool = False
+
+
+class UserSessionQueryModel(SessionFilterModel):
     limit: int | None = None
     offset: int | None = 0
+    # When set, offset is ignored and the page is read relative to the cursor.
+    cursor: str | None = None
 
-    @validator("limit")
+    @validator("limit", always=True)
     def set_max_limit(cls, v):
         if v is not None and v > 50:
             return 50
@@ -117,13 +215,52 @@ class UserSessionQueryModel(BaseModel):
         return v
 
 
-def register_custom_gpt_controller(
+def substring_filter(
+    column: InstrumentedAttribute[str], value: str, case_insensitive: bool
+) -> ColumnElement[bool]:
+    """
+    `column LIKE '%value%'`, or ILIKE when case_insensitive, with wildcards in the
+    value escaped. Both are served by the column's pg_trgm GIN index once the
+    value is at least three characters long.
+    """
+    if case_insensitive:
+        return column.icontains(value, autoescape=True)
+    return column.contains(value, autoescape=True)
+
+
+def filter_user_sessions(query: Select, filters: SessionFilterModel) -> Select:
+    case_insensitive = filters.case_insensitive
+    if filters.name and filters.email:
+        query = query.filter(
+            or_(
+                substring_filter(GPTAppSession.name, filters.name, case_insensitive),
+                substring_filter(GPTAppSession.email, filters.email, case_insensitive),
+            )
+        )
+    elif filters.name:
+        query = query.filter(
+            substring_filter(GPTAppSession.name, filters.name, case_insensitive)
+        )
+    elif filters.email:
+        query = query.filter(
+            substring_filter(GPTAppSession.email, filters.email, case_insensitive)
+        )
+
+    if filters.start_datetime:
+        query = query.filter(GPTAppSession.created_at >= filters.start_datetime)
+    if filters.end_datetime:
+        query = query.filter(GPTAppSession.created_at <= filters.end_datetime)
+    return query
+
+
+async def register_custom_gpt_controller(
     request: Request,
     req: RegisterGPTApplicationRequest,
     config: EnvConfig,
-    session: Session,
+    session: AsyncSession,
     logger: Logger,
-    current_user: User,
+    current_user: UserPrincipal,
+    gpt_application_cache: GPTApplicationCache,
 ):
     gpt_application = CustomGPTApplication(
         gpt_name=req.gpt_name,
@@ -131,11 +268,11 @@ def register_custom_gpt_controller(
         gpt_url=str(req.gpt_url),
         verification_medium=req.verification_medium,
         token_expiry=DEFAULT_VERIFICATION_EXPIRY,
-        user=current_user,
+        user_id=current_user.id,
     )
     try:
         session.add(gpt_application)
-        session.flush()
+        await session.flush()
         auth_details = AuthenticationDetails(
             client_id=str(gpt_application.client_id),
             client_secret=str(gpt_application.client_secret),
@@ -160,121 +297,292 @@ def register_custom_gpt_controller(
             privacy_policy_url=url_for(request, "privacy_policy"),
             authentication_details=auth_details,
         )
-        session.commit()
+        await session.commit()
+        gpt_application_cache.invalidate(gpt_application)
         return resp
     except IntegrityError as ex:
         logger.error(f"Failed to create user: {ex}", exc_info=True)
-        session.rollback()
+        await session.rollback()
         raise HTTPException(
             status_code=409,
             detail=f"An account for gpt_url {req.gpt_url} already exists",
         )
 
 
-@gpt_application_router.get(
-    "/api/v1/custom-gpt-application/{gpt_application_id}/gpt-app-sessions",
-    response_model=GPTAPPSesssionPaginatedModel,
-)
-def gpt_app_users_session(
+async def get_owned_gpt_application(
     gpt_application_id: str,
     session: DbSession,
     logger: LoggerDep,
-    query_params: UserSessionQueryModel = Depends(),
-    user: User = Depends(get_current_user),
-):
-    gpt_app = (
-        session.query(CustomGPTApplication)
-        .filter(
-            CustomGPTApplication.uuid == gpt_application_id,
-            CustomGPTApplication.user_id == user.id,
-        )
-        .first()
-    )
+    gpt_application_cache: GPTApplicationCacheDep,
+    user: UserPrincipal = Depends(get_current_user),
+) -> CustomGPTApplication:
+    gpt_app = await gpt_application_cache.get_by_uuid(session, gpt_application_id)
 
-    if not gpt_app:
+    if not gpt_app or gpt_app.user_id != user.id:
         logger.error(
             f"Unauthorized access attempt for GPT app with uuid {gpt_application_id}"
         )
         raise HTTPException(
             status_code=404,
-            detail={
-                "deatil": "GPT application not found or not accessible by the user"
-            },
+            detail="GPT application not found or not accessible by the user",
         )
+    return gpt_app
+
+
+OwnedGPTApplicationDep = Annotated[
+    CustomGPTApplication, Depends(get_owned_gpt_application)
+]
+
 
+@gpt_application_router.get(
+    "/api/v1/custom-gpt-application/{gpt_application_id}/gpt-app-sessions",
+    response_model=GPTAPPSesssionPaginatedModel,
+)
+async def gpt_app_users_session(
+    gpt_app: OwnedGPTApplicationDep,
+    session: DbSession,
+    logger: LoggerDep,
+    query_params: UserSessionQueryModel = Depends(),
+):
     user_sessions_query = (
-        session.query(
+        select(
+            GPTAppSession.id,
             GPTAppSession.email,
             GPTAppSession.name,
             GPTAppSession.created_at,
             CustomGPTApplication.uuid,
         )
         .join(CustomGPTApplication)
-        .filter(CustomGPTApplication.uuid == gpt_application_id)
+        .filter(GPTAppSession.gpt_application_id == gpt_app.id)
     )
 
-    if query_params.name and query_params.email:
-        user_sessions_query = user_sessions_query.filter(
-            or_(
-                GPTAppSession.name.contains(query_params.name),
-                GPTAppSession.email.contains(query_params.email),
-            )
-        )
-    elif query_params.name:
-        user_sessions_query = user_sessions_query.filter(
-            GPTAppSession.name.contains(query_params.name)
-        )
-    elif query_params.email:
-        user_sessions_query = user_sessions_query.filter(
-            GPTAppSession.email.containts(query_params.email)
-        )
+    user_sessions_query = filter_user_sessions(user_sessions_query, query_params)
 
-    if query_params.start_datetime:
-        user_sessions_query = user_sessions_query.filter(
-            GPTAppSession.created_at >= query_params.start_datetime
-        )
-    if query_params.end_datetime:
-        user_sessions_query = user_sessions_query.filter(
-            GPTAppSession.created_at <= query_params.end_datetime
+    if query_params.is_filtered:
+        total_count = await session.scalar(
+            select(func.count()).select_from(user_sessions_query.subquery())
         )
+    else:
+        total_count = await get_session_count(session, gpt_app.id)
 
-    total_count = (
-        session.query(func.count()).select_from(user_sessions_query.subquery()).scalar()
+    cursor = (
+        GPTAppSessionCursor.decode(query_params.cursor) if query_params.cursor else None
     )
+    sort_key = tuple_(GPTAppSession.created_at, GPTAppSession.id)
+    # The plain created_at bounds are implied by the row comparisons, but only
+    # they let Postgres prune gpt_session partitions outside the page.
+    if cursor and cursor.direction == "prev":
+        # Walk the index forwards from the cursor and flip the page afterwards.
+        user_sessions_query = user_sessions_query.filter(
+            sort_key > tuple_(cursor.created_at, cursor.id),
+            GPTAppSession.created_at >= cursor.created_at,
+        ).order_by(asc(GPTAppSession.created_at), asc(GPTAppSession.id))
+    else:
+        if cursor:
+            user_sessions_query = user_sessions_query.filter(
+                sort_key < tuple_(cursor.created_at, cursor.id),
+                GPTAppSession.created_at <= cursor.created_at,
+            )
+        elif query_params.offset:
+            user_sessions_query = user_sessions_query.offset(query_params.offset)
+        user_sessions_query = user_sessions_query.order_by(
+            desc(GPTAppSession.created_at), desc(GPTAppSession.id)
+        )
 
-    user_sessions_query = user_sessions_query.order_by(
-        desc(GPTAppSession.created_at)
-    ).limit(query_params.limit)
-    if query_params.offset:
-        user_sessions_query = user_sessions_query.offset(query_params.offset)
+    # Fetch one extra row to learn whether there is a page beyond this one.
+    user_sessions_query = user_sessions_query.limit(query_params.limit + 1)
+    user_sessions = (await session.execute(user_sessions_query)).all()
+    has_more = len(user_sessions) > query_params.limit
+    user_sessions = user_sessions[: query_params.limit]
 
-    user_sessions = user_sessions_query.all()
+    if cursor and cursor.direction == "prev":
+        user_sessions.reverse()
+        has_next, has_prev = True, has_more
+    else:
+        has_next, has_prev = has_more, bool(cursor or query_params.offset)
 
     if not user_sessions:
-        logger.info(
-            f"No user sessions found for GPT app with uuid {gpt_application_id}"
-        )
+        logger.info(f"No user sessions found for GPT app with uuid {gpt_app.uuid}")
 
     paginated_response = {
         "items": user_sessions,
         "total_count": total_count,
+        "next_cursor": None,
+        "prev_cursor": None,
     }
+    if user_sessions and has_next:
+        paginated_response["next_cursor"] = GPTAppSessionCursor(
+            created_at=user_sessions[-1].created_at,
+            id=user_sessions[-1].id,
+            direction="next",
+        ).encode()
+    if user_sessions and has_prev:
+        paginated_response["prev_cursor"] = GPTAppSessionCursor(
+            created_at=user_sessions[0].created_at,
+            id=user_sessions[0].id,
+            direction="prev",
+        ).encode()
 
     return paginated_response
 
 
+@gpt_application_router.get(
+    "/api/v1/custom-gpt-application/{gpt_application_id}/gpt-app-sessions/export",
+    response_class=StreamingResponse,
+)
+async def gpt_app_users_session_export(
+    gpt_app: OwnedGPTApplicationDep,
+    config: ConfigDep,
+    logger: LoggerDep,
+    query_params: SessionExportQueryModel = Depends(),
+):
+    """
+    Every session matching the filters, oldest first, streamed as CSV or NDJSON
+    and optionally gzipped.
+    """
+    export_query = filter_user_sessions(
+        select(
+            GPTAppSession.email,
+            GPTAppSession.name,
+            GPTAppSession.created_at,
+            CustomGPTApplication.uuid,
+        )
+        .join(CustomGPTApplication)
+        .filter(GPTAppSession.gpt_application_id == gpt_app.id),
+        query_params,
+    ).order_by(asc(GPTAppSession.created_at), asc(GPTAppSession.id))
+
+    export_format = query_params.format
+    filename = f"gpt-app-sessions-{gpt_app.uuid}.{export_format.value}"
+    media_type = export_format.media_type
+    if query_params.gzip:
+        filename += ".gz"
+        media_type = "application/gzip"
+    logger.info(f"Exporting sessions for GPT app {gpt_app.uuid} as {filename}")
+
+    return StreamingResponse(
+        stream_sessions(
+            config.async_session_local,
+            export_query,
+            export_format,
+            gzip=query_params.gzip,
+        ),
+        media_type=media_type,
+        headers={"Content-Disposition": f'attachment; filename="{filename}"'},
+    )
+
+
+@gpt_application_router.get(
+    "/api/v1/custom-gpt-application/{gpt_application_id}/session-analytics",
+    response_model=SessionAnalyticsResponse,
+)
+async def gpt_app_session_analytics(
+    gpt_app: OwnedGPTApplicationDep,
+    session: DbSession,
+    query_params: SessionAnalyticsQueryModel = Depends(),
+):
+    """
+    Sessions and unique users per hour, day or week, read from the session rollups.
+    Every bucket in the range is returned, with zeros where there were no sessions.
+    Unique users are counted within each bucket, so they don't add up across
+    buckets.
+    """
+    granularity = query_params.granularity
+    width = bucket_width(granularity)
+    end_datetime = query_params.end_datetime or utcnow()
+    start_datetime = query_params.start_datetime or (
+        end_datetime - width * (DEFAULT_SESSION_ANALYTICS_BUCKETS[granularity] - 1)
+    )
+    # Naive datetimes are taken to be UTC, like the rollup buckets.
+    if end_datetime.tzinfo is None:
+        end_datetime = end_datetime.replace(tzinfo=UTC)
+    if start_datetime.tzinfo is None:
+        start_datetime = start_datetime.replace(tzinfo=UTC)
+
+    if start_datetime > end_datetime:
+        raise HTTPException(
+            status_code=400, detail="start_datetime must be before end_datetime"
+        )
+    if (end_datetime - start_datetime) / width > MAX_SESSION_ANALYTICS_BUCKETS:
+        raise HTTPException(
+            status_code=400,
+            detail=f"Date range spans more than {MAX_SESSION_ANALYTICS_BUCKETS} {granularity.value} buckets",
+        )
+
+    rollups = {
+        rollup.bucket_start: rollup
+        for rollup in await get_session_rollups(
+            session, gpt_app.id, granularity, start_datetime, end_datetime
+        )
+    }
+    items = []
+    current = bucket_start(granularity, start_datetime)
+    while current <= end_datetime:
+        rollup = rollups.get(current)
+        items.append(
+            SessionAnalyticsBucket.model_validate(rollup)
+            if rollup
+            else SessionAnalyticsBucket(
+                bucket_start=current, session_count=0, unique_users=0
+            )
+        )
+        current += width
+
+    return SessionAnalyticsResponse(
+        granularity=granularity,
+        start_datetime=start_datetime,
+        end_datetime=end_datetime,
+        total_sessions=sum(item.session_count for item in items),
+        items=items,
+    )
+
+
+@gpt_application_router.get(
+    "/api/v1/custom-gpt-application/{gpt_application_id}/unique-users",
+    response_model=UniqueUsersResponse,
+)
+async def gpt_app_unique_users(
+    gpt_app: OwnedGPTApplicationDep,
+    session: DbSession,
+    query_params: UniqueUsersQueryModel = Depends(),
+):
+    """
+    Estimated distinct users between two UTC dates, inclusive, merged from the
+    daily HyperLogLog sketches. About 95% of estimates are within two relative
+    standard errors of the true count.
+    """
+    end_date = query_params.end_date or utcnow().date()
+    start_date = query_params.start_date or (
+        end_date - timedelta(days=DEFAULT_UNIQUE_USERS_DAYS - 1)
+    )
+    if start_date > end_date:
+        raise HTTPException(
+            status_code=400, detail="start_date must be before end_date"
+        )
+
+    return UniqueUsersResponse(
+        start_date=start_date,
+        end_date=end_date,
+        unique_users=await estimate_unique_users(
+            session, gpt_app.id, start_date, end_date
+        ),
+        relative_standard_error=HLL_RELATIVE_STANDARD_ERROR,
+    )
+
+
 @gpt_application_router.get(
     "/api/v1/custom-gpt-application",
     response_model=list[CustomGPTApplicationResponse],
 )
-def gpt_applications(
-    session: DbSession, logger: LoggerDep, user: User = Depends(get_current_user)
+async def gpt_applications(
+    session: DbSession,
+    logger: LoggerDep,
+    user: UserPrincipal = Depends(get_current_user),
 ):
-    gpt_apps = (
-        session.query(CustomGPTApplication)
-        .filter(CustomGPTApplication.user_id == user.id)
-        .all()
+    result = await session.execute(
+        select(CustomGPTApplication).filter(CustomGPTApplication.user_id == user.id)
     )
+    gpt_apps = result.scalars().all()
     return [CustomGPTApplicationResponse.model_validate(i) for i in gpt_apps]
 
 
@@ -286,7 +594,7 @@ def gpt_applications(
 )
 async def gpt_application_registration_view(
     request: Request,
-    current_user: User = Depends(login_required),
+    current_user: UserPrincipal = Depends(login_required),
 ):
     return templates.TemplateResponse("register_gpt.html", {"request": request})
 
@@ -297,22 +605,24 @@ async def gpt_application_registration_view(
     status_code=201,
     response_model=RegisterGPTApplicationResponse,
 )
-def register_custom_gpt_api(
+async def register_custom_gpt_api(
     request: Request,
     req: RegisterGPTApplicationRequest,
     config: ConfigDep,
     session: DbSession,
     logger: LoggerDep,
-    current_user: User = Depends(get_current_user),
+    gpt_application_cache: GPTApplicationCacheDep,
+    current_user: UserPrincipal = Depends(get_current_user),
 ):
     logger.info(current_user.email)
-    resp = register_custom_gpt_controller(
+    resp = await register_custom_gpt_controller(
         request=request,
         req=req,
         config=config,
         session=session,
         logger=logger,
         current_user=current_user,
+        gpt_application_cache=gpt_application_cache,
     )
     return resp
 
@@ -322,29 +632,11 @@ def register_custom_gpt_api(
     path="/api/v1/custom-gpt-application/{gpt_application_id}",
     response_model=RegisterGPTApplicationResponse,
 )
-def gpt_application_detail(
+async def gpt_application_detail(
     request: Request,
-    gpt_application_id: str,
-    session: DbSession,
-    logger: LoggerDep,
+    gpt_app: OwnedGPTApplicationDep,
     config: ConfigDep,
-    current_user: User = Depends(get_current_user),
 ):
-    gpt_app = (
-        session.query(CustomGPTApplication)
-        .filter(
-            CustomGPTApplication.uuid == gpt_application_id,
-            CustomGPTApplication.user_id == current_user.id,
-        )
-        .first()
-    )
-
-    if not gpt_app:
-        logger.error(f"Gpt application with uuid {gpt_application_id}")
-        raise HTTPException(
-            status_code=404,
-            detail={"detail": "GPT application not found"},
-        )
     auth_details = AuthenticationDetails(
         client_id=str(gpt_app.client_id),
         client_secret=str(gpt_app.client_secret),
@@ -375,7 +667,7 @@ def gpt_application_detail(
 def gpt_application_deail_page(
     request: Request,
     gpt_application_id: str,
-    current_user: User = Depends(get_current_user),
+    current_user: UserPrincipal = Depends(get_current_user),
 ):
     return templates.TemplateResponse(
         "gpt_application_detail.html", {"request": request}
@@ -389,7 +681,9 @@ def gpt_application_deail_page(
     include_in_schema=False,
 )
 def gpt_app_users_sesssion_page(
-    request: Request, gpt_application_id: str, user: User = Depends(login_required)
+    request: Request,
+    gpt_application_id: str,
+    user: UserPrincipal = Depends(login_required),
 ):
     return templates.TemplateResponse(
         "gpt_app_sessions.html", context={"request": request}
@@ -1,29 +1,46 @@
+from datetime import datetime, timedelta
 from logging import Logger
 from typing import Annotated, TypedDict
 from urllib.parse import urlencode
 import uuid
-from authlib.integrations.httpx_client import AsyncOAuth2Client
-from fastapi import APIRouter, Depends, Form, HTTPException, Request
+from fastapi import APIRouter, BackgroundTasks, Depends, Form, HTTPException, Request
 from fastapi.exceptions import RequestValidationError
 from fastapi.responses import JSONResponse, RedirectResponse
 from fastapi.security import HTTPBasic, HTTPBasicCredentials
 import httpx
 from pydantic import BaseModel, HttpUrl, ValidationError, field_validator
 import shortuuid
-from sqlalchemy.orm import Session, joinedload
+from sqlalchemy import select, update
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.orm import joinedload
 from gategpt.config import EnvConfig, create_jwt_token
 
-from gategpt.dependencies import ConfigDep, DbSession, LoggerDep
+from gategpt.dependencies import (
+    ConfigDep,
+    DbSession,
+    GPTApplicationCacheDep,
+    LoggerDep,
+    RateLimiterDep,
+    StatelessOAuthCodesDep,
+)
 from gategpt.models import (
     OAuthVerificationRequest,
     OAuthVerificationRequestStatus,
     CustomGPTApplication,
 )
+from gategpt.oauth_codes import (
+    InvalidOAuthCodeError,
+    StatelessAuthorizationCode,
+    StatelessOAuthCodes,
+)
+from gategpt.rate_limit import RateLimit, RateLimitCheck, enforce_rate_limits
 from gategpt.utils import url_for, utcnow
 
 
 oauth2_router = APIRouter()
 
+GOOGLE_USERINFO_URL = "https://www.googleapis.com/oauth2/v3/userinfo"
+
 
 class AuthorizationRequestParams(BaseModel):
     client_id: uuid.UUID
@@ -50,21 +67,46 @@ class GoogleUserInfo(TypedDict):
     name: str
 
 
+def _per_minute(limit: int) -> RateLimit:
+    return RateLimit(limit, timedelta(minutes=1))
+
+
+def _client_ip(request: Request) -> str:
+    return request.client.host if request.client else "unknown"
+
+
 @oauth2_router.get("/authorize")
 async def oauth2_server_authorize(
     request: Request,
     config: ConfigDep,
     session: DbSession,
+    gpt_application_cache: GPTApplicationCacheDep,
+    stateless_oauth_codes: StatelessOAuthCodesDep,
+    rate_limiter: RateLimiterDep,
 ):
     try:
         params = AuthorizationRequestParams(**request.query_params._dict)
     except ValidationError as e:
         raise RequestValidationError(errors=e.errors())
 
-    gpt_application = (
-        session.query(CustomGPTApplication)
-        .filter(CustomGPTApplication.client_id == params.client_id)
-        .first()
+    await enforce_rate_limits(
+        rate_limiter,
+        [
+            RateLimitCheck(
+                "authorize:client",
+                str(params.client_id),
+                _per_minute(config.rate_limit_client_per_minute),
+            ),
+            RateLimitCheck(
+                "authorize:ip",
+                _client_ip(request),
+                _per_minute(config.rate_limit_ip_per_minute),
+            ),
+        ],
+    )
+
+    gpt_application = await gpt_application_cache.get_by_client_id(
+        session, params.client_id
     )
     if not gpt_application:
         raise HTTPException(
@@ -79,6 +121,29 @@ async def oauth2_server_authorize(
         )
 
     nonce = params.nonce or shortuuid.uuid()
+    callback_uri = url_for(
+        request,
+        "oauth2_server_callback_google",
+        scheme=config.url_scheme,
+    )
+
+    if config.stateless_oauth:
+        state = stateless_oauth_codes.issue_flow(
+            gpt_application_id=gpt_application.id,
+            redirect_uri=str(params.redirect_uri),
+            state=params.state,
+            nonce=nonce,
+            expires_in=gpt_application.token_expiry,
+        )
+        # authorize_redirect would also copy the flow into the session cookie,
+        # which the stateless flow never reads back.
+        authorization = await config.google_oauth_client.create_authorization_url(
+            callback_uri,
+            state=state,
+            nonce=nonce,
+            access_type="offline",
+        )
+        return RedirectResponse(url=authorization["url"])
 
     oauth_verification_request = OAuthVerificationRequest(
         provider="google",
@@ -91,16 +156,12 @@ async def oauth2_server_authorize(
     )
 
     session.add(oauth_verification_request)
-    session.flush()
+    await session.flush()
     verification_request_id = oauth_verification_request.uuid
-    session.commit()
+    await session.commit()
     return await config.google_oauth_client.authorize_redirect(
         request,
-        redirect_uri=url_for(
-            request,
-            "oauth2_server_callback_google",
-            scheme=config.url_scheme,
-        ),
+        redirect_uri=callback_uri,
         state=verification_request_id,
         nonce=nonce,
         access_type="offline",
@@ -110,18 +171,22 @@ async def oauth2_server_authorize(
 security = HTTPBasic()
 
 
-def verify_credentials(
-    credentials: Annotated[HTTPBasicCredentials, Depends(security)], session: DbSession
+async def verify_credentials(
+    credentials: Annotated[HTTPBasicCredentials, Depends(security)],
+    session: DbSession,
+    gpt_application_cache: GPTApplicationCacheDep,
 ):
-    client_id = credentials.username
-    client_secret = credentials.password
-    gpt_application = (
-        session.query(CustomGPTApplication)
-        .filter(
-            CustomGPTApplication.client_id == client_id,
-            CustomGPTApplication.client_secret == client_secret,
+    try:
+        client_id = uuid.UUID(credentials.username)
+        client_secret = uuid.UUID(credentials.password)
+    except ValueError:
+        raise HTTPException(
+            status_code=401,
+            detail="Invalid client_id or client_secret",
         )
-        .first()
+
+    gpt_application = await gpt_application_cache.get_by_credentials(
+        session, client_id, client_secret
     )
     if not gpt_application:
         raise HTTPException(
@@ -150,27 +215,48 @@ async def _fetch_access_token(
     return token
 
 
-async def _fetch_google_user_profile(access_token: str) -> GoogleUserInfo:
-    client = AsyncOAuth2Client(token={"access_token": access_token})
-
-    userinfo_endpoint = "https://www.googleapis.com/oauth2/v3/userinfo"
+async def _fetch_google_user_profile(
+    access_token: str, config: EnvConfig
+) -> GoogleUserInfo:
+    # From the discovery document, so a stub provider's endpoint is used too.
+    userinfo_endpoint = config.google_oauth_client.server_metadata.get(
+        "userinfo_endpoint", GOOGLE_USERINFO_URL
+    )
 
-    response = await client.get(userinfo_endpoint)
+    response = await config.google_http_client.get(
+        userinfo_endpoint, headers={"Authorization": f"Bearer {access_token}"}
+    )
+    response.raise_for_status()
     return response.json()
 
 
-async def _fetch_user_email(
+async def _fetch_user_info(
     token: dict,
     nonce: str,
     config: EnvConfig,
-):
+    logger: Logger,
+) -> GoogleUserInfo:
+    """
+    Read email and name from the id_token returned by the code exchange, verified
+    locally against the cached Google signing keys. Only call the userinfo endpoint
+    when there is no usable id_token or it lacks those claims.
+    """
     oauth_client = config.google_oauth_client
     if "id_token" in token:
-        userinfo = await oauth_client.parse_id_token(token, nonce=nonce)
-        email = userinfo["email"]
-        return email
-    else:
-        raise Exception("Unable to get user email from google oauth. Please try again")
+        try:
+            claims = await oauth_client.parse_id_token(token, nonce=nonce)
+        except (httpx.RequestError, httpx.HTTPStatusError):
+            raise
+        except Exception as exc:
+            logger.warning(
+                f"Failed validating id_token, falling back to userinfo: {exc}",
+                exc_info=True,
+            )
+            claims = {}
+        if claims.get("email") and claims.get("name"):
+            return {"email": claims["email"], "name": claims["name"]}
+
+    return await _fetch_google_user_profile(token["access_token"], config)
 
 
 class OAuth2ServerTokenResponse(BaseModel):
@@ -179,6 +265,62 @@ class OAuth2ServerTokenResponse(BaseModel):
     access_token: str
 
 
+def _redeem_stateless_code(
+    stateless_oauth_codes: StatelessOAuthCodes,
+    code: str,
+    gpt_application: CustomGPTApplication,
+    redirect_uri: str,
+    logger: Logger,
+) -> StatelessAuthorizationCode:
+    try:
+        return stateless_oauth_codes.redeem_code(code, gpt_application.id, redirect_uri)
+    except InvalidOAuthCodeError as exc:
+        logger.warning(
+            f"Rejected stateless authorization code for GPT application {gpt_application.id}: {exc}"
+        )
+        raise HTTPException(
+            status_code=422,
+            detail="Either OAuth Verification Request is expired or archived. Please start again",
+        )
+
+
+async def _write_stateless_audit_record(
+    config: EnvConfig,
+    authorization_code: StatelessAuthorizationCode,
+    email: str,
+    verified_at: datetime,
+    logger: Logger,
+) -> None:
+    """
+    Record a completed stateless flow in oauth_verification_request. Runs after the
+    response is sent, so failures are only logged.
+    """
+    try:
+        async with config.async_session_local() as session:
+            session.add(
+                OAuthVerificationRequest(
+                    uuid=authorization_code.jti,
+                    provider="google",
+                    gpt_application_id=authorization_code.gpt_application_id,
+                    state=authorization_code.state,
+                    redirect_uri=authorization_code.redirect_uri,
+                    nonce=authorization_code.nonce,
+                    status=OAuthVerificationRequestStatus.VERIFIED,
+                    oauth_flow_started_at=authorization_code.iat,
+                    oauth_callback_completed_at=authorization_code.callback_completed_at,
+                    verified_at=verified_at,
+                    email=email,
+                    created_at=authorization_code.iat,
+                )
+            )
+            await session.commit()
+    except Exception as exc:
+        logger.error(
+            f"Failed writing audit record for stateless OAuth flow {authorization_code.jti}: {exc}",
+            exc_info=True,
+        )
+
+
 @oauth2_router.post("/token", response_class=JSONResponse)
 async def oauth2_server_token(
     request: Request,
@@ -189,23 +331,60 @@ async def oauth2_server_token(
     code: Annotated[str, Form()],
     redirect_uri: Annotated[str, Form()],
     logger: LoggerDep,
+    stateless_oauth_codes: StatelessOAuthCodesDep,
+    background_tasks: BackgroundTasks,
+    rate_limiter: RateLimiterDep,
 ):
+    # Token requests come from OpenAI's servers, so they are not limited by IP.
+    await enforce_rate_limits(
+        rate_limiter,
+        [
+            RateLimitCheck(
+                "token:client",
+                str(gpt_application.client_id),
+                _per_minute(config.rate_limit_client_per_minute),
+            )
+        ],
+    )
     if grant_type != "authorization_code":
         raise HTTPException(
             status_code=400,
             detail="Invalid grant_type",
         )
 
-    oauth_verification_request = (
-        session.query(OAuthVerificationRequest)
+    if config.stateless_oauth:
+        authorization_code = _redeem_stateless_code(
+            stateless_oauth_codes, code, gpt_application, redirect_uri, logger
+        )
+        user_info = await _exchange_authorization_code(
+            request,
+            verification_request_uuid=authorization_code.jti,
+            authorization_code=authorization_code.google_code,
+            nonce=authorization_code.nonce,
+            config=config,
+            logger=logger,
+        )
+        if config.stateless_oauth_audit:
+            background_tasks.add_task(
+                _write_stateless_audit_record,
+                config,
+                authorization_code,
+                user_info["email"],
+                utcnow(),
+                logger,
+            )
+        return _token_response(config, gpt_application, user_info, logger)
+
+    result = await session.execute(
+        select(OAuthVerificationRequest)
         .filter(
             OAuthVerificationRequest.uuid == code,
             OAuthVerificationRequest.redirect_uri == redirect_uri,
             OAuthVerificationRequest.gpt_application_id == gpt_application.id,
         )
         .options(joinedload(OAuthVerificationRequest.gpt_application))
-        .first()
     )
+    oauth_verification_request = result.scalars().first()
     if not oauth_verification_request:
         raise HTTPException(
             status_code=404,
@@ -223,18 +402,42 @@ async def oauth2_server_token(
             detail="Either OAuth Verification Request is expired or archived. Please start again",
         )
 
-    token = await _fetch_access_token(
+    user_info = await _exchange_authorization_code(
+        request,
         verification_request_uuid=code,
         authorization_code=oauth_verification_request.authorization_code,
         nonce=oauth_verification_request.nonce,
+        config=config,
+        logger=logger,
+    )
+
+    oauth_verification_request.status = OAuthVerificationRequestStatus.VERIFIED
+    oauth_verification_request.verified_at = utcnow()
+    oauth_verification_request.email = user_info["email"]
+    session.add(oauth_verification_request)
+    await session.commit()
+    return _token_response(config, gpt_application, user_info, logger)
+
+
+async def _exchange_authorization_code(
+    request: Request,
+    verification_request_uuid: str,
+    authorization_code: str,
+    nonce: str,
+    config: EnvConfig,
+    logger: Logger,
+) -> GoogleUserInfo:
+    token = await _fetch_access_token(
+        verification_request_uuid=verification_request_uuid,
+        authorization_code=authorization_code,
+        nonce=nonce,
         redirect_uri=url_for(
             request, "oauth2_server_callback_google", scheme=config.url_scheme
         ),
         config=config,
     )
-    access_token = token["access_token"]
     try:
-        user_info = await _fetch_google_user_profile(access_token)
+        return await _fetch_user_info(token, nonce, config, logger)
     except (httpx.RequestError, httpx.NetworkError) as exc:
         logger.error(
             f"A network error occurred while fetching user_info: {exc}",
@@ -245,12 +448,19 @@ async def oauth2_server_token(
         )
     except httpx.HTTPStatusError as exc:
         error_msg = "Error while validating token"
-        logger.errror(
+        logger.error(
             f"Error while fetching user profile: Status Code: {exc.response.status_code}. Response: {exc.response.content}",
             exc_info=exc,
         )
         raise HTTPException(status_code=exc.response.status_code, detail=error_msg)
 
+
+def _token_response(
+    config: EnvConfig,
+    gpt_application: CustomGPTApplication,
+    user_info: GoogleUserInfo,
+    logger: Logger,
+) -> dict:
     email = user_info["email"]
     name = user_info["name"]
     jwt_token = create_jwt_token(
@@ -263,16 +473,10 @@ async def oauth2_server_token(
     logger.info(
         f"Successfully fetched user email: {email} and name: {name} from google oauth"
     )
-
-    oauth_verification_request.status = OAuthVerificationRequestStatus.VERIFIED
-    oauth_verification_request.verified_at = utcnow()
-    oauth_verification_request.email = email
-    session.add(oauth_verification_request)
-    session.commit()
     return {
         "name": name,
         "email": email,
-        "gpt_application_id": oauth_verification_request.gpt_application_id,
+        "gpt_application_id": gpt_application.id,
         "access_token": jwt_token,
     }
 
@@ -296,10 +500,12 @@ def _verify_oauth_callback_request(request: Request, logger: Logger) -> tuple[st
     verification_request_uuid = request.query_params.get("state")
     error_description = None
     if error_code:
+        error_description = request.query_params.get(
+            "error_description", "Google Authentication Failed. Please try again"
+        )
         logger.error(
             f"Error while login using google oauth: {error_description}, Verification Request UUId: {verification_request_uuid}"
         )
-        error_description = request.query_params.get("error_description")
 
     elif code is None:
         logger.error("Error while login using google oauth: Code is not passed")
@@ -318,18 +524,18 @@ def _verify_oauth_callback_request(request: Request, logger: Logger) -> tuple[st
     return code, verification_request_uuid
 
 
-def _verify_oauth_verification_request(
-    verification_request_uuid: str, session: Session, logger: Logger
+async def _verify_oauth_verification_request(
+    verification_request_uuid: str, session: AsyncSession, logger: Logger
 ) -> OAuthVerificationRequest:
     now = utcnow()
-    verification_request = (
-        session.query(OAuthVerificationRequest)
+    result = await session.execute(
+        select(OAuthVerificationRequest)
         .options(joinedload(OAuthVerificationRequest.gpt_application))
         .filter(
             OAuthVerificationRequest.uuid == verification_request_uuid,
         )
-        .first()
     )
+    verification_request = result.scalars().first()
     if not verification_request:
         logger.error(
             f"Error while login using google oauth: Invalid verification_request_uuid: {verification_request_uuid}"
@@ -361,19 +567,73 @@ def _verify_oauth_verification_request(
     return verification_request
 
 
+def _stateless_oauth2_callback(
+    request: Request, stateless_oauth_codes: StatelessOAuthCodes, logger: Logger
+) -> RedirectResponse:
+    try:
+        flow = stateless_oauth_codes.read_flow(request.query_params.get("state"))
+    except InvalidOAuthCodeError as exc:
+        logger.error(f"Error while login using google oauth: Invalid state: {exc}")
+        raise HTTPException(status_code=400, detail="Invalid OAuth state")
+
+    try:
+        code, _ = _verify_oauth_callback_request(request, logger)
+        if flow.exp < utcnow():
+            logger.warn(
+                f"Google Authentication Request Expired. Verification Request UUId: {flow.jti}"
+            )
+            raise OAuthCallBackException(
+                OAuthVerificationRequestStatus.EXPIRED,
+                "access_denied",
+                "Google Authentication Request Expired.",
+            )
+        query_params = {
+            "code": stateless_oauth_codes.issue_code(flow, code),
+            "state": flow.state,
+        }
+    except OAuthCallBackException as e:
+        query_params = {
+            "error": e.error_code,
+            "error_description": e.message,
+            "state": flow.state,
+        }
+
+    redirect_uri = f"{flow.redirect_uri}?{urlencode(query_params)}"
+    logger.info(f"After Google OAuth Callback redirecting to: {flow.redirect_uri}")
+    return RedirectResponse(url=redirect_uri)
+
+
 @oauth2_router.get(
     "/callback/google",
 )
 async def oauth2_server_callback_google(
-    request: Request, config: ConfigDep, session: DbSession, logger: LoggerDep
+    request: Request,
+    config: ConfigDep,
+    session: DbSession,
+    logger: LoggerDep,
+    stateless_oauth_codes: StatelessOAuthCodesDep,
+    rate_limiter: RateLimiterDep,
 ):
+    await enforce_rate_limits(
+        rate_limiter,
+        [
+            RateLimitCheck(
+                "callback:ip",
+                _client_ip(request),
+                _per_minute(config.rate_limit_ip_per_minute),
+            )
+        ],
+    )
+    if config.stateless_oauth:
+        return _stateless_oauth2_callback(request, stateless_oauth_codes, logger)
+
     code = None
     status = None
     try:
         code, verification_request_uuid = _verify_oauth_callback_request(
             request, logger
         )
-        verification_request = _verify_oauth_verification_request(
+        verification_request = await _verify_oauth_verification_request(
             verification_request_uuid, session, logger
         )
         status = OAuthVerificationRequestStatus.CALLBACK_COMPLETED
@@ -393,15 +653,20 @@ async def oauth2_server_callback_google(
     query = urlencode(query_params)
     redirect_uri = f"{verification_request.redirect_uri}?{query}"
 
-    session.query(OAuthVerificationRequest).filter(
-        OAuthVerificationRequest.id == verification_request.id,
-    ).update(
-        {
-            OAuthVerificationRequest.status: status,
-            OAuthVerificationRequest.oauth_callback_completed_at: utcnow(),
-            OAuthVerificationRequest.authorization_code: code,
-        }
+    await session.execute(
+        update(OAuthVerificationRequest)
+        .filter(
+            OAuthVerificationRequest.id == verification_request.id,
+            OAuthVerificationRequest.created_at == verification_request.created_at,
+        )
+        .values(
+            {
+                OAuthVerificationRequest.status: status,
+                OAuthVerificationRequest.oauth_callback_completed_at: utcnow(),
+                OAuthVerificationRequest.authorization_code: code,
+            }
+        )
     )
-    session.commit()
+    await session.commit()
     logger.info(f"After Google OAuth Callback redirecting to: {redirect_uri}")
     return RedirectResponse(url=redirect_uri)
@@ -1,11 +1,21 @@
-from typing import Any
-from fastapi import APIRouter, Query, Request
-from fastapi.responses import JSONResponse
+import hashlib
+import json
+from typing import Any, Iterable
+from fastapi import APIRouter, FastAPI, Query, Request
+from fastapi.responses import JSONResponse, Response
+from pydantic import BaseModel
 
 from gategpt.config import OpenAPISchemaTags
 
 openapi_schema_router = APIRouter()
 
+OPENAPI_SCHEMA_CACHE_CONTROL = "public, max-age=300"
+
+
+class EncodedOpenAPISchema(BaseModel):
+    content: bytes
+    etag: str
+
 
 def find_values_with_key(nested_dict: dict, target_key: str):
     """
@@ -20,8 +30,14 @@ def find_values_with_key(nested_dict: dict, target_key: str):
         for key, value in current_dict.items():
             if key == target_key:
                 found_values.append(value)
-            if isinstance(value, dict):
-                recurse_through_dict(value)
+            recurse_through_value(value)
+
+    def recurse_through_value(value):
+        if isinstance(value, dict):
+            recurse_through_dict(value)
+        elif isinstance(value, list):
+            for item in value:
+                recurse_through_value(item)
 
     recurse_through_dict(nested_dict)
     return found_values
@@ -83,7 +99,6 @@ def filter_openapi_schema_by_tags(schema: dict[str, Any], tags: set[OpenAPISchem
                 response_body_components = find_values_with_key(
                     details.get("responses", {}), "$ref"
                 )
-                print(response_body_components)
                 for response_ref in response_body_components:
                     if response_ref:
                         _, component_name = parse_component_ref(response_ref)
@@ -94,24 +109,73 @@ def filter_openapi_schema_by_tags(schema: dict[str, Any], tags: set[OpenAPISchem
                     for sec_key in sec_req.keys():
                         required_components["securitySchemes"].add(sec_key)
 
-    # Add required components to the filtered schema
-    for component_type, component_names in required_components.items():
-        for component_name in component_names:
-            component = schema["components"][component_type][component_name]
-            filtered_schema["components"][component_type][component_name] = component
-            other_component_refs = find_values_with_key(component, "$ref")
-            for ref in other_component_refs:
-                if ref:
-                    other_component_type, other_component_name = parse_component_ref(
-                        ref
+    # Add required components, and every component they reference in turn, to the
+    # filtered schema
+    pending_components = [
+        (component_type, component_name)
+        for component_type, component_names in required_components.items()
+        for component_name in component_names
+    ]
+    while pending_components:
+        component_type, component_name = pending_components.pop()
+        if component_name in filtered_schema["components"][component_type]:
+            continue
+        component = schema["components"][component_type][component_name]
+        filtered_schema["components"][component_type][component_name] = component
+        for ref in find_values_with_key(component, "$ref"):
+            if ref:
+                other_component_type, other_component_name = parse_component_ref(ref)
+                if other_component_type:
+                    pending_components.append(
+                        (other_component_type, other_component_name)
                     )
-                    filtered_schema["components"][other_component_type][
-                        other_component_name
-                    ] = schema["components"][other_component_type][other_component_name]
 
     return filtered_schema
 
 
+def encode_openapi_schema(schema: dict[str, Any]) -> EncodedOpenAPISchema:
+    """
+    Serialize a schema the same way JSONResponse does and tag it with a strong ETag.
+    """
+    content = json.dumps(
+        schema,
+        ensure_ascii=False,
+        allow_nan=False,
+        indent=None,
+        separators=(",", ":"),
+    ).encode("utf-8")
+    etag = f'"{hashlib.sha256(content).hexdigest()[:32]}"'
+    return EncodedOpenAPISchema(content=content, etag=etag)
+
+
+def get_filtered_openapi_schema(
+    app: FastAPI, tags: Iterable[OpenAPISchemaTags]
+) -> EncodedOpenAPISchema:
+    """
+    Filter and encode the app's OpenAPI schema for a tag set, once per distinct set.
+    The schema only changes on deploy, so entries live as long as the app.
+    """
+    tags = frozenset(tags)
+    if not hasattr(app.state, "filtered_openapi_schemas"):
+        app.state.filtered_openapi_schemas = {}
+    encoded_schema = app.state.filtered_openapi_schemas.get(tags)
+    if encoded_schema is None:
+        encoded_schema = encode_openapi_schema(
+            filter_openapi_schema_by_tags(app.openapi(), set(tags))
+        )
+        app.state.filtered_openapi_schemas[tags] = encoded_schema
+    return encoded_schema
+
+
+def _etag_matches(if_none_match: str | None, etag: str) -> bool:
+    if not if_none_match:
+        return False
+    candidates = [candidate.strip() for candidate in if_none_match.split(",")]
+    return "*" in candidates or any(
+        candidate.removeprefix("W/") == etag for candidate in candidates
+    )
+
+
 # Usage Example
 # Assuming `original_schema` is your full OpenAPI schema and `tags_list` is your list of tags
 # filtered_schema = filter_openapi_schema_by_tags(original_schema, tags_list)
@@ -123,9 +187,19 @@ def filter_openapi_schema_by_tags(schema: dict[str, Any], tags: set[OpenAPISchem
     include_in_schema=False,
     name="openapi_schema_by_tags",
 )
-def openapi_schema_by_tags(
+async def openapi_schema_by_tags(
     request: Request,
     tags: list[OpenAPISchemaTags] = Query([]),
 ):
-    openapi_schema = request.app.openapi()
-    return filter_openapi_schema_by_tags(openapi_schema, set(tags))
+    encoded_schema = get_filtered_openapi_schema(request.app, tags)
+    headers = {
+        "ETag": encoded_schema.etag,
+        "Cache-Control": OPENAPI_SCHEMA_CACHE_CONTROL,
+    }
+    if _etag_matches(request.headers.get("if-none-match"), encoded_schema.etag):
+        return Response(status_code=304, headers=headers)
+    return Response(
+        content=encoded_schema.content,
+        media_type="application/json",
+        headers=headers,
+    )
@@ -1,11 +1,24 @@
 from fastapi import APIRouter, HTTPException, Depends
-from fastapi.responses import HTMLResponse, FileResponse
+from fastapi.responses import HTMLResponse, FileResponse, Response
 from sqlalchemy import text
 
-from gategpt.dependencies import DbSession, LoggerDep, login_required
+from gategpt.dependencies import (
+    ConfigDep,
+    DbSession,
+    EmailDeliveryDep,
+    GPTApplicationCacheDep,
+    GPTAppSessionBufferDep,
+    HTTPMetricsDep,
+    LoggerDep,
+    UserCacheDep,
+    UserPrincipal,
+    VerifiedJWTCacheDep,
+    internal_endpoint,
+    login_required,
+)
 from fastapi import Request
-from gategpt.models import User
 from gategpt.config import templates
+from gategpt.metrics import METRICS_CONTENT_TYPE, render_metrics
 
 root_router = APIRouter()
 
@@ -48,7 +61,9 @@ async def privacy_policy():
 
 @root_router.get("/", include_in_schema=False, response_class=FileResponse, name="root")
 def root(
-    request: Request, logger: LoggerDep, current_user: User = Depends(login_required)
+    request: Request,
+    logger: LoggerDep,
+    current_user: UserPrincipal = Depends(login_required),
 ):
     logger.info("Root endpoint hit")
     return templates.TemplateResponse(
@@ -78,12 +93,77 @@ def not_found_page(
     "/healthcheck",
     include_in_schema=False,
 )
-def healthcheck(session: DbSession, logger: LoggerDep):
+async def healthcheck(session: DbSession, logger: LoggerDep):
     try:
-        session.execute(text("SELECT 1"))
+        await session.execute(text("SELECT 1"))
         return {"api_status": "success", "db_status": "success"}
     except Exception as ex:
         logger.error(f"Error while checking connection to db: {ex}", exc_info=True)
         raise HTTPException(
             status_code=500, detail="Error while connecting with database"
         )
+
+
+@root_router.get(
+    "/healthcheck/cache",
+    include_in_schema=False,
+    dependencies=[Depends(internal_endpoint)],
+)
+def cache_stats(
+    gpt_application_cache: GPTApplicationCacheDep,
+    verified_jwt_cache: VerifiedJWTCacheDep,
+    user_cache: UserCacheDep,
+):
+    return {
+        name: {**stats.model_dump(), "hit_ratio": stats.hit_ratio}
+        for name, stats in [
+            ("gpt_application", gpt_application_cache.stats()),
+            ("verified_jwt", verified_jwt_cache.stats()),
+            ("user", user_cache.stats()),
+        ]
+    }
+
+
+@root_router.get(
+    "/healthcheck/session-buffer",
+    include_in_schema=False,
+    dependencies=[Depends(internal_endpoint)],
+)
+def session_buffer_stats(gpt_app_session_buffer: GPTAppSessionBufferDep):
+    if gpt_app_session_buffer is None:
+        return {"enabled": False}
+    return {"enabled": True, **gpt_app_session_buffer.stats().model_dump()}
+
+
+@root_router.get(
+    "/healthcheck/email-delivery",
+    include_in_schema=False,
+    dependencies=[Depends(internal_endpoint)],
+)
+def email_delivery_stats(email_delivery: EmailDeliveryDep):
+    return email_delivery.stats().model_dump()
+
+
+# Async so it renders on the event loop thread, between metric updates.
+@root_router.get(
+    "/metrics",
+    include_in_schema=False,
+    dependencies=[Depends(internal_endpoint)],
+)
+async def metrics(
+    config: ConfigDep,
+    http_metrics: HTTPMetricsDep,
+    gpt_app_session_buffer: GPTAppSessionBufferDep,
+):
+    return Response(
+        render_metrics(
+            http_metrics,
+            config.google_http_transport.metrics,
+            {
+                "async": config.async_db_engine.pool,
+                "sync": config.db_engine.pool,
+            },
+            gpt_app_session_buffer,
+        ),
+        media_type=METRICS_CONTENT_TYPE,
+    )
@@ -0,0 +1,190 @@
+import asyncio
+from collections import Counter
+from datetime import datetime, timedelta
+import logging
+import time
+from typing import Callable, Optional
+
+from pydantic import BaseModel
+from sqlalchemy import insert
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from gategpt.analytics import increment_session_count, update_session_rollups
+from gategpt.metrics import Histogram
+from gategpt.models import GPTAppSession
+
+logger = logging.getLogger(__name__)
+
+FLUSH_RETRY_DELAYS = (0.5, 2.0)
+
+
+class SessionBufferFullError(Exception):
+    pass
+
+
+class SessionBufferStats(BaseModel):
+    queue_depth: int
+    max_size: int
+    enqueued_rows: int
+    flushed_rows: int
+    flushed_batches: int
+    failed_batches: int
+    retried_flushes: int
+    dropped_rows: int
+    last_flush_seconds: float
+    max_flush_seconds: float
+    total_flush_seconds: float
+
+
+class GPTAppSessionBuffer:
+    """
+    Write-behind buffer for gpt_session rows.
+
+    Rows are queued in process and written in a single multi-row INSERT per batch,
+    together with the matching session counter and rollup updates, whenever `batch_size`
+    rows are waiting or `flush_interval` has passed since the first one arrived.
+    When the queue is full `put` waits up to `put_timeout` for room and then raises
+    SessionBufferFullError so callers can shed load. `stop` flushes everything
+    still queued.
+    """
+
+    def __init__(
+        self,
+        session_factory: Callable[[], AsyncSession],
+        max_size: int,
+        batch_size: int,
+        flush_interval: timedelta,
+        put_timeout: timedelta,
+    ) -> None:
+        self._session_factory = session_factory
+        self.max_size = max_size
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval.total_seconds()
+        self.put_timeout = put_timeout.total_seconds()
+        self._queue: Optional[asyncio.Queue[Optional[dict]]] = None
+        self._task: Optional[asyncio.Task] = None
+        self.enqueued_rows = 0
+        self.flushed_rows = 0
+        self.flushed_batches = 0
+        self.failed_batches = 0
+        self.retried_flushes = 0
+        self.dropped_rows = 0
+        self.last_flush_seconds = 0.0
+        self.max_flush_seconds = 0.0
+        self.total_flush_seconds = 0.0
+        # Time to write a batch, retries included.
+        self.flush_duration = Histogram()
+
+    @property
+    def is_running(self) -> bool:
+        return self._task is not None and not self._task.done()
+
+    async def start(self) -> None:
+        self._queue = asyncio.Queue(maxsize=self.max_size)
+        self._task = asyncio.create_task(self._run())
+        logger.info("GPT app session write-behind buffer started")
+
+    async def stop(self) -> None:
+        if not self.is_running:
+            return
+        # The sentinel queues behind every pending row, so they all get flushed.
+        await self._queue.put(None)
+        await self._task
+        logger.info(
+            f"GPT app session write-behind buffer stopped after flushing {self.flushed_rows} rows"
+        )
+
+    async def put(
+        self, gpt_application_id: int, email: str, name: str, created_at: datetime
+    ) -> None:
+        row = {
+            "gpt_application_id": gpt_application_id,
+            "email": email,
+            "name": name,
+            "created_at": created_at,
+        }
+        # Rows queued with no flush task running would never be written.
+        if not self.is_running:
+            raise RuntimeError("GPT app session buffer is not started")
+        try:
+            await asyncio.wait_for(self._queue.put(row), self.put_timeout)
+        except asyncio.TimeoutError:
+            raise SessionBufferFullError("GPT app session buffer is full")
+        self.enqueued_rows += 1
+
+    async def _run(self) -> None:
+        loop = asyncio.get_running_loop()
+        stopping = False
+        while not stopping:
+            row = await self._queue.get()
+            if row is None:
+                break
+            rows = [row]
+            deadline = loop.time() + self.flush_interval
+            while len(rows) < self.batch_size:
+                timeout = deadline - loop.time()
+                if timeout <= 0:
+                    break
+                try:
+                    row = await asyncio.wait_for(self._queue.get(), timeout)
+                except asyncio.TimeoutError:
+                    break
+                if row is None:
+                    stopping = True
+                    break
+                rows.append(row)
+            await self._flush(rows)
+
+    async def _flush(self, rows: list[dict]) -> None:
+        started_at = time.perf_counter()
+        for attempt, retry_delay in enumerate((*FLUSH_RETRY_DELAYS, None)):
+            try:
+                await self._write(rows)
+                break
+            except Exception as exc:
+                if retry_delay is None:
+                    self.failed_batches += 1
+                    self.dropped_rows += len(rows)
+                    logger.error(
+                        f"Dropping {len(rows)} GPT app sessions after {attempt + 1} failed flushes: {exc}",
+                        exc_info=True,
+                    )
+                    return
+                self.retried_flushes += 1
+                logger.warning(
+                    f"Failed flushing {len(rows)} GPT app sessions, retrying in {retry_delay}s: {exc}"
+                )
+                await asyncio.sleep(retry_delay)
+
+        flush_seconds = time.perf_counter() - started_at
+        self.flushed_rows += len(rows)
+        self.flushed_batches += 1
+        self.last_flush_seconds = flush_seconds
+        self.max_flush_seconds = max(self.max_flush_seconds, flush_seconds)
+        self.total_flush_seconds += flush_seconds
+        self.flush_duration.observe(flush_seconds)
+
+    async def _write(self, rows: list[dict]) -> None:
+        async with self._session_factory() as session:
+            await session.execute(insert(GPTAppSession).values(rows))
+            counts = Counter(row["gpt_application_id"] for row in rows)
+            # Fixed order so concurrent flushes from other workers can't deadlock.
+            for gpt_application_id, count in sorted(counts.items()):
+                await increment_session_count(session, gpt_application_id, count)
+            await update_session_rollups(session, rows)
+            await session.commit()
+
+    def stats(self) -> SessionBufferStats:
+        return SessionBufferStats(
+            queue_depth=self._queue.qsize() if self._queue else 0,
+            max_size=self.max_size,
+            enqueued_rows=self.enqueued_rows,
+            flushed_rows=self.flushed_rows,
+            flushed_batches=self.flushed_batches,
+            failed_batches=self.failed_batches,
+            retried_flushes=self.retried_flushes,
+            dropped_rows=self.dropped_rows,
+            last_flush_seconds=self.last_flush_seconds,
+            max_flush_seconds=self.max_flush_seconds,
+            total_flush_seconds=self.total_flush_seconds,
+        )
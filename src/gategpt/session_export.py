@@ -0,0 +1,95 @@
+"""
+Streaming CSV / NDJSON export of GPT app sessions.
+
+Rows are read through a server-side cursor, EXPORT_BATCH_SIZE at a time, and
+each batch is encoded and sent before the next one is fetched, so memory stays
+flat however many sessions are exported.
+"""
+import csv
+import io
+import json
+import zlib
+from enum import Enum
+from typing import AsyncIterator, Callable, Sequence
+
+from sqlalchemy import Row, Select
+from sqlalchemy.ext.asyncio import AsyncSession
+
+EXPORT_BATCH_SIZE = 1000
+EXPORT_COLUMNS = ["gpt_application_id", "email", "name", "created_at"]
+
+
+class SessionExportFormat(Enum):
+    CSV = "csv"
+    NDJSON = "ndjson"
+
+    @property
+    def media_type(self) -> str:
+        return {
+            SessionExportFormat.CSV: "text/csv",
+            SessionExportFormat.NDJSON: "application/x-ndjson",
+        }[self]
+
+
+def _encode_csv(rows: Sequence[Row], header: bool) -> bytes:
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    if header:
+        writer.writerow(EXPORT_COLUMNS)
+    writer.writerows(
+        (row.uuid, row.email, row.name, row.created_at.isoformat()) for row in rows
+    )
+    return buffer.getvalue().encode("utf-8")
+
+
+def _encode_ndjson(rows: Sequence[Row], header: bool) -> bytes:
+    return "".join(
+        json.dumps(
+            {
+                "gpt_application_id": row.uuid,
+                "email": row.email,
+                "name": row.name,
+                "created_at": row.created_at.isoformat(),
+            }
+        )
+        + "\n"
+        for row in rows
+    ).encode("utf-8")
+
+
+async def stream_sessions(
+    session_factory: Callable[[], AsyncSession],
+    query: Select,
+    export_format: SessionExportFormat,
+    gzip: bool = False,
+) -> AsyncIterator[bytes]:
+    """
+    Yield the rows of `query`, which must select uuid, email, name and
+    created_at, encoded in `export_format` and optionally gzipped.
+
+    The export uses its own database session, held for as long as the client
+    keeps reading.
+    """
+    encode = _encode_csv if export_format == SessionExportFormat.CSV else _encode_ndjson
+    # wbits=31 writes a gzip header and trailer around the deflate stream.
+    compressor = zlib.compressobj(wbits=31) if gzip else None
+    header = True
+
+    async with session_factory() as session:
+        result = await session.stream(
+            query.execution_options(yield_per=EXPORT_BATCH_SIZE)
+        )
+        async for rows in result.partitions():
+            chunk = encode(rows, header)
+            header = False
+            if compressor:
+                chunk = compressor.compress(chunk)
+            if chunk:
+                yield chunk
+
+    if header and export_format == SessionExportFormat.CSV:
+        # No rows, still send the header.
+        chunk = _encode_csv([], header=True)
+        yield compressor.compress(chunk) if compressor else chunk
+    if compressor:
+        yield compressor.flush()
@@ -0,0 +1,161 @@
+"""
+Per-request SQL statistics.
+
+`instrument_engine` hooks an engine's cursor execute events and adds every
+statement's count and time to the RequestSQLStats of the request it ran in, which
+SQLStatsMiddleware keeps in a context variable. SQLAlchemy's async engine runs
+the events in a greenlet that shares the calling task's context, so statements
+are attributed to the right request however many run concurrently.
+
+At the end of a request the totals are added to the per-route metrics, and
+statements executed `n_plus_one_threshold` or more times with identical SQL are
+logged as a likely N+1. With `debug_headers` the totals are also sent as
+X-DB-Query-Count and Server-Timing response headers; those only cover statements
+run before the response starts, not ones run while a streaming response is sent.
+
+Statements slower than `slow_query_threshold` are logged as they finish, with the
+route they ran for or "background" outside of a request.
+"""
+from contextvars import ContextVar
+from datetime import timedelta
+import logging
+import time
+from typing import Optional
+
+from sqlalchemy import Engine, event
+from starlette.datastructures import MutableHeaders
+from starlette.types import ASGIApp, Message, Receive, Scope, Send
+
+from gategpt.metrics import HTTPMetrics, RouteTemplates
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_N_PLUS_ONE_THRESHOLD = 3
+BACKGROUND_ROUTE = "background"
+# Longer statements are cut short in log lines.
+LOGGED_STATEMENT_LENGTH = 500
+
+
+class RequestSQLStats:
+    def __init__(self, scope: Scope, route_templates: RouteTemplates) -> None:
+        self.method: str = scope["method"]
+        self.queries = 0
+        self.duration = 0.0
+        # SQL text -> times executed. Compiled statements are cached, so repeated
+        # statements are usually the same str object and hash for free.
+        self.statements: dict[str, int] = {}
+        self._scope = scope
+        self._route_templates = route_templates
+
+    @property
+    def route(self) -> str:
+        return self._route_templates(self._scope)
+
+    def record(self, statement: str, duration: float) -> None:
+        self.queries += 1
+        self.duration += duration
+        self.statements[statement] = self.statements.get(statement, 0) + 1
+
+    def repeated(self, threshold: int) -> list[tuple[str, int]]:
+        return [
+            (statement, count)
+            for statement, count in self.statements.items()
+            if count >= threshold
+        ]
+
+
+current_sql_stats: ContextVar[Optional[RequestSQLStats]] = ContextVar(
+    "current_sql_stats", default=None
+)
+
+
+def _shorten(statement: str) -> str:
+    statement = " ".join(statement.split())
+    if len(statement) > LOGGED_STATEMENT_LENGTH:
+        return statement[:LOGGED_STATEMENT_LENGTH] + "..."
+    return statement
+
+
+def instrument_engine(engine: Engine, slow_query_threshold: timedelta) -> None:
+    """
+    Record every statement `engine` executes. Pass an AsyncEngine's `sync_engine`.
+    Call it once per engine.
+    """
+    threshold = slow_query_threshold.total_seconds()
+
+    def before_cursor_execute(
+        conn, cursor, statement, parameters, context, executemany
+    ):
+        context._sql_stats_started_at = time.perf_counter()
+
+    def after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+        duration = time.perf_counter() - context._sql_stats_started_at
+        stats = current_sql_stats.get()
+        if stats is not None:
+            stats.record(statement, duration)
+        if duration >= threshold:
+            route = (
+                f"{stats.method} {stats.route}"
+                if stats is not None
+                else BACKGROUND_ROUTE
+            )
+            logger.warning(
+                f"Slow query in {route} took {duration * 1000:.1f}ms: "
+                f"{_shorten(statement)}"
+            )
+
+    event.listen(engine, "before_cursor_execute", before_cursor_execute)
+    event.listen(engine, "after_cursor_execute", after_cursor_execute)
+
+
+class SQLStatsMiddleware:
+    def __init__(
+        self,
+        app: ASGIApp,
+        metrics: HTTPMetrics,
+        n_plus_one_threshold: int = DEFAULT_N_PLUS_ONE_THRESHOLD,
+        debug_headers: bool = False,
+    ) -> None:
+        self.app = app
+        self.metrics = metrics
+        self.n_plus_one_threshold = n_plus_one_threshold
+        self.debug_headers = debug_headers
+        self._route = RouteTemplates()
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send) -> None:
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        stats = RequestSQLStats(scope, self._route)
+
+        async def send_with_stats(message: Message) -> None:
+            if message["type"] == "http.response.start" and self.debug_headers:
+                headers = MutableHeaders(scope=message)
+                headers["X-DB-Query-Count"] = str(stats.queries)
+                headers.append(
+                    "Server-Timing",
+                    f'db;dur={stats.duration * 1000:.1f};desc="{stats.queries} queries"',
+                )
+            await send(message)
+
+        token = current_sql_stats.set(stats)
+        try:
+            await self.app(scope, receive, send_with_stats)
+        finally:
+            current_sql_stats.reset(token)
+            self._finish(stats)
+
+    def _finish(self, stats: RequestSQLStats) -> None:
+        route = stats.route
+        self.metrics.observe_db(stats.method, route, stats.queries, stats.duration)
+        for statement, count in stats.repeated(self.n_plus_one_threshold):
+            logger.warning(
+                f"Possible N+1 in {stats.method} {route}: statement executed "
+                f"{count} times: {_shorten(statement)}"
+            )
+        if stats.queries:
+            logger.debug(
+                f"{stats.method} {route}: {stats.queries} queries in "
+                f"{stats.duration * 1000:.1f}ms"
+            )
@@ -4,13 +4,11 @@ let mainDiv = document.getElementById("orders-all");
 let tableTitle = document.getElementById("title");
 let paginateNav = document.getElementById("app-pagination");
 
-let currentOffset = 0;
-let OFFEST_VAL = 20;
+let PAGE_SIZE = 20;
 let paginateUl = paginateNav.children[0];
-let navOffset = 1;
+let currentPage = 1;
+let currentCursor = null;
 let totalCount;
-let previous;
-let next;
 
 let fullPath = new URL(window.location.href);
 let pathSegments = fullPath.pathname.split("/");
@@ -19,175 +17,66 @@ let gptApplicationId = pathSegments[pathSegments.length - 3];
 
 fullPath = `/api/v1${fullPath.pathname}`;
 
-async function increasePagination() {
-  while (paginateUl.childNodes.length > 3) {
-    paginateUl.removeChild(paginateUl.childNodes[1]);
-  }
-  for (let i = 0, value = currentOffset + 2; i < 5; i++, value = value + 1) {
-    let listItem = document.createElement("li");
-    listItem.classList.add("page-item");
-
-    let input = document.createElement("input");
-    input.setAttribute("value", value);
-    input.setAttribute("type", "button");
-    input.classList.add("page-link");
-    input.addEventListener("click", (e) => handlePaginationUI(e.target));
-
-    listItem.appendChild(input);
-    paginateUl.insertBefore(listItem, next.parentNode);
-    if (value * OFFEST_VAL > totalCount) break;
-  }
-  navOffset = 1;
-}
-
-async function decreasePagination() {
-  while (paginateUl.childNodes.length > 3) {
-    paginateUl.removeChild(paginateUl.childNodes[2]);
-  }
-  let elemn = paginateUl.childNodes[1];
-  for (let i = 0, value = currentOffset - 3; i < 4; i++, value = value + 1) {
-    let listItem = document.createElement("li");
-    listItem.classList.add("page-item");
-
-    let input = document.createElement("input");
-    input.setAttribute("value", value);
-    input.setAttribute("type", "button");
-    input.classList.add("page-link");
-    input.addEventListener("click", (e) => handlePaginationUI(e.target));
-
-    listItem.appendChild(input);
-    paginateUl.insertBefore(listItem, elemn);
-  }
-  navOffset = 5;
-}
-async function handlePaginationUI(e) {
-  paginateUl.childNodes.forEach((li) => {
-    let input = li.querySelector("input");
-    if (input && !parseInt(input.value)) return;
-    li.classList.remove("active");
-  });
-  if (e.value !== "Previous" || e.target.value !== "Next") {
-    e.parentNode.classList.add("active");
-  }
-
-  for (let i = 1; i <= 5; i++) {
-    let li = paginateUl.children[i];
-    if (li.classList.contains("active")) {
-      navOffset = i;
-      break;
-    }
-  }
-  currentOffset = parseInt(e.value) - 1;
-  if (
-    currentOffset >= 4 &&
-    currentOffset * OFFEST_VAL < totalCount &&
-    navOffset == 5
-  ) {
-    increasePagination();
-  }
-  if (currentOffset >= 4 && navOffset == 1) {
-    decreasePagination();
-  }
-  await apiSearch();
-}
-
-function addPaginationUI(data) {
-  if (!data.items.length > 0) return;
-
-  while (paginateUl.childNodes.length) {
-    paginateUl.removeChild(paginateUl.childNodes[0]);
-  }
-
+function createPaginationItem(label, cursor, pageDelta) {
   let li = document.createElement("li");
   li.className = "page-item";
-  if (currentOffset == 0) {
-    li.classList.add("disabled");
-  }
-  li.id = "previous-button";
 
   let input = document.createElement("input");
   input.type = "button";
-  input.value = "Previous";
+  input.value = label;
   input.className = "page-link";
-  input.tabIndex = -1;
-  input.setAttribute("disabled", "true");
-  previous = input;
 
-  li.appendChild(input);
-
-  paginateUl.appendChild(li);
-  for (let i = 0; i < 5 && i * OFFEST_VAL < data.total_count; i++) {
-    if (i * 20 > totalCount) break;
-    let listItem = document.createElement("li");
-    listItem.classList.add("page-item");
-
-    let input = document.createElement("input");
-    input.setAttribute("value", i + 1);
-    input.setAttribute("type", "button");
-    input.classList.add("page-link");
-
-    if (i == navOffset - 1) {
-      listItem.classList.add("active");
-    }
-
-    listItem.appendChild(input);
-
-    paginateUl.appendChild(listItem);
-  }
-  li = document.createElement("li");
-  li.className = "page-item";
-
-  input = document.createElement("input");
-  input.type = "button";
-  input.value = "Next";
-  input.className = "page-link";
-
-  console.log(paginateUl.children.length, currentOffset * 20);
-  if (currentOffset * OFFEST_VAL > totalCount) {
+  if (!cursor) {
     li.classList.add("disabled");
     input.setAttribute("disabled", "true");
+    input.tabIndex = -1;
+  } else {
+    input.addEventListener("click", async () => {
+      currentCursor = cursor;
+      currentPage += pageDelta;
+      await apiSearch();
+    });
   }
 
-  next = input;
-
   li.appendChild(input);
+  return li;
+}
+
+function addPaginationUI(data) {
+  while (paginateUl.childNodes.length) {
+    paginateUl.removeChild(paginateUl.childNodes[0]);
+  }
+  if (!data.items.length > 0) return;
 
+  paginateUl.appendChild(
+    createPaginationItem("Previous", data.prev_cursor, -1),
+  );
+
+  let li = document.createElement("li");
+  li.className = "page-item active";
+  let span = document.createElement("span");
+  span.className = "page-link";
+  let totalPages = Math.max(1, Math.ceil(totalCount / PAGE_SIZE));
+  span.textContent = `${currentPage} of ${totalPages}`;
+  li.appendChild(span);
   paginateUl.appendChild(li);
-  paginateUl.childNodes.forEach((element) => {
-    element.addEventListener("click", async (e) => {
-      let toClick;
-      if (e.target.children.length) {
-        if (e.target.children[0].getAttribute("disabled") === "true") {
-          return;
-        }
-      }
-      if (e.target.value === "Next") {
-        if (navOffset < paginateUl.children.length - 2) {
-          ++navOffset;
-        }
-        toClick = paginateUl.children[navOffset].children[0];
-      } else if (e.target.value == "Previous") {
-        if (navOffset !== 1) {
-          --navOffset;
-        }
-        toClick = paginateUl.children[navOffset].children[0];
-      } else {
-        toClick = e.target;
-      }
-      handlePaginationUI(toClick);
-    });
-  });
+
+  paginateUl.appendChild(createPaginationItem("Next", data.next_cursor, 1));
 }
 
 function getQueryParams() {
   let nameEmail = document.getElementById("searchNameEmail").value;
   let startDate = document.getElementById("startDate").value;
   let endDate = document.getElementById("endDate").value;
+  let caseInsensitive = document.getElementById("caseInsensitive").checked;
 
   let queryParams = new URLSearchParams();
   if (nameEmail) {
     queryParams.append("name", nameEmail);
     queryParams.append("email", nameEmail);
+    if (caseInsensitive) {
+      queryParams.append("case_insensitive", "true");
+    }
   }
   if (startDate) {
     startDate = new Date(startDate).toISOString();
@@ -197,8 +86,9 @@ function getQueryParams() {
     endDate = new Date(endDate).toISOString();
     queryParams.append("end_datetime", endDate);
   }
-  if (currentOffset) {
-    queryParams.append("offset", currentOffset * 20);
+  queryParams.append("limit", PAGE_SIZE);
+  if (currentCursor) {
+    queryParams.append("cursor", currentCursor);
   }
   return queryParams;
 }
@@ -219,7 +109,7 @@ async function apiSearch() {
     }
     let data = await response.json();
     let items = data.items;
-    totalCount = items.total_count;
+    totalCount = data.total_count;
 
     let tableBody = table.getElementsByTagName("tbody");
     let tableRows = table.getElementsByTagName("tr");
@@ -252,6 +142,8 @@ async function apiSearch() {
 
 searchBtn.addEventListener("click", async (e) => {
   e.preventDefault();
+  currentCursor = null;
+  currentPage = 1;
   await apiSearch();
 });
 